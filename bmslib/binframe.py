@@ -0,0 +1,124 @@
+"""
+Compact fixed-layout binary frame of a BMS sample, published to `{device_topic}/bin` (`mqtt_binary` option).
+
+A high-rate consumer subscribes to one topic instead of reassembling ~40 text topics. The layout (v1, little
+endian) is described by a JSON schema published retained to `{device_topic}/bin/schema`:
+
+    header  <BBBBIHfffHH   version, num_cells, num_temps, num_switches, ts seconds, ts millis,
+                          voltage V, current A, power W, soc 0.01 %, switch bitmap
+    temps   <h * num_temps   0.1 °C, -32768 = n/a
+    cells   <H * num_cells   mV, 65535 = n/a
+
+A 16s pack with 4 temperature sensors is 66 bytes. Floats carry nan for missing values. Switch bit i is the
+i-th name in the schema `switches` list (1 = on), only the first 16 switch names (sorted) fit into the bitmap.
+"""
+import math
+import struct
+from typing import List, Optional
+
+VERSION = 1
+
+_HEADER = struct.Struct('<BBBBIHfffHH')
+_TEMP_NA = -32768
+_CELL_NA = 0xFFFF
+_SOC_NA = 0xFFFF
+MAX_SWITCHES = 16
+
+
+def _scaled(v, scale, lo, hi, na):
+    if v is None or (isinstance(v, float) and not math.isfinite(v)):
+        return na
+    return min(max(int(round(v * scale)), lo), hi)
+
+
+def schema(num_cells: int, num_temps: int, switches: List[str]) -> dict:
+    return {
+        "version": VERSION,
+        "byteorder": "little",
+        "header": {
+            "format": _HEADER.format,
+            "fields": ["version", "num_cells", "num_temps", "num_switches", "ts_s", "ts_ms",
+                       "voltage", "current", "power", "soc", "switches"],
+            "scale": {"soc": 0.01},
+            "na": {"soc": _SOC_NA},
+        },
+        "temperatures": {"format": "h", "count": num_temps, "scale": 0.1, "na": _TEMP_NA},
+        "cell_voltages": {"format": "H", "count": num_cells, "scale": 0.001, "na": _CELL_NA},
+        "switches": list(switches),
+    }
+
+
+class BinaryFrameEncoder:
+    """
+    Encodes samples of one device. `encode` returns the schema along with the frame when the layout (cell, temp
+    or switch count) changed, so the caller can republish it. It keeps returning it until the caller confirms the
+    publish with `schema_published()`.
+    """
+
+    def __init__(self):
+        self._layout = None  # layout of the last published schema
+        self._pending = None
+
+    def encode(self, sample, voltages: Optional[List[int]]):
+        """
+        :param sample: BmsSample
+        :param voltages: cell voltages in mV
+        :return: (frame bytes, schema dict or None if unchanged)
+        :raises ValueError: more than 255 cells or temperatures
+        """
+        temps = sample.temperatures or []
+        voltages = voltages or []
+        switches = sorted(sample.switches.keys())[:MAX_SWITCHES] if sample.switches else []
+        if len(voltages) > 255 or len(temps) > 255:
+            raise ValueError('sample exceeds frame layout (%d cells, %d temps)' % (len(voltages), len(temps)))
+
+        bitmap = 0
+        for i, name in enumerate(switches):
+            if sample.switches[name]:
+                bitmap |= 1 << i
+
+        ts = sample.timestamp or 0.
+        ts_s = int(ts)
+        frame = _HEADER.pack(VERSION, len(voltages), len(temps), len(switches),
+                             ts_s, min(int(round((ts - ts_s) * 1000)), 999),
+                             sample.voltage, sample.current, sample.power,
+                             _scaled(sample.soc, 100, 0, 0xFFFE, _SOC_NA), bitmap)
+        frame += struct.pack('<%dh%dH' % (len(temps), len(voltages)),
+                             *(_scaled(t, 10, -32767, 32767, _TEMP_NA) for t in temps),
+                             *(_scaled(v, 1, 0, 0xFFFE, _CELL_NA) for v in voltages))
+
+        layout = (len(voltages), len(temps), tuple(switches))
+        if layout == self._layout:
+            return frame, None
+        self._pending = layout
+        return frame, schema(len(voltages), len(temps), switches)
+
+    def schema_published(self):
+        self._layout = self._pending
+
+
+def decode(frame: bytes) -> dict:
+    """
+    Decode a frame into a dict with keys of the schema header fields plus `timestamp`, `temperatures`,
+    `cell_voltages` (V) and `switch_bits`. Missing values are nan.
+    """
+    if not frame or frame[0] != VERSION:
+        raise ValueError('unsupported frame version %s' % (frame[0] if frame else None))
+    (version, num_cells, num_temps, num_switches, ts_s, ts_ms,
+     voltage, current, power, soc, bitmap) = _HEADER.unpack_from(frame)
+    expected = _HEADER.size + 2 * (num_temps + num_cells)
+    if len(frame) != expected:
+        raise ValueError('frame length %d != %d' % (len(frame), expected))
+
+    body = struct.unpack_from('<%dh%dH' % (num_temps, num_cells), frame, _HEADER.size)
+    return dict(
+        version=version,
+        timestamp=ts_s + ts_ms / 1000,
+        voltage=voltage,
+        current=current,
+        power=power,
+        soc=math.nan if soc == _SOC_NA else soc / 100,
+        temperatures=[math.nan if t == _TEMP_NA else t / 10 for t in body[:num_temps]],
+        cell_voltages=[math.nan if v == _CELL_NA else v / 1000 for v in body[num_temps:]],
+        switch_bits=[bool(bitmap >> i & 1) for i in range(num_switches)],
+    )
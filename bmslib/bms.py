@@ -1,8 +1,9 @@
 import math
 import time
-from copy import copy
 from typing import List, Dict, Optional
 
+from bmslib.fields import SAMPLE_FIELDS
+
 MIN_VALUE_EXPIRY = 20
 
 
@@ -32,6 +33,10 @@ class PowerMonitorSample:
 
 
 class BmsSample:
+    # A sample is allocated (and copied) a few times per fetch and device, slots keep that cheap. The fields are
+    # declared in bmslib.fields, setting an attribute not in SAMPLE_FIELDS raises AttributeError.
+    __slots__ = SAMPLE_FIELDS
+
     def __init__(self, voltage, current, power=math.nan,
                  charge=math.nan, capacity=math.nan, total_charge_throughput=math.nan,
                  num_cycles=math.nan, soc=math.nan,
@@ -136,8 +141,7 @@ class BmsSample:
         """
         return (self.voltage * self.current) if math.isnan(self._power) else self._power
 
-    def values(self):
-        return {**self.__dict__, "power": self.power}
+    # values() and __copy__() are generated from SAMPLE_FIELDS, see _compile_sample_methods()
 
     def __str__(self):
         # noinspection PyStringFormat
@@ -154,9 +158,28 @@ class BmsSample:
         return self.multiply_current(-1)
 
     def multiply_current(self, x):
-        res = copy(self)
+        res = self.__copy__()
         if res.current != 0:  # prevent -0 values
             res.current *= x
         if not math.isnan(res._power) and res._power != 0:
             res._power *= x
         return res
+
+
+def _compile_sample_methods():
+    """ straight-line values() and __copy__() over SAMPLE_FIELDS, several times faster than a loop """
+    src = ('def values(self):\n'
+           '    return {%s, "power": self.power}\n'
+           '\n'
+           'def __copy__(self):\n'
+           '    res = _new(type(self))\n'
+           '%s'
+           '    return res\n') % (', '.join('"%s": self.%s' % (f, f) for f in SAMPLE_FIELDS),
+                                   ''.join('    res.%s = self.%s\n' % (f, f) for f in SAMPLE_FIELDS))
+    ns = dict(_new=object.__new__)
+    exec(compile(src, '<BmsSample>', 'exec'), ns)
+    BmsSample.values = ns['values']
+    BmsSample.__copy__ = ns['__copy__']
+
+
+_compile_sample_methods()
@@ -398,6 +398,10 @@ class BtBms:
             from bmslib.models.dummy import BleakDummyClient
             self.client = BleakDummyClient(address, disconnected_callback=self._on_disconnect)
             self._adapter = "fake"
+        elif address.startswith('replay:'):
+            from bmslib.models.dummy import BleakReplayClient
+            self.client = BleakReplayClient(address, disconnected_callback=self._on_disconnect)
+            self._adapter = "fake"
         else:
 
             if psk:
@@ -427,6 +431,11 @@ class BtBms:
             """
             self._pending_disconnect_call = False
 
+        from bmslib.recorder import get_recorder, RecordingClient
+        recorder = get_recorder(name)
+        if recorder is not None and not address.startswith('replay:'):
+            self.client = RecordingClient(self.client, recorder)
+
     @property
     def slug(self):
         return type(self).__name__.lower()
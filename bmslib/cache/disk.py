@@ -1,12 +1,24 @@
-from typing import Callable
-
-import pandas as pd
-
+"""
+Disk cache: pickled return values in files below `cache_dir`, bounded in total size and age.
+
+An index file (index.json) keeps size, last access and write time of each entry, so eviction needs no directory
+scan. All decorators writing to a directory share one store (`get_store`), so they share its index and size limit.
+Beyond `max_bytes` the least recently used entries are removed, entries older than `max_age` are never returned.
+Files and the index are written atomically (temp file + rename). The index is rebuilt from the files if it is
+missing or damaged.
+
+pandas is not imported here: unpickling a DataFrame imports it, so only processes that actually cache DataFrames
+pay its startup time and memory.
+"""
+import hashlib
+import json
 import os
 import pickle
-import random
-import string
+import threading
+import time
+import zlib
 from functools import wraps
+from typing import Dict, List, Optional
 
 from bmslib.cache import to_hashable, random_str
 from bmslib.util import get_logger
@@ -15,7 +27,8 @@ cache_dir = os.path.expanduser('~') + "/.cache/batmon"
 
 logger = get_logger()
 
-
+INDEX_FILE = 'index.json'
+_ZLIB_MAGIC = b'BZ1\n'  # compressed entry
 
 
 def touch(fname, times=None):
@@ -34,64 +47,180 @@ def mkdir_p(path):
             raise
 
 
-def _get_fn(key, ext):
-    path = cache_dir + "/" + key + "." + ext
-    path = os.path.realpath(path)
-    dn = os.path.dirname(path)
-    # noinspection PyBroadException
-    try:
-        if not os.path.isdir(dn):
-            mkdir_p(dn)
-    except:
-        pass
-    return path
+_stores: Dict[str, 'PickleFileStore'] = {}
+_stores_lock = threading.Lock()
+
+
+def _atomic_write(path, data: bytes):
+    tmp = f'{path}.{random_str(6)}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, path)
 
 
 class PickleFileStore:
-    def __init__(self):
-        pass
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024, max_age=30 * 86400, compress=False):
+        """
+        :param max_bytes: total size of the entries, least recently used are evicted beyond
+        :param max_age: seconds after writing an entry is stale
+        :param compress: zlib-compress entries
+        """
+        self.directory = directory or cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.time = time.time
+        self._index: Optional[Dict[str, List[float]]] = None  # key -> [size, atime, mtime]
+        self._dirty = False
+        self._lock = threading.RLock()  # shared by the decorators of the directory, see get_store
+
+    def _path(self, key):
+        path = os.path.realpath(os.path.join(self.directory, key + '.pickle'))
+        if not path.startswith(os.path.realpath(self.directory) + os.sep):
+            raise ValueError('cache key %r outside the cache directory' % key)
+        return path
+
+    @property
+    def index(self) -> Dict[str, List[float]]:
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as fh:
+                return {k: list(v) for k, v in json.load(fh)['entries'].items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning('disk cache index damaged (%s), rebuilding', e)
+        index = {}
+        for root, _, files in os.walk(self.directory):
+            for fn in files:
+                if fn.endswith('.pickle'):
+                    path = os.path.join(root, fn)
+                    st = os.stat(path)
+                    index[os.path.relpath(path, self.directory)[:-len('.pickle')]] = [st.st_size, st.st_atime,
+                                                                                      st.st_mtime]
+        self._dirty = bool(index)
+        return index
+
+    def save_index(self):
+        if not self._dirty:
+            return
+        mkdir_p(self.directory)
+        _atomic_write(os.path.join(self.directory, INDEX_FILE),
+                      json.dumps(dict(version=1, entries=self._index), separators=(',', ':')).encode())
+        self._dirty = False
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        self._dirty = True
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
 
-    # noinspection PyMethodMayBeStatic
     def read(self, key):
-        # noinspection PyBroadException
-        try:
-            fn = _get_fn(key, ext='pickle')
-            with open(fn, 'rb') as fh:
-                ret = pickle.load(fh)
-            touch(fn)
+        with self._lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            now = self.time()
+            if now - entry[2] > self.max_age:
+                self._remove(key)
+                self.save_index()
+                return None
+            # noinspection PyBroadException
+            try:
+                with open(self._path(key), 'rb') as fh:
+                    data = fh.read()
+                if data.startswith(_ZLIB_MAGIC):
+                    data = zlib.decompress(data[len(_ZLIB_MAGIC):])
+                ret = pickle.loads(data)
+            except Exception as e:
+                logger.warning('disk cache: dropping unreadable %s: %s', key, e)
+                self._remove(key)
+                self.save_index()
+                return None
+            entry[1] = now  # LRU, persisted with the next write
+            self._dirty = True
             return ret
-        except:
-            return None
 
-    # noinspection PyMethodMayBeStatic
-    def write(self, key, df):
-        fn = _get_fn(key, ext='pickle')
-        s = f'.{random_str(6)}.tmp'
-        with open(fn + s, 'wb') as fh:
-            pickle.dump(df, fh, pickle.HIGHEST_PROTOCOL)
-        os.replace(fn + s, fn)
-        # _set_df_file_store_mtime(fn, df)
+    def write(self, key, obj, compress: Optional[bool] = None):
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if self.compress if compress is None else compress:
+            data = _ZLIB_MAGIC + zlib.compress(data, 6)
+        with self._lock:
+            path = self._path(key)
+            mkdir_p(os.path.dirname(path))
+            _atomic_write(path, data)
+            now = self.time()
+            self.index[key] = [len(data), now, now]
+            self._dirty = True
+            self.evict(now)
+            self.save_index()
+
+    def evict(self, now=None):
+        """ remove stale entries and the least recently used beyond max_bytes """
+        now = now or self.time()
+        index = self.index
+        for key in [k for k, (_, _, mtime) in index.items() if now - mtime > self.max_age]:
+            self._remove(key)
+        total = sum(e[0] for e in index.values())
+        if total > self.max_bytes:
+            for key in sorted(index, key=lambda k: index[k][1]):
+                if total <= self.max_bytes:
+                    break
+                total -= index[key][0]
+                self._remove(key)
+
+    def size(self):
+        return sum(e[0] for e in self.index.values())
+
+
+def get_store(directory=None, max_bytes=256 * 1024 * 1024, max_age=30 * 86400) -> PickleFileStore:
+    """
+    The store of `directory`, created on first use. Each directory has one index, so two stores on the same directory
+    would overwrite each other's entries in it. The limits are the tightest requested for the directory.
+    """
+    directory = directory or cache_dir
+    with _stores_lock:
+        store = _stores.get(os.path.realpath(directory))
+        if store is None:
+            store = _stores[os.path.realpath(directory)] = PickleFileStore(directory, max_bytes, max_age)
+        else:
+            store.max_bytes = min(store.max_bytes, max_bytes)
+            store.max_age = min(store.max_age, max_age)
+        return store
 
 
 def func_args_hash_func(target):
-    import hashlib
     import inspect
     mod = inspect.getmodule(target)
     path_hash = hashlib.sha224(bytes(mod.__file__, 'utf-8')).hexdigest()[:4]
 
     def _cache_key(args, kwargs):
         cache_key_obj = (to_hashable(args), to_hashable(kwargs))
-        cache_key_hash = hashlib.sha224(bytes(str(cache_key_obj), 'utf-8')).hexdigest()
-        return path_hash, cache_key_hash
+        try:
+            # pickle tells 1 and '1' apart and has no memory addresses in it, unlike str()
+            key_bytes = pickle.dumps(cache_key_obj, 4)
+        except Exception:
+            key_bytes = repr(cache_key_obj).encode('utf-8')
+        return path_hash, hashlib.sha224(key_bytes).hexdigest()
 
     return _cache_key
 
 
-def disk_cache_deco(ignore_kwargs=None):
+def disk_cache_deco(ignore_kwargs=None, compress=False, **store_kwargs):
+    """
+    :param compress: zlib-compress the entries of this function
+    :param store_kwargs: directory, max_bytes, max_age (see get_store)
+    """
     if ignore_kwargs is None:
         ignore_kwargs = set()
 
-    disk_cache = PickleFileStore()
+    disk_cache = get_store(**store_kwargs)
 
     def decorate(target, hash_func_gen=func_args_hash_func):
         import inspect
@@ -112,7 +241,7 @@ def disk_cache_deco(ignore_kwargs=None):
             try:
                 ret = target(*args, **kwargs)
                 try:
-                    disk_cache.write(cache_key_str, ret)
+                    disk_cache.write(cache_key_str, ret, compress=compress)
                     logger.info("wrote %s", cache_key_str)
                 except Exception as _e:
                     logger.warning('Fall-back cache: error storing: %s', _e, exc_info=1)
@@ -123,8 +252,7 @@ def disk_cache_deco(ignore_kwargs=None):
 
             return ret
 
+        _fallback_cache_wrapper.cache = disk_cache
         return _fallback_cache_wrapper
 
     return decorate
-
-
@@ -1,7 +1,9 @@
+import asyncio
 import inspect
+import threading
 import time
-from asyncio import Lock
-from functools import wraps
+from collections import OrderedDict
+from functools import partial, wraps
 from typing import Callable
 
 from bmslib.cache import to_hashable
@@ -9,8 +11,13 @@ from bmslib.util import get_logger
 
 logger = get_logger()
 
+# DictCacheStorage.stats() keys
+CACHE_STATS = ('entries', 'hits', 'misses', 'hit_percent', 'evictions', 'expirations')
+
 
 class MemoryCacheStorage:
+    time = staticmethod(time.time)
+
     def get(self, key):
         raise NotImplementedError()
 
@@ -28,32 +35,84 @@ class MemoryCacheStorage:
 
 
 class DictCacheStorage(MemoryCacheStorage):
-    def __init__(self):
-        self.d = dict()
+    """
+    Bounded TTL + LRU cache. An entry expires `ttl` seconds after it was set. Expired entries are dropped when
+    accessed and by a sweep of all entries at most every `sweep_interval` seconds (on set). Above `max_entries`
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_entries=1024, sweep_interval=60.):
+        self.d = OrderedDict()  # key -> (value, expires), least recently used first
         self.time = time.time
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._t_sweep = 0.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _live(self, key, now=None):
+        e = self.d.get(key)
+        if e is None:
+            return None
+        if e[1] < (now or self.time()):
+            del self.d[key]
+            self.expirations += 1
+            return None
+        return e
 
     def get(self, key):
-        if key not in self:
+        e = self._live(key)
+        if e is None:
+            self.misses += 1
             return None
-        return self.d[key][0]
+        self.hits += 1
+        self.d.move_to_end(key)
+        return e[0]
 
     def get_default(self, key, returns_default_value: Callable, ttl):
-        if key not in self:
+        e = self._live(key)
+        if e is None:
             return returns_default_value()
-        return self.d[key][0]
+        self.d.move_to_end(key)
+        return e[0]
 
     def set(self, key, value, ttl, ignore_overwrite):
-        if not ignore_overwrite and key in self:
+        now = self.time()
+        if not ignore_overwrite and self._live(key, now) is not None:
             logger.warning("overwrite key %s", key)
-        self.d[key] = value, (self.time() + ttl)
+        self.d[key] = value, (now + ttl)
+        self.d.move_to_end(key)
+        if now - self._t_sweep >= self.sweep_interval:
+            self.sweep(now)
+        while len(self.d) > self.max_entries:
+            self.d.popitem(last=False)
+            self.evictions += 1
+
+    def sweep(self, now=None):
+        """ drop all expired entries """
+        now = now or self.time()
+        self._t_sweep = now
+        expired = [k for k, (_, expires) in self.d.items() if expires < now]
+        for k in expired:
+            del self.d[k]
+        self.expirations += len(expired)
 
     def __delitem__(self, key):
         del self.d[key]
 
     def __contains__(self, key):
-        if key not in self.d:
-            return False
-        return self.d[key][1] >= self.time()
+        return self._live(key) is not None
+
+    def __len__(self):
+        return len(self.d)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return dict(entries=len(self.d), hits=self.hits, misses=self.misses,
+                    hit_percent=round(100 * self.hits / lookups, 1) if lookups else None,
+                    evictions=self.evictions, expirations=self.expirations)
 
 
 _managed_mem_cache = None
@@ -66,15 +125,37 @@ def shared_managed_mem_cache() -> DictCacheStorage:
     return _managed_mem_cache
 
 
+class _CachedError:
+    """ an exception cached for `error_ttl` (negative caching) """
+    __slots__ = ('exc',)
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class _Entry:
+    """ a value that is served stale after `fresh_until` while it is refreshed (stale-while-revalidate) """
+    __slots__ = ('value', 'fresh_until')
+
+    def __init__(self, value, fresh_until):
+        self.value = value
+        self.fresh_until = fresh_until
+
+
 def mem_cache_deco(ttl, touch=False, ignore_kwargs=None, synchronized=False, expired=None, ignore_rc=False,
                    cache_storage: MemoryCacheStorage = shared_managed_mem_cache(),
-                   key_func: Callable = None):
+                   key_func: Callable = None, stale_ttl=0, error_ttl=0):
     """
     Decorator
     :param touch: touch key time on hit
     :param ttl:
     :param ignore_kwargs: a set of keyword arguments to ignore when building the cache key
     :param expired Callable to evaluate whether the cached value has expired/invalidated
+    :param synchronized: threads calling with the same key wait for the first call instead of calling too.
+        Coroutines are always single-flight: concurrent callers on a miss share one in-flight call.
+    :param stale_ttl: coroutines only. for stale_ttl after ttl the old value is returned while one call refreshes it
+        in the background
+    :param error_ttl: cache exceptions for error_ttl seconds, calls within re-raise them without calling the target
     :return:
     """
 
@@ -83,7 +164,6 @@ def mem_cache_deco(ttl, touch=False, ignore_kwargs=None, synchronized=False, exp
 
     # ttl = pd.to_timedelta(ttl)
     _mem_cache = cache_storage
-    _lock_cache = shared_managed_mem_cache()
 
     def decorate(target):
 
@@ -101,54 +181,107 @@ def mem_cache_deco(ttl, touch=False, ignore_kwargs=None, synchronized=False, exp
         setattr(target, "invalidate", invalidate)
 
         is_coro = inspect.iscoroutinefunction(target)
+        assert is_coro or not stale_ttl, "stale-while-revalidate needs a coroutine"
 
-
-        @wraps(target)
-        def _inner_wrapper(cache_key_obj, args, kwargs):
+        def _lookup(cache_key_obj):
+            """ :return: (value, stale), value None on miss. raises a cached error """
             ret = _mem_cache.get(cache_key_obj)
-
-            if expired and ret is not None and expired(ret):
+            if ret is None:
+                return None, False
+            if isinstance(ret, _CachedError):
+                raise ret.exc
+            stale = False
+            if isinstance(ret, _Entry):
+                stale = _mem_cache.time() >= ret.fresh_until
+                ret = ret.value
+            if expired and expired(ret):
                 del _mem_cache[cache_key_obj]
-                ret = None
+                return None, False
+            if touch and not stale:
+                _store(cache_key_obj, ret, overwrite=True)
+            return ret, stale
 
+        def _store(cache_key_obj, ret, overwrite=ignore_rc):
             if ret is None:
-                ret = target(*args, **kwargs)
-                _mem_cache.set(cache_key_obj, ret, ttl=ttl, ignore_overwrite=ignore_rc)
-            elif touch:
-                _mem_cache.set(cache_key_obj, ret, ttl=ttl, ignore_overwrite=True)
+                return  # None is a miss
+            if stale_ttl:
+                _mem_cache.set(cache_key_obj, _Entry(ret, _mem_cache.time() + ttl), ttl=ttl + stale_ttl,
+                               ignore_overwrite=True)
+            else:
+                _mem_cache.set(cache_key_obj, ret, ttl=ttl, ignore_overwrite=overwrite)
 
-            return ret
+        def _store_error(cache_key_obj, e):
+            if error_ttl:
+                _mem_cache.set(cache_key_obj, _CachedError(e), ttl=error_ttl, ignore_overwrite=True)
 
         @wraps(target)
-        async def _inner_wrapper_async(cache_key_obj, args, kwargs):
-            ret = _mem_cache.get(cache_key_obj)
+        def _inner_wrapper(cache_key_obj, args, kwargs):
+            ret, _ = _lookup(cache_key_obj)
+            if ret is None:
+                try:
+                    ret = target(*args, **kwargs)
+                except Exception as e:
+                    _store_error(cache_key_obj, e)
+                    raise
+                _store(cache_key_obj, ret)
+            return ret
 
-            if expired and ret is not None and expired(ret):
-                del _mem_cache[cache_key_obj]
-                ret = None
+        _in_flight = {}  # cache key -> future of the call shared by all waiting callers
 
-            if ret is None:
+        async def _load(cache_key_obj, args, kwargs, refresh):
+            try:
                 ret = await target(*args, **kwargs)
-                _mem_cache.set(cache_key_obj, ret, ttl=ttl, ignore_overwrite=ignore_rc)
-            elif touch:
-                _mem_cache.set(cache_key_obj, ret, ttl=ttl, ignore_overwrite=True)
-
+            except Exception as e:
+                if not (refresh and cache_key_obj in _mem_cache):  # a failed refresh keeps the stale value
+                    _store_error(cache_key_obj, e)
+                raise
+            _store(cache_key_obj, ret)
             return ret
 
-        if synchronized:
-            target_lock = Lock()
+        def _call_done(cache_key_obj, fut):
+            _in_flight.pop(cache_key_obj, None)
+            if not fut.cancelled() and fut.exception() is not None:
+                # retrieved here so a background refresh nobody awaits doesn't log 'never retrieved'
+                logger.debug('%s failed: %s', target.__name__, fut.exception())
 
-            assert not is_coro, "asyncio io not yet supported"
+        def _call_shared(cache_key_obj, args, kwargs, refresh=False):
+            fut = _in_flight.get(cache_key_obj)
+            if fut is None:
+                fut = _in_flight[cache_key_obj] = asyncio.ensure_future(_load(cache_key_obj, args, kwargs, refresh))
+                fut.add_done_callback(partial(_call_done, cache_key_obj))
+            return fut
+
+        @wraps(target)
+        async def _inner_wrapper_async(cache_key_obj, args, kwargs):
+            ret, stale = _lookup(cache_key_obj)
+            if ret is None:
+                # shield: a cancelled caller must not cancel the call other callers wait for
+                return await asyncio.shield(_call_shared(cache_key_obj, args, kwargs))
+            if stale:
+                _call_shared(cache_key_obj, args, kwargs, refresh=True)  # in the background
+            return ret
+
+        if synchronized and not is_coro:
+            target_lock = threading.Lock()
+            key_locks = {}  # cache key -> [lock, number of callers holding or waiting]
 
             @wraps(target)
             def _mem_cache_synchronized_wrapper(*args, **kwargs):
                 cache_key_obj = _cache_key_obj(args, kwargs)
 
                 with target_lock:
-                    lock = _lock_cache.get_default((cache_key_obj, target_lock), Lock, ttl=ttl)
-
-                with lock:
-                    return _inner_wrapper(cache_key_obj, args, kwargs)
+                    entry = key_locks.get(cache_key_obj)
+                    if entry is None:
+                        entry = key_locks[cache_key_obj] = [threading.Lock(), 0]
+                    entry[1] += 1
+                try:
+                    with entry[0]:
+                        return _inner_wrapper(cache_key_obj, args, kwargs)
+                finally:
+                    with target_lock:
+                        entry[1] -= 1
+                        if not entry[1]:
+                            del key_locks[cache_key_obj]
 
             return _mem_cache_synchronized_wrapper
 
@@ -0,0 +1,72 @@
+"""
+Cell voltage encodings of the time-series sinks (InfluxDB, QuestDB). Voltages are stored as integer mV.
+
+* wide: one column per changed cell on the device row, `voltage_cell000=3301i ...`
+* packed: a single string field `voltage_cells` holding all cells delta-encoded, `3301,2,-1,,0` (first cell in mV,
+  then the difference to the previous valid cell, empty for a missing reading). One field per device instead of a
+  column or series per cell.
+* rows: one `cells` point per changed cell, tagged with `cell_index`
+
+Encodings can be combined, e.g. `wide,rows` (the default, as written before encodings were configurable).
+"""
+from typing import Dict, List, Optional
+
+CELL_ENCODINGS = ('wide', 'packed', 'rows')
+
+
+def pack_cells(voltages: List[Optional[int]]) -> str:
+    parts = []
+    prev = None
+    for v in voltages:
+        if v is None:
+            parts.append('')
+        else:
+            parts.append(str(v if prev is None else v - prev))
+            prev = v
+    return ','.join(parts)
+
+
+def unpack_cells(s: str) -> List[Optional[int]]:
+    out = []
+    prev = None
+    for p in s.split(','):
+        if not p:
+            out.append(None)
+        else:
+            prev = int(p) if prev is None else prev + int(p)
+            out.append(prev)
+    return out
+
+
+class CellEncoding:
+
+    def __init__(self, spec='wide,rows'):
+        names = [n.strip() for n in spec.split(',')] if isinstance(spec, str) else list(spec)
+        for n in names:
+            assert n in CELL_ENCODINGS, "unknown cell encoding %s (%s)" % (n, ', '.join(CELL_ENCODINGS))
+        self.wide = 'wide' in names
+        self.packed = 'packed' in names
+        self.rows = 'rows' in names
+
+    def __repr__(self):
+        return 'CellEncoding(%s)' % ','.join(n for n in CELL_ENCODINGS if getattr(self, n))
+
+    def fields(self, cells: Dict[int, int], changed: Dict[int, int]) -> dict:
+        """
+        :param cells: mV of all valid cells by index
+        :param changed: the cells to write (see ChangeTracker)
+        :return: fields of the device row
+        """
+        fields = {}
+        if self.wide:
+            for i, v in changed.items():
+                fields["voltage_cell%03i" % i] = v
+        if self.packed and changed:
+            fields["voltage_cells"] = pack_cells([cells.get(i) for i in range(max(cells) + 1)])
+        return fields
+
+    def cell_rows(self, changed: Dict[int, int]) -> list:
+        """ :return: [(cell_index, fields)] of the `cells` points """
+        if not self.rows:
+            return []
+        return [(i, dict(voltage=v)) for i, v in sorted(changed.items())]
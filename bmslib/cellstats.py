@@ -0,0 +1,119 @@
+"""
+Cell voltage statistics, computed once per fetch and shared by MQTT, the sinks, rollups and algorithms.
+
+The sampler wraps fetched voltages in `CellVoltages`, a list that caches its `CellStats`. `cell_stats()` accepts any
+sequence and uses the cache when there is one. Missing cells (None, nan) are skipped, indices refer to the original
+list. One pass collects the valid cells, min/max with their indices and the sum, the median is an O(n) selection
+(quickselect) on that copy.
+"""
+import math
+from typing import List, NamedTuple, Optional, Sequence
+
+
+class CellStats(NamedTuple):
+    num_cells: int
+    num_valid: int
+    min: float
+    max: float
+    min_index: int  # first cell with the lowest voltage
+    max_index: int
+    sum: float
+    mean: float
+    median: float
+
+    @property
+    def delta(self):
+        return self.max - self.min
+
+
+def _valid(v) -> bool:
+    return v is not None and not (isinstance(v, float) and not math.isfinite(v))
+
+
+def select(values: List[float], k: int) -> float:
+    """ k-th smallest of `values` (0-based) in expected O(n), reorders `values` """
+    lo, hi = 0, len(values) - 1
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        a, b, c = values[lo], values[mid], values[hi]
+        pivot = sorted((a, b, c))[1]  # median of 3
+        i, j = lo, hi
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while values[j] > pivot:
+                j -= 1
+            if i <= j:
+                values[i], values[j] = values[j], values[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            return values[k]
+    return values[k]
+
+
+def median(values: List[float]) -> float:
+    """ median of the (non-empty) `values`, like statistics.median. Reorders `values` """
+    n = len(values)
+    m = select(values, n // 2)
+    if n & 1:
+        return m
+    return (max(values[:n // 2]) + m) / 2  # after selection the lower half holds the n/2 smallest
+
+
+def compute(voltages: Sequence[float]) -> Optional[CellStats]:
+    """ :return: the statistics of the valid cells, None if there are none """
+    if not voltages:
+        return None
+    valid = []
+    lo = hi = None
+    lo_i = hi_i = -1
+    s = 0
+    for i, v in enumerate(voltages):
+        if not _valid(v):
+            continue
+        valid.append(v)
+        s += v
+        if lo is None:
+            lo = hi = v
+            lo_i = hi_i = i
+        elif v < lo:
+            lo, lo_i = v, i
+        elif v > hi:
+            hi, hi_i = v, i
+    if not valid:
+        return None
+    n = len(valid)
+    return CellStats(num_cells=len(voltages), num_valid=n, min=lo, max=hi, min_index=lo_i, max_index=hi_i, sum=s,
+                     mean=s / n, median=median(valid))
+
+
+class CellVoltages(list):
+    """ cell voltages (mV) with cached statistics. Treat as immutable once the stats were read """
+
+    __slots__ = ('_stats',)
+
+    def __init__(self, voltages=()):
+        super().__init__(voltages)
+        self._stats = False
+
+    @property
+    def stats(self) -> Optional[CellStats]:
+        if self._stats is False:
+            self._stats = compute(self)
+        return self._stats
+
+    def __copy__(self):
+        res = CellVoltages(self)
+        res._stats = self._stats
+        return res
+
+
+def cell_stats(voltages: Optional[Sequence[float]]) -> Optional[CellStats]:
+    if isinstance(voltages, CellVoltages):
+        return voltages.stats
+    return compute(voltages)
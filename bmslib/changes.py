@@ -0,0 +1,47 @@
+"""
+Deterministic change tracking for the time-series sinks.
+
+A field is written when its value differs from the last written one, or when it hasn't been written for `heartbeat`
+seconds. So every series has a point at least every `heartbeat` seconds (a `last()` over that window always finds
+one), and the write volume of a steady battery is bounded and predictable.
+
+Heartbeats ride along: when a row is written anyway, fields older than half the heartbeat are refreshed with it,
+which avoids rows carrying a single heartbeat field.
+
+NaN equals NaN here, a missing reading is unchanged until it comes back.
+"""
+import math
+from typing import Dict, Hashable, Tuple
+
+
+def _same(a, b):
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+
+
+class ChangeTracker:
+
+    def __init__(self, heartbeat=300.):
+        self.heartbeat = heartbeat
+        self._last: Dict[Hashable, Dict[Hashable, Tuple[object, float]]] = {}  # series -> key -> (value, time)
+
+    def changed(self, series: Hashable, fields: dict, now: float) -> dict:
+        """ :return: the fields of `fields` to write now, remembered as written """
+        last = self._last.get(series)
+        if last is None:
+            last = self._last[series] = {}
+        out = {}
+        for k, v in fields.items():
+            prev = last.get(k)
+            if prev is None or not _same(prev[0], v) or now - prev[1] >= self.heartbeat:
+                out[k] = v
+        if out:
+            half = self.heartbeat * .5
+            for k, v in fields.items():
+                if k not in out and now - last[k][1] >= half:
+                    out[k] = v
+            for k, v in out.items():
+                last[k] = (v, now)
+        return out
+
+    def forget(self, series: Hashable):
+        self._last.pop(series, None)
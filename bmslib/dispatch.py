@@ -0,0 +1,158 @@
+"""
+Runs each sample sink on its own thread, so a slow or failing sink (blocking HTTP, a full buffer, a bug) can't
+stall the sampling event loop or the other sinks. It only costs its own data.
+
+Calls are queued (bounded by `max_queue`) and executed in order by the sink's worker. When the queue is full:
+* drop_oldest: the oldest pending call is dropped
+* coalesce: a pending call of the same method and device is replaced by the new one (keeping its place in the
+  queue), otherwise the oldest call is dropped. Rollups are records, not the latest state, they are never coalesced
+* block: the caller waits up to `block_timeout` seconds for room, then the new call is dropped. This stalls
+  sampling while the sink is behind.
+"""
+import threading
+import time
+from collections import OrderedDict
+from copy import copy
+from typing import Dict, List
+
+from bmslib.bms import BmsSample
+from bmslib.sampling import BmsSampleSink
+from bmslib.util import get_logger, summarize_exc
+
+logger = get_logger()
+
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'block')
+
+
+class SinkDispatcher(BmsSampleSink):
+
+    def __init__(self, sink, max_queue=1000, policy='drop_oldest', block_timeout=1., stats_interval=600):
+        assert policy in OVERFLOW_POLICIES, "unknown overflow policy %s" % policy
+        self.sink = sink
+        self.name = type(sink).__name__
+        self.max_queue = max(1, int(max_queue))
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.stats_interval = stats_interval
+
+        self._queue = OrderedDict()  # key -> (method, args)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+
+        self.num_calls = 0
+        self.num_dropped = 0
+        self.num_coalesced = 0
+        self.num_errors = 0
+        self.max_qsize = 0
+        self.busy_time = 0.
+        self.max_call_time = 0.
+        self._t_stats = time.time()
+        self._t_error_log = 0
+
+        self._thread = threading.Thread(target=self._run, name='Sink-' + self.name, daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return 'SinkDispatcher(%s,%s,%d)' % (self.name, self.policy, self.max_queue)
+
+    def publish_sample(self, bms_name: str, sample: BmsSample, tags=None):
+        # the sampler keeps working on the sample (e.g. temperatures), hand a copy to the worker
+        self._put('publish_sample', bms_name, (bms_name, copy(sample), tags))
+
+    def publish_voltages(self, bms_name: str, voltages: List[int]):
+        self._put('publish_voltages', bms_name, (bms_name, copy(voltages) if voltages else voltages))  # keeps the stats
+
+    def publish_meters(self, bms_name: str, readings: Dict[str, float]):
+        self._put('publish_meters', bms_name, (bms_name, dict(readings)))
+
+    def publish_rollup(self, bms_name: str, resolution: float, timestamp: float, fields: Dict[str, float]):
+        self._put('publish_rollup', None, (bms_name, resolution, timestamp, fields))
+
+    def _put(self, method, series, args):
+        """ :param series: calls of a method with the same series can be coalesced, None for append-only records """
+        with self._cond:
+            if self._stopping:
+                return
+            if self.policy == 'coalesce' and series is not None:
+                key = (method, series)
+                if key in self._queue:
+                    self._queue[key] = (method, args)
+                    self.num_coalesced += 1
+                    return
+            else:
+                self._seq += 1
+                key = self._seq
+
+            if len(self._queue) >= self.max_queue:
+                if self.policy == 'block':
+                    if not self._cond.wait_for(lambda: len(self._queue) < self.max_queue, self.block_timeout):
+                        self.num_dropped += 1
+                        return
+                else:
+                    self._queue.popitem(last=False)
+                    self.num_dropped += 1
+
+            self._queue[key] = (method, args)
+            self.max_qsize = max(self.max_qsize, len(self._queue))
+            self._cond.notify_all()
+
+    def qsize(self):
+        return len(self._queue)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._stopping)
+                if not self._queue:
+                    return  # stopping and drained
+                _, (method, args) = self._queue.popitem(last=False)
+                self._cond.notify_all()  # room for blocked producers
+
+            t0 = time.perf_counter()
+            try:
+                getattr(self.sink, method)(*args)
+            except NotImplementedError:
+                pass
+            except Exception as e:
+                self.num_errors += 1
+                now = time.time()
+                if now - self._t_error_log > 60:
+                    self._t_error_log = now
+                    logger.error('sink %s %s failed (%d errors): %s', self.name, method, self.num_errors,
+                                 summarize_exc(e))
+            dt = time.perf_counter() - t0
+            self.num_calls += 1
+            self.busy_time += dt
+            self.max_call_time = max(self.max_call_time, dt)
+            self._maybe_log_stats()
+
+    def _maybe_log_stats(self):
+        now = time.time()
+        if now - self._t_stats < self.stats_interval:
+            return
+        self._t_stats = now
+        log = logger.info if (self.num_dropped or self.num_errors) else logger.debug
+        log('sink %s: %s', self.name, ' '.join('%s=%s' % kv for kv in self.stats().items()))
+
+    def stats(self) -> dict:
+        return dict(calls=self.num_calls, dropped=self.num_dropped, coalesced=self.num_coalesced,
+                    errors=self.num_errors, qsize=len(self._queue), max_qsize=self.max_qsize,
+                    mean_call_ms=round(self.busy_time / max(1, self.num_calls) * 1e3, 3),
+                    max_call_ms=round(self.max_call_time * 1e3, 3))
+
+    def close(self, timeout=5.):
+        """
+        process the pending calls (for up to `timeout` seconds), then close the sink. If the worker is still in a
+        call the sink is left open, closing it underneath the call could corrupt it
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            logger.warning('sink %s: %d calls pending at close, not closing it', self.name, len(self._queue))
+            return
+        close = getattr(self.sink, 'close', None)
+        if close:
+            close()
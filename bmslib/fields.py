@@ -0,0 +1,244 @@
+"""
+The single registry of BmsSample fields: storage, MQTT/HA metadata, sink encoding.
+
+Everything that used to keep its own field list derives from FIELDS:
+* BmsSample slots and values() (SAMPLE_FIELDS)
+* MQTT topics and HA discovery (`mqtt_util.sample_desc`)
+* the QuestDB column types and scales (QUESTDB_INT_SCALE, ...)
+* the fields summarized by the telemetry sink and the rollups (SUMMARY_FIELDS)
+* the per-sink sample serializers, compiled once into straight-line functions (`compile_serializer`)
+
+To add a field: add it to BmsSample.__init__ and here.
+"""
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+
+class Field(NamedTuple):
+    name: str
+    kind: str = 'float'  # float, int, bool, str, list (flattened to name_<i>), dict (flattened to name_<key>)
+    attr: Optional[str] = None  # storage slot if not `name` (then `name` is a computed property)
+    unit: Optional[str] = None
+
+    # MQTT state topic under the device topic, published and discovered as a HA sensor
+    topic: Optional[str] = None
+    tier: Optional[str] = None  # publish tier (see mqtt_util.PUBLISH_TIERS)
+    aggregate: Optional[str] = None  # 'last': never averaged by tier aggregation
+    device_class: Optional[str] = None
+    state_class: Optional[str] = None
+    precision: Optional[int] = None  # HA suggested display precision
+    significant_digits: Optional[int] = None  # MQTT values are rounded to n significant digits
+    icon: Optional[str] = None
+
+    # QuestDB column: 'int' (round(v * scale)), 'long', 'bool', 'float' or None (not written)
+    questdb: Optional[str] = 'float'
+    scale: Optional[int] = None
+    max_items: Optional[int] = None  # questdb: list items written (temperatures_0..7)
+    keys: Tuple[str, ...] = ()  # questdb: dict keys written
+
+    sink: bool = True  # written to the data sinks (InfluxDB, QuestDB, local store)
+    summary: bool = False  # summarized by the telemetry windows and rollups
+
+    @property
+    def slot(self):
+        return self.attr or self.name
+
+
+SWITCH_KEYS = (
+    "charge", "discharge", "balance", "float_charge",
+    "status_normal", "status_charging", "status_discharging",
+    "status_protection", "status_overvolt_protection",
+    "status_undervolt_protection", "status_overtemp",
+    "status_undertemp", "status_short",
+)
+
+# units: https://github.com/home-assistant/core/blob/d7ac4bd65379e11461c7ce0893d3533d8d8b8cbf/homeassistant/const.py#L384
+# MQTT fields first, in publish order
+FIELDS: Tuple[Field, ...] = (
+    Field('voltage', unit='V', topic='soc/total_voltage', tier='medium', device_class='voltage',
+          state_class='measurement', precision=2, significant_digits=4, icon='meter-electric',
+          questdb='int', scale=1000, summary=True),  # V -> mV
+    Field('current', unit='A', topic='soc/current', tier='fast', device_class='current', state_class='measurement',
+          precision=2, significant_digits=4, questdb='int', scale=1000, summary=True),  # A -> mA
+    Field('balance_current', unit='A', topic='soc/balance_current', tier='fast', device_class='current',
+          state_class='measurement', precision=2, significant_digits=4, icon='scale-unbalanced',
+          questdb='int', scale=1000),
+    Field('soc', unit='%', topic='soc/soc_percent', tier='medium', device_class='battery', state_class='measurement',
+          precision=2, significant_digits=4, icon='battery', questdb='int', scale=100, summary=True),  # centi-%
+    Field('power', attr='_power', unit='W', topic='soc/power', tier='fast', device_class='power',
+          state_class='measurement', precision=1, significant_digits=4, icon='flash', summary=True),
+    Field('capacity', unit='Ah', topic='soc/capacity', tier='slow', questdb='int', scale=100),  # centi-Ah
+    Field('aged_capacity', unit='Ah', topic='soc/aged_capacity', tier='slow', precision=2,
+          icon='battery-heart-variant', questdb='int', scale=100),
+    Field('soh', unit='%', topic='soc/soh', tier='slow', state_class='measurement', precision=1,
+          icon='battery-heart-variant', questdb='int', scale=100),
+    # Topic kept as ``soc/cycle_capacity`` (and therefore HA's unique_id / entity_id) so existing user automations
+    # and long-term statistics keep working across the rename. The HA display name is derived from the field name.
+    Field('total_charge_throughput', unit='Ah', topic='soc/cycle_capacity', tier='slow', aggregate='last'),
+    Field('num_cycles', unit='N', topic='soc/num_cycles', tier='slow', aggregate='last', state_class='measurement',
+          icon='battery-sync'),
+    Field('charge', unit='Ah', topic='mosfet_status/capacity_ah', tier='medium'),
+    Field('mos_temperature', unit='°C', topic='mosfet_status/temperature', tier='slow', device_class='temperature',
+          state_class='measurement', icon='thermometer', questdb='int', scale=100, summary=True),  # centi-degC
+    Field('uptime', unit='s', topic='bms/uptime', tier='slow', aggregate='last', device_class='duration',
+          state_class='measurement', precision=0, icon='clock'),
+    Field('runtime', unit='s', topic='bms/runtime', tier='medium', device_class='duration',
+          state_class='measurement', precision=0, icon='timer-sand'),
+    Field('total_charge_net', unit='Ah', topic='soc/total_charge_net', tier='slow', aggregate='last',
+          state_class='total_increasing', icon='battery-arrow-down', questdb=None),
+    Field('num_samples', kind='int', unit='N', topic='meter/sample_count', tier='slow', aggregate='last',
+          state_class='measurement', icon='counter'),
+
+    # published on their own topics (mqtt_util.publish_sample, publish_temperatures)
+    Field('temperatures', kind='list', unit='°C', questdb='int', scale=100, max_items=8),
+    Field('switches', kind='dict', questdb='bool', keys=SWITCH_KEYS),
+    Field('problem', kind='bool'),
+    Field('problem_code', kind='int', questdb='long'),
+    Field('battery_charging', kind='bool'),
+    Field('battery_mode', kind='str', questdb=None),
+    Field('timestamp', unit='s', questdb=None, sink=False),
+)
+
+FIELDS_BY_NAME: Dict[str, Field] = {f.name: f for f in FIELDS}
+
+# BmsSample storage, in the order of values()
+SAMPLE_FIELDS = tuple(f.slot for f in FIELDS)
+
+SUMMARY_FIELDS = tuple(f.name for f in FIELDS if f.summary)
+
+
+def _flat_names(f: Field):
+    if f.kind == 'list':
+        return ['%s_%d' % (f.name, i) for i in range(f.max_items or 0)]
+    if f.kind == 'dict':
+        return ['%s_%s' % (f.name, k) for k in f.keys]
+    names = [f.name]
+    if f.attr:
+        names.append(f.attr)  # the storage slot is written too (`_power`)
+    return names
+
+
+# QuestDB columns (doc/QuestDB-compression.md): scaled integers where pco compresses them better (the scale fixes
+# the unit, decode with stored / scale), a LONG bitmask, BOOLEAN switches, FLOAT for wide-range or derived values.
+# Sample fields not in any of them are not written: ILP auto-create would re-add columns the schema dropped.
+QUESTDB_INT_SCALE = {n: f.scale for f in FIELDS if f.questdb == 'int' for n in _flat_names(f)}
+QUESTDB_LONG_FIELDS = frozenset(n for f in FIELDS if f.questdb == 'long' for n in _flat_names(f))
+QUESTDB_BOOL_FIELDS = frozenset(n for f in FIELDS if f.questdb == 'bool' for n in _flat_names(f))
+QUESTDB_FLOAT_FIELDS = frozenset(n for f in FIELDS if f.questdb == 'float' and f.sink for n in _flat_names(f))
+
+
+def mqtt_sample_desc() -> Dict[str, dict]:
+    """ MQTT topic -> field description (the `sample_desc` format) """
+    desc = {}
+    for f in FIELDS:
+        if not f.topic:
+            continue
+        d = dict(field=f.name, tier=f.tier)
+        if f.aggregate:
+            d['aggregate'] = f.aggregate
+        d.update(device_class=f.device_class, state_class=f.state_class, unit_of_measurement=f.unit)
+        if f.precision is not None:
+            d['precision'] = f.precision
+        if f.significant_digits is not None:
+            d['significant_digits'] = f.significant_digits
+        if f.icon:
+            d['icon'] = f.icon
+        desc[f.topic] = d
+    return desc
+
+
+# --- compiled serializers ---------------------------------------------------
+#
+# A serializer turns a sample into the flat field dict a sink writes (the keys of `flatten(sample.values())`).
+# The code is generated once per encoding, a few statements per field, so publishing a sample neither builds the
+# values() dict nor flattens it. An encoding returns the code writing value `x` to `out[<key>]` (or nothing to
+# leave the field out), `key` is a code expression.
+
+_FINITE = '(x - x == 0)'  # False for nan and inf
+_NUMBER = 'x.__class__ is not bool and (isinstance(x, int) or (isinstance(x, float) and %s))' % _FINITE
+
+
+def _influx_item(f: Field, key: str) -> Optional[str]:
+    # ints become floats, so a field's type doesn't flip between BMS models; floats with 3 decimals
+    return ('if isinstance(x, float):\n'
+            '    if %s: out[%s] = round(x, 3)\n'
+            'elif isinstance(x, int): out[%s] = float(x)\n'
+            'else: out[%s] = x\n') % (_FINITE, key, key, key)
+
+
+def _questdb_item(f: Field, key: str) -> Optional[str]:
+    t = f.questdb
+    if t == 'int':
+        return 'if %s: out[%s] = int(round(x * %r))\n' % (_NUMBER, key, f.scale)
+    if t == 'long':
+        return 'if %s: out[%s] = int(x)\n' % (_NUMBER, key)
+    if t == 'bool':
+        return 'out[%s] = bool(x)\n' % key
+    if t == 'float':
+        return ('if x.__class__ is bool: out[%s] = float(x)\n'
+                'elif %s: out[%s] = round(float(x), 3)\n') % (key, _NUMBER, key)
+    return None
+
+
+def _raw_item(f: Field, key: str) -> Optional[str]:
+    return 'if not isinstance(x, float) or %s: out[%s] = x\n' % (_FINITE, key)
+
+
+ENCODINGS: Dict[str, Callable[[Field, str], Optional[str]]] = dict(
+    influx=_influx_item,
+    questdb=_questdb_item,
+    raw=_raw_item,
+)
+
+
+def _indent(code, n):
+    return ''.join(' ' * n + line + '\n' for line in code.splitlines())
+
+
+def _field_code(f: Field, encoding: str) -> str:
+    encode = ENCODINGS[encoding]
+    item = encode(f, 'k' if f.kind in ('list', 'dict') else repr(f.name))
+    if item is None:
+        return ''
+    schema = encoding == 'questdb'  # QuestDB writes only the columns of its schema
+
+    if f.kind in ('list', 'dict'):
+        code = 'v = s.%s\nif v:\n' % f.slot
+        if f.kind == 'list':
+            code += '    for i, x in enumerate(v%s):\n' % ('[:%d]' % f.max_items if schema and f.max_items else '')
+            code += '        k = %r + str(i)\n' % (f.name + '_')
+        else:
+            code += '    for k, x in v.items():\n'
+            if schema and f.keys:
+                code += '        if k not in %r: continue\n' % (frozenset(f.keys),)
+            code += '        k = %r + k\n' % (f.name + '_')
+        code += '        if x is None: continue\n'
+        return code + _indent(item, 8)
+
+    code = ''
+    for key in (f.name, f.attr):  # the storage slot is written too (`_power`)
+        if key:
+            code += 'x = s.%s\nif x is not None:\n' % key
+            code += _indent(encode(f, repr(key)), 4)
+    return code
+
+
+def compile_serializer(encoding: str) -> Callable[[object], dict]:
+    """ :return: fn(sample) -> flat dict of the sink fields in `encoding` (see ENCODINGS) """
+    body = ''.join(_field_code(f, encoding) for f in FIELDS if f.sink)
+    src = 'def serialize_%s(s):\n    out = {}\n%s    return out\n' % (encoding, _indent(body, 4))
+    ns = {}
+    exec(compile(src, '<serializer %s>' % encoding, 'exec'), ns)
+    fn = ns['serialize_' + encoding]
+    fn.source = src
+    return fn
+
+
+_serializers: Dict[str, Callable] = {}
+
+
+def serializer(encoding: str) -> Callable[[object], dict]:
+    """ the compiled serializer of `encoding`, compiled on first use """
+    fn = _serializers.get(encoding)
+    if fn is None:
+        fn = _serializers[encoding] = compile_serializer(encoding)
+    return fn
@@ -0,0 +1,117 @@
+"""
+Fleet processor: batches the per-sample integration of all samplers.
+
+Each sampler integrates six meters per sample (charge, energy, cycles, ...), one Python call each. With many devices
+that per-call overhead dominates. With a FleetProcessor the samplers' meters are `FleetMeter`s: `meter += (x, y)`
+only records the input, `flush()` (once per sampling tick) integrates the inputs of all devices with one filter bank
+update per meter (arrays indexed by device, see pwmath.FilterBank).
+
+Meter readings include the inputs up to the last flush, so they lag by at most one tick.
+A device submitting again before the flush triggers the flush, no input is lost. A device whose clock steps back
+has its meters re-seeded, the other devices are not affected.
+
+Without numpy the banks fall back to per-device scalar meters, which is correct but not faster, so main.py only
+enables fleet batching when numpy is available.
+"""
+import math
+from typing import Dict, List, Optional
+
+from bmslib.pwmath import DiffAbsSumBank, IntegratorBank
+from bmslib.util import get_logger
+
+logger = get_logger()
+
+# name -> dy_max of a DiffAbsSum meter, None for an Integrator. In the order of BmsSampler.meters
+METERS = {
+    'total_charge': None,
+    'total_energy': None,
+    'total_energy_discharge': None,
+    'total_energy_charge': None,
+    'total_cycles': 0.1,
+    'total_abs_diff_charge': 0.5,
+}
+
+DIFF_DX_MAX = 3600 / 3600  # allow larger gaps for already integrated values
+
+
+class FleetMeter:
+    """ a device's meter in the fleet banks, with the Integrator API used by the sampler """
+
+    __slots__ = ('name', 'fleet', 'meter', 'index')
+
+    def __init__(self, name, fleet: 'FleetProcessor', index: int):
+        self.name = name
+        self.fleet = fleet
+        self.meter = fleet.meters[name]
+        self.index = index
+
+    def __iadd__(self, other):
+        assert isinstance(other, tuple)
+        self.fleet.submit(self.meter, self.index, *other)
+        return self
+
+    def get(self):
+        return float(self.meter.bank.get()[self.index])
+
+    def restore(self, value):
+        values = list(self.meter.bank.get())
+        values[self.index] = value
+        self.meter.bank.restore(values)
+
+
+class _Meter:
+    __slots__ = ('bank', 'x', 'y')
+
+    def __init__(self, bank):
+        self.bank = bank
+        self.x: List[float] = []  # pending inputs, nan if none
+        self.y: List[float] = []
+
+
+class FleetProcessor:
+
+    def __init__(self, dt_max_seconds, use_numpy: bool = None):
+        dx_max = dt_max_seconds / 3600
+        self.meters: Dict[str, _Meter] = {
+            name: _Meter(IntegratorBank(dx_max, use_numpy=use_numpy) if dy_max is None
+                         else DiffAbsSumBank(DIFF_DX_MAX, dy_max, use_numpy=use_numpy))
+            for name, dy_max in METERS.items()}
+        self.devices: Dict[str, int] = {}
+        self._dirty = False
+        self.num_flushes = 0
+
+    def register(self, device_name, meter_state: Optional[dict] = None) -> List[FleetMeter]:
+        """ :return: the device's meters, in the order of METERS """
+        index = self.devices.setdefault(device_name, len(self.devices))
+        for m in self.meters.values():
+            m.bank.resize(len(self.devices))
+            while len(m.x) < len(self.devices):
+                m.x.append(math.nan)
+                m.y.append(math.nan)
+        meters = [FleetMeter(name, self, index) for name in METERS]
+        for meter in meters:
+            if meter_state and meter.name in meter_state:
+                meter.restore(meter_state[meter.name]['reading'])
+        return meters
+
+    def submit(self, meter: _Meter, index, x, y):
+        if not math.isnan(meter.x[index]):
+            self.flush()  # the device is faster than the tick
+        meter.x[index] = x
+        meter.y[index] = y
+        self._dirty = True
+
+    def flush(self):
+        """ integrate the pending inputs of all devices """
+        if not self._dirty:
+            return
+        self._dirty = False
+        self.num_flushes += 1
+        for name, m in self.meters.items():
+            m.bank.update(m.x, m.y)
+            if m.bank.stepped_back:
+                devices = list(self.devices)
+                logger.warning('fleet meter %s: clock stepped back on %s, re-seeded', name,
+                               ', '.join(devices[i] for i in m.bank.stepped_back))
+            n = len(m.x)
+            m.x[:] = m.y[:] = [math.nan] * n
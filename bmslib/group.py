@@ -1,4 +1,5 @@
 import asyncio
+import itertools
 import math
 import statistics
 from copy import copy
@@ -33,7 +34,7 @@ class BmsGroup:
 
     def fetch_voltages(self):
         try:
-            return sum((self.voltages[name] for name in self.bms_names), [])
+            return list(itertools.chain.from_iterable(self.voltages[name] for name in self.bms_names))
         except KeyError as e:
             raise GroupNotReady(e)
 
@@ -147,7 +148,7 @@ def sum_parallel(samples: Iterable[BmsSample]) -> BmsSample:
         soc=sum(s.soc * s.capacity for s in samples) / sum(s.capacity for s in samples),
         soh=sum(s.soh * s.capacity for s in samples) / sum(s.capacity for s in samples),
         aged_capacity=sum(s.aged_capacity for s in samples),
-        temperatures=sum(((s.temperatures or []) for s in samples), []),
+        temperatures=list(itertools.chain.from_iterable((s.temperatures or []) for s in samples)),
         mos_temperature=max((s.mos_temperature for s in samples if is_finite(s.mos_temperature)), default=math.nan),
         switches={k: v for s in samples for k, v in (s.switches or {}).items()},
         timestamp=min(s.timestamp for s in samples),
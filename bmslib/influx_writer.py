@@ -0,0 +1,160 @@
+"""
+InfluxDB v1 /write client on http.client (no `influxdb` package needed).
+
+* one keep-alive HTTP/1.1 connection, re-opened after errors (there is a single flush thread per sink)
+* the line protocol buffer is gzip-compressed while it is sent (chunked transfer encoding), in `chunk_size` slices;
+  `compresslevel=None` sends it uncompressed
+* adaptive batch size: `batch_end()` splits a buffer at line boundaries so that one request carries about
+  `batch_bytes`, which grows while requests are fast and shrinks when they approach `target_latency`
+
+QuestDB accepts the same requests on its /write endpoint (see bmslib.questdb_writer).
+"""
+import base64
+import http.client
+import ssl as ssl_
+import time
+import zlib
+from urllib.parse import urlencode
+
+from bmslib.util import get_logger
+
+logger = get_logger()
+
+
+def split_host_port(host: str, default_port: int):
+    """ 'example.com:8086' -> ('example.com', 8086) """
+    h, sep, p = host.rpartition(':')
+    if sep and p.isdigit() and (':' not in h or h.endswith(']')):  # bare IPv6 addresses have no port
+        return h.strip('[]'), int(p)
+    return host, default_port
+
+
+def line_batch_end(data, start, batch_bytes) -> int:
+    """ :return: end of the batch starting at `start`, after a newline if the buffer is longer than a batch """
+    end = start + batch_bytes
+    if end >= len(data):
+        return len(data)
+    nl = data.rfind(b'\n', start, end)
+    if nl < 0:
+        nl = data.find(b'\n', end)  # a single line longer than the batch
+        if nl < 0:
+            return len(data)
+    return nl + 1
+
+
+class InfluxWriteError(Exception):
+    def __init__(self, status, body):
+        super().__init__('HTTP %s: %s' % (status, body[:200]))
+        self.status = status
+
+
+class InfluxHttpWriter:
+
+    def __init__(self, host='localhost', port=None, username=None, password=None, database=None, ssl=False,
+                 verify_ssl=False, timeout=10., compresslevel=6, chunk_size=64 * 1024, precision='n',
+                 batch_bytes=256 * 1024, min_batch_bytes=16 * 1024, max_batch_bytes=4 * 2 ** 20, target_latency=1.):
+        if port is None:
+            host, port = split_host_port(host, 8086)
+        self.host = host
+        self.port = int(port)
+        self.ssl = ssl
+        self.verify_ssl = verify_ssl
+        self.timeout = timeout
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+
+        self.batch_bytes = batch_bytes
+        self.min_batch_bytes = min_batch_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.target_latency = target_latency
+        self.latency = None  # EWMA of seconds per request
+
+        params = dict(db=database, precision=precision)
+        self.path = '/write?' + urlencode({k: v for k, v in params.items() if v})
+        self.headers = {
+            'Content-Type': 'application/octet-stream',
+            'Connection': 'keep-alive',
+        }
+        if compresslevel is not None:
+            self.headers['Content-Encoding'] = 'gzip'
+        if username:
+            cred = base64.b64encode(('%s:%s' % (username, password or '')).encode()).decode('ascii')
+            self.headers['Authorization'] = 'Basic ' + cred
+
+        self._conn = None
+        self.num_connects = 0
+
+    def _connect(self):
+        if self.ssl:
+            ctx = ssl_.create_default_context()
+            if not self.verify_ssl:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl_.CERT_NONE
+            conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=ctx)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.num_connects += 1
+        return conn
+
+    def _gzip_chunks(self, data):
+        compress = self.compresslevel is not None and zlib.compressobj(self.compresslevel, zlib.DEFLATED,
+                                                                       16 + zlib.MAX_WBITS)
+        with memoryview(data) as view:
+            for i in range(0, len(view), self.chunk_size):
+                chunk = view[i:i + self.chunk_size]
+                if compress:
+                    chunk = compress.compress(chunk)
+                if chunk:
+                    yield chunk
+        if compress:
+            yield compress.flush()
+
+    def write(self, data):
+        """ POST one batch of line protocol. Raises on failure. """
+        if not data:
+            return
+        t0 = time.time()
+        for attempt in range(2):
+            reused = self._conn is not None
+            if not reused:
+                self._conn = self._connect()
+            body = self._gzip_chunks(data)
+            try:
+                self._conn.request('POST', self.path, body=body, headers=self.headers, encode_chunked=True)
+                res = self._conn.getresponse()
+                res_body = res.read()  # drain, so the connection can be reused
+                if res.will_close:
+                    self.close()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if not reused or attempt:
+                    raise
+                # the server closed the idle keep-alive connection, retry once on a new one
+            except Exception:
+                self.close()
+                raise
+            finally:
+                body.close()  # releases the buffer view
+        self._update_batch_size(time.time() - t0, len(data))
+        if res.status not in (200, 204):
+            raise InfluxWriteError(res.status, res_body.decode('utf-8', 'replace'))
+
+    def _update_batch_size(self, dt, n):
+        self.latency = dt if self.latency is None else .8 * self.latency + .2 * dt
+        if n < self.batch_bytes * .5:
+            return  # small writes say little about the server's capacity
+        if self.latency > self.target_latency:
+            self.batch_bytes = max(self.min_batch_bytes, int(self.batch_bytes * .5))
+        elif self.latency < self.target_latency * .25:
+            self.batch_bytes = min(self.max_batch_bytes, int(self.batch_bytes * 1.25))
+
+    def batch_end(self, data, start=0) -> int:
+        return line_batch_end(data, start, self.batch_bytes)
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            finally:
+                self._conn = None
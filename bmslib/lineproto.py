@@ -0,0 +1,78 @@
+"""
+InfluxDB line protocol encoder writing straight into a bytearray.
+
+Sinks serialize a point once at publish time; the flush thread only compresses and sends the buffer. The
+`measurement,tag=value,...` prefix is escaped once per (measurement, tags) and cached. Lines are equivalent to
+`influxdb.line_protocol.make_line` (sorted tags and fields, ints as `Ni`), except that non-finite floats are
+skipped and timestamps are always integer nanoseconds.
+
+https://docs.influxdata.com/influxdb/v1/write_protocols/line_protocol_reference/
+"""
+import math
+from typing import Dict, Optional
+
+_TAG_ESCAPE = str.maketrans({'\\': '\\\\', ' ': '\\ ', ',': '\\,', '=': '\\=', '\n': '\\n'})
+
+
+def escape_key(s) -> str:
+    """ escape a measurement, tag key, tag value or field key """
+    return str(s).translate(_TAG_ESCAPE)
+
+
+def format_value(v) -> Optional[str]:
+    """ :return: the field value in line protocol or None if it can't be represented (None, nan, inf) """
+    if isinstance(v, bool):
+        return 'true' if v else 'false'
+    if isinstance(v, int):
+        return '%di' % v
+    if isinstance(v, float):
+        return repr(v) if math.isfinite(v) else None
+    if isinstance(v, str):
+        return '"%s"' % v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    if v is None:
+        return None
+    return format_value(float(v))
+
+
+class LineProtocolEncoder:
+    """
+    Appends points to `buf`. Prefixes are cached per (measurement, tags), so tags should be drawn from a small
+    set (device name, cell index, ...).
+    """
+
+    def __init__(self, max_prefixes=4096):
+        self._prefixes: Dict[tuple, bytes] = {}
+        self._max_prefixes = max_prefixes
+
+    def prefix(self, measurement: str, tags: Optional[dict]) -> bytes:
+        key = (measurement, tuple(sorted(tags.items())) if tags else ())
+        p = self._prefixes.get(key)
+        if p is None:
+            s = escape_key(measurement)
+            for k, v in key[1]:
+                if v is None or v == '':
+                    continue
+                s += ',' + escape_key(k) + '=' + escape_key(v)
+            p = s.encode('utf-8')
+            if len(self._prefixes) >= self._max_prefixes:
+                self._prefixes.clear()
+            self._prefixes[key] = p
+        return p
+
+    def encode(self, measurement: str, tags: Optional[dict], fields: dict, time_ns: int) -> Optional[bytes]:
+        """ :return: one line including the trailing newline, None if no field is representable """
+        parts = []
+        for k in sorted(fields):
+            v = format_value(fields[k])
+            if v is not None:
+                parts.append(escape_key(k) + '=' + v)
+        if not parts:
+            return None
+        return b'%s %s %d\n' % (self.prefix(measurement, tags), ','.join(parts).encode('utf-8'), time_ns)
+
+    def write(self, buf: bytearray, measurement: str, tags: Optional[dict], fields: dict, time_ns: int) -> bool:
+        line = self.encode(measurement, tags, fields, time_ns)
+        if line is None:
+            return False
+        buf += line
+        return True
@@ -139,8 +139,8 @@ def construct_bms(dev: dict, verbose_log: bool, bt_discovered_devices: list):
             raise Exception("Can't resolve device name %s, not discovered" % address)
         return dev
 
-    if addr == "serial" and not dev.get('alias'):
-        raise ValueError('with `address=serial` you need to specify `alias`')
+    if (addr == "serial" or addr.startswith('replay:')) and not dev.get('alias'):
+        raise ValueError('with `address=%s` you need to specify `alias`' % addr.split(':')[0])
     addr = name2addr(addr)
 
     name: str = dev.get('alias') or dev_by_addr(addr).name
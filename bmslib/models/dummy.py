@@ -2,6 +2,8 @@
 This is code for a dummy BMS wich doesn't physically exist.
 
 """
+import asyncio
+import json
 import math
 import random
 import time
@@ -114,6 +116,111 @@ class BleakDummyClient:
         return self.__aexit__().__await__()
 
 
+class BleakReplayClient:
+    """
+    Plays a frame recording (see bmslib.recorder) back to a BMS driver, device address `replay:<file>[@<speed>]`.
+
+    Each write advances to the next recorded write of the same payload (or just the next write) and schedules the
+    notifications recorded after it, at their recorded delay divided by `speed` (0: no delay). The recording repeats,
+    so a few minutes of a real pack drive a sampler indefinitely.
+    """
+
+    def __init__(self, address: str, disconnected_callback):
+        from bmslib.recorder import read_frames, SERVICES, TX
+        self.address = address
+        path, _, speed = address[len('replay:'):].partition('@')
+        self.speed = float(speed) if speed else 1.
+        self._connected = False
+        self._disconnected_callback = disconnected_callback
+        self._callbacks = {}
+        self._tasks = set()
+        self._pos = 0
+        self._tx = TX
+
+        frames = list(read_frames(path))
+        self._services = next((json.loads(f.data) for f in frames if f.kind == SERVICES), [])
+        self._frames = [f for f in frames if f.kind != SERVICES]
+        if not any(f.kind == TX for f in self._frames):
+            raise ValueError("recording %s has no writes to replay" % path)
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    @property
+    def services(self):
+        return [dotdict(uuid=s['uuid'], characteristics=[
+            dotdict(uuid=c['uuid'], handle=c['handle'], properties=c['properties'], descriptors=[])
+            for c in s['characteristics']]) for s in self._services]
+
+    async def connect(self, timeout=20):
+        self._connected = True
+
+    async def disconnect(self):
+        for task in self._tasks:
+            task.cancel()
+        self._connected = False
+        cb = self._disconnected_callback
+        cb and cb(self)
+
+    async def pair(self, *args, **kwargs):
+        return True
+
+    async def start_notify(self, char_specifier, callback: Callable[[int, bytearray], None], **kwargs):
+        self._callbacks[str(getattr(char_specifier, 'uuid', char_specifier))] = callback
+
+    async def stop_notify(self, char_specifier):
+        self._callbacks.pop(str(getattr(char_specifier, 'uuid', char_specifier)), None)
+
+    def _next_write(self, data: bytes) -> int:
+        n = len(self._frames)
+        first = None
+        for k in range(n):
+            i = (self._pos + k) % n
+            f = self._frames[i]
+            if f.kind == self._tx:
+                if f.data == data:
+                    return i
+                if first is None:
+                    first = i
+        return first
+
+    async def write_gatt_char(self, char_specifier, data: Union[bytes, bytearray, memoryview],
+                              response: bool = False, ):
+        i = self._next_write(bytes(data))
+        t0 = self._frames[i].t
+        notifications = []
+        i += 1
+        while i < len(self._frames) and self._frames[i].kind != self._tx:
+            notifications.append(self._frames[i])
+            i += 1
+        self._pos = i % len(self._frames)
+        task = asyncio.ensure_future(self._play(t0, notifications))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _play(self, t0, notifications):
+        start = time.time()
+        for f in notifications:
+            if self.speed > 0:
+                delay = (f.t - t0) / self.speed - (time.time() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)
+            cb = self._callbacks.get(f.char)
+            if cb is None and len(self._callbacks) == 1:
+                cb = next(iter(self._callbacks.values()))
+            if cb:
+                cb(f.char, bytearray(f.data))
+
+    async def __aenter__(self):
+        await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.disconnect()
+
+
 class JKDummy:
     DEVICE_INFO = b'U\xaa\xeb\x90\x03\x15JK-B2A24S20P\x00\x00\x00\x0010.X-W\x00\x0010.02\x00\x00\x00\xdc\xc6/\x00\x06\x00\x00\x00JK pw123456\x00\x00\x00\x00\x001234\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00220606\x00\x001120303218\x000000\x00Input Userdata\x00\x00123456\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xc5\xaaU\x90\xeb\xc8\x01\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00D'
 
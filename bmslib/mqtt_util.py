@@ -7,16 +7,24 @@ HA mdi: icons https://pictogrammers.com/library/mdi/
 import asyncio
 import json
 import math
+import os
 import queue
-import statistics
+import threading
 import time
 import traceback
+from typing import Optional, Tuple
 from unittest.mock import patch
 
 import paho.mqtt.client as paho
+from paho.mqtt.enums import CallbackAPIVersion, MQTTProtocolVersion
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
+from bmslib.binframe import BinaryFrameEncoder
 from bmslib.bms import BmsSample, DeviceInfo, MIN_VALUE_EXPIRY
 from bmslib.bt import BtBms
+from bmslib.cellstats import cell_stats
+from bmslib.fields import mqtt_sample_desc
 from bmslib.util import get_logger
 
 logger = get_logger()
@@ -92,7 +100,134 @@ _last_values = {}
 _last_publish_time = 0.
 
 
-def mqtt_single_out(client: paho.Client, topic, data, retain=False):
+class Mqtt5Options:
+    """
+    MQTT v5 publish extras (`mqtt_v5` option):
+      * topic aliases for state topics (non-retained, below the device topic). A hot topic like
+        `bat1/cell_voltages/12` goes over the wire once per connection, afterwards as a 2-byte alias with an empty
+        topic string
+      * message expiry for state messages, so the broker doesn't hand out stale readings
+      * a `ts` user property carrying the sample timestamp
+
+    Aliases only live for one connection and the broker announces how many it accepts (Topic Alias Maximum in
+    CONNACK), so `on_connect` resets the table. An alias is only used with an empty topic after the broker has seen
+    it bound to the full topic, i.e. after a successful publish on the current connection.
+    """
+
+    def __init__(self, message_expiry: Optional[int] = None):
+        self.message_expiry = int(message_expiry) if message_expiry else None
+        self.alias_max = 0  # 0 = broker accepts no aliases
+        self._aliases = {}  # topic -> (alias, confirmed)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def on_connect(self, properties: Optional[Properties]):
+        with self._lock:
+            self.alias_max = getattr(properties, 'TopicAliasMaximum', 0) or 0
+            self._aliases.clear()
+            self._generation += 1
+
+    def publish_args(self, topic: str, state: bool, timestamp: Optional[float] = None):
+        """
+        :param state: a periodically published state topic. Other topics (retained, discovery configs) are sent
+        once in a while, an alias would only take one of the few the broker accepts
+        :return: (topic to send, properties, alias token for `confirm()` or None)
+        """
+        props = Properties(PacketTypes.PUBLISH)
+        token = None
+        out_topic = topic
+
+        if state:
+            if self.message_expiry:
+                props.MessageExpiryInterval = self.message_expiry
+            with self._lock:
+                alias, confirmed = self._aliases.get(topic, (0, False))
+                if not alias and len(self._aliases) < self.alias_max:
+                    alias = len(self._aliases) + 1
+                    self._aliases[topic] = alias, False
+                if alias:
+                    props.TopicAlias = alias
+                    if confirmed:
+                        out_topic = ''
+                    else:
+                        token = topic, self._generation
+
+        if timestamp:
+            props.UserProperty = ('ts', '%.3f' % timestamp)
+
+        return out_topic, props, token
+
+    def confirm(self, token):
+        topic, generation = token
+        with self._lock:
+            if generation == self._generation and topic in self._aliases:
+                self._aliases[topic] = self._aliases[topic][0], True
+
+
+_mqtt5: Optional[Mqtt5Options] = None
+
+
+def mqtt_connect(client_factory, broker: str, port: int, v5=False, message_expiry=None, timeout=5.) -> paho.Client:
+    """
+    Connect and start the network loop.
+    With `v5` try MQTT v5 first and fall back to 3.1.1 if the broker refuses it or doesn't answer the CONNECT.
+    :param client_factory: callable(protocol) returning a configured (credentials, callbacks) paho client
+    """
+    global _mqtt5
+
+    if v5:
+        client: paho.Client = client_factory(MQTTProtocolVersion.MQTTv5)
+        opts = Mqtt5Options(message_expiry=message_expiry)
+        connack = threading.Event()
+        result = {}
+
+        def on_connect(_client, _userdata, _flags, reason_code, properties):
+            result['rc'] = reason_code
+            if not reason_code.is_failure:
+                opts.on_connect(properties)
+            connack.set()
+
+        client.on_connect = on_connect
+        try:
+            client.connect(broker, port=port)
+            client.loop_start()
+            if connack.wait(timeout) and not result['rc'].is_failure:
+                logger.info('mqtt v5 connected, topic alias max %d, message expiry %ss',
+                            opts.alias_max, opts.message_expiry)
+                _mqtt5 = opts
+                return client
+            logger.warning('mqtt v5 connect failed (%s), falling back to v3.1.1', result.get('rc', 'no CONNACK'))
+            client.loop_stop()
+            client.disconnect()
+        except Exception as ex:
+            logger.warning('mqtt v5 connect error %s, falling back to v3.1.1', ex)
+
+    _mqtt5 = None
+    client = client_factory(MQTTProtocolVersion.MQTTv311)
+    try:
+        client.connect(broker, port=port)
+        client.loop_start()
+    except Exception as ex:
+        logger.error('mqtt connection error %s', ex)
+    return client
+
+
+def mqtt_client_factory(username=None, password=None, on_message=None):
+    def _create(protocol):
+        client = paho.Client(CallbackAPIVersion.VERSION2, protocol=protocol)
+        client.enable_logger(logger)
+        if username:
+            client.username_pw_set(username, password)
+        client.on_message = on_message
+        return client
+
+    return _create
+
+
+def mqtt_single_out(client: paho.Client, topic, data, retain=False, timestamp=None, state=True):
+    """
+    :param state: False for messages that are not device state (discovery), they get no MQTT v5 alias and expiry
+    """
     # logger.debug(f'Send data: {data} on topic: {topic}, retain flag: {retain}')
     # print('mqtt: ' + topic, data)
     # return
@@ -106,12 +241,20 @@ def mqtt_single_out(client: paho.Client, topic, data, retain=False):
         logger.debug('topic %s data not changed', topic)
         return False
 
-    mqi: paho.MQTTMessageInfo = client.publish(topic, data, retain=retain)
+    alias_token = None
+    if _mqtt5 is not None:
+        out_topic, props, alias_token = _mqtt5.publish_args(topic, state and not retain, timestamp)
+        mqi: paho.MQTTMessageInfo = client.publish(out_topic, data, retain=retain, properties=props)
+    else:
+        mqi: paho.MQTTMessageInfo = client.publish(topic, data, retain=retain)
     if mqi.rc != paho.MQTT_ERR_SUCCESS:
         if not no_publish_fail_warn:
             logger.warning('mqtt publish %s failed: %s %s', topic, mqi.rc, mqi)
         return False
 
+    if alias_token:
+        _mqtt5.confirm(alias_token)
+
     now = time.time()
     _last_values[topic] = now, data
     global _last_publish_time
@@ -131,129 +274,38 @@ def is_none_or_nan(val):
     return False
 
 
-# units: https://github.com/home-assistant/core/blob/d7ac4bd65379e11461c7ce0893d3533d8d8b8cbf/homeassistant/const.py#L384
-sample_desc = {
-    "soc/total_voltage": {
-        "field": "voltage",
-        "device_class": "voltage",
-        "state_class": "measurement",
-        "unit_of_measurement": "V",
-        "precision": 2,
-        "significant_digits": 4,  # round_to_n
-        "icon": "meter-electric"},
-    "soc/current": {
-        "field": "current",
-        "device_class": "current",
-        "state_class": "measurement",
-        "unit_of_measurement": "A",
-        "precision": 2,
-        "significant_digits": 4,
-    },
-    "soc/balance_current": {
-        "field": "balance_current",
-        "device_class": "current",
-        "state_class": "measurement",
-        "unit_of_measurement": "A",
-        "precision": 2,
-        "significant_digits": 4,
-        "icon": "scale-unbalanced"},
-    "soc/soc_percent": {
-        "field": "soc",
-        "device_class": "battery",
-        "state_class": "measurement",
-        "unit_of_measurement": "%",
-        "precision": 2,
-        "significant_digits": 4,
-        "icon": "battery"},
-    "soc/power": {
-        "field": "power",
-        "device_class": "power",
-        "state_class": "measurement",
-        "unit_of_measurement": "W",
-        "precision": 1,
-        "significant_digits": 4,
-        "icon": "flash"},
-    "soc/capacity": {
-        "field": "capacity",
-        "device_class": None,
-        "state_class": None,
-        "unit_of_measurement": "Ah"
-    },
-    "soc/aged_capacity": {
-        "field": "aged_capacity",
-        "device_class": None,
-        "state_class": None,
-        "unit_of_measurement": "Ah",
-        "precision": 2,
-        "icon": "battery-heart-variant"},
-    "soc/soh": {
-        "field": "soh",
-        "device_class": None,
-        "state_class": "measurement",
-        "unit_of_measurement": "%",
-        "precision": 1,
-        "icon": "battery-heart-variant"},
-    # Topic key kept as ``soc/cycle_capacity`` (and therefore HA's unique_id /
-    # entity_id) so existing user automations and long-term statistics keep
-    # working across the rename. The HA display name is auto-derived from
-    # ``field`` and will refresh to "Total Charge Throughput".
-    "soc/cycle_capacity": {
-        "field": "total_charge_throughput",
-        "device_class": None,
-        "state_class": None,
-        "unit_of_measurement": "Ah"},
-    "soc/num_cycles": {
-        "field": "num_cycles",
-        "device_class": None,
-        "state_class": "measurement",
-        "unit_of_measurement": "N",
-        "icon": "battery-sync"},
-    "mosfet_status/capacity_ah": {
-        "field": "charge",
-        "device_class": None,
-        "state_class": None,
-        "unit_of_measurement": "Ah"},
-    "mosfet_status/temperature": {
-        "field": "mos_temperature",
-        "device_class": "temperature",
-        "state_class": "measurement",
-        "unit_of_measurement": "°C",
-        "icon": "thermometer"},
-    "bms/uptime": {
-        "field": "uptime",
-        "device_class": "duration",
-        "state_class": "measurement",
-        "unit_of_measurement": "s",
-        "precision": 0,
-        "icon": "clock"},
-    "bms/runtime": {
-        "field": "runtime",
-        "device_class": "duration",
-        "state_class": "measurement",
-        "unit_of_measurement": "s",
-        "precision": 0,
-        "icon": "timer-sand"},
-    "soc/total_charge_net": {
-        "field": "total_charge_net",
-        "device_class": None,
-        "state_class": "total_increasing",
-        "unit_of_measurement": "Ah",
-        "icon": "battery-arrow-down"},
-    "meter/sample_count": {
-        "field": "num_samples",
-        "device_class": None,
-        "state_class": "measurement",
-        "unit_of_measurement": "N",
-        "icon": "counter"},
-}
+# Publish tiers, each with its own period and aggregation (see BmsSampler). `tier` in sample_desc assigns a field,
+# the other topic groups are assigned below. Fields with `"aggregate": "last"` are never averaged.
+PUBLISH_TIERS = ('fast', 'medium', 'slow')
+STATE_TIER = 'fast'  # switches, problem, battery_charging, battery_mode
+CELL_VOLTAGES_TIER = 'medium'
+CELL_STATS_TIER = 'slow'  # cell_voltages/min, max, ...
+TEMPERATURES_TIER = 'slow'
+METERS_TIER = 'slow'
+
+# topic -> field description, generated from the field registry (bmslib.fields)
+sample_desc = mqtt_sample_desc()
+
 
+def tier_mean_fields(tier):
+    """ sample fields of `tier` that are averaged when the tier aggregates with `mean` """
+    return tuple(d['field'] for d in sample_desc.values() if d['tier'] == tier and d.get('aggregate') != 'last')
 
-def publish_sample(client, device_topic, sample: BmsSample):
+
+def publish_sample(client, device_topic, sample: BmsSample, tiers=None):
+    """
+    :param tiers: only publish fields of these publish tiers, None for all
+    """
     for k, v in sample_desc.items():
+        if tiers is not None and v['tier'] not in tiers:
+            continue
         topic = f"{device_topic}/{k}"
         s = round_to_n(getattr(sample, v['field']), v.get('significant_digits', 5))
         if not is_none_or_nan(s):
-            mqtt_single_out(client, topic, s)
+            mqtt_single_out(client, topic, s, timestamp=sample.timestamp)
+
+    if tiers is not None and STATE_TIER not in tiers:
+        return
 
     if sample.switches:
         for switch_name, switch_state in sample.switches.items():
@@ -274,7 +326,7 @@ def publish_sample(client, device_topic, sample: BmsSample):
         mqtt_single_out(client, f"{device_topic}/battery_mode", sample.battery_mode)
 
 
-def publish_cell_voltages(client, device_topic, voltages):
+def publish_cell_voltages(client, device_topic, voltages, cells=True, stats=True):
     # "highest_voltage": parts[0] / 1000,
     # "highest_cell": parts[1],
     # "lowest_voltage": parts[2] / 1000,
@@ -283,21 +335,20 @@ def publish_cell_voltages(client, device_topic, voltages):
     if not voltages:
         return
 
-    for i in range(0, len(voltages)):
-        topic = f"{device_topic}/cell_voltages/{i + 1}"
-        mqtt_single_out(client, topic, voltages[i] / 1000)
+    if cells:
+        for i in range(0, len(voltages)):
+            topic = f"{device_topic}/cell_voltages/{i + 1}"
+            mqtt_single_out(client, topic, voltages[i] / 1000)
 
-    if len(voltages) > 1:
-        x = range(len(voltages))
-        high_i = max(x, key=lambda i: voltages[i])
-        low_i = min(x, key=lambda i: voltages[i])
-        mqtt_single_out(client, f"{device_topic}/cell_voltages/min", voltages[low_i] / 1000)
-        mqtt_single_out(client, f"{device_topic}/cell_voltages/min_index", low_i + 1)
-        mqtt_single_out(client, f"{device_topic}/cell_voltages/max", voltages[high_i] / 1000)
-        mqtt_single_out(client, f"{device_topic}/cell_voltages/max_index", high_i + 1)
-        mqtt_single_out(client, f"{device_topic}/cell_voltages/delta", (voltages[high_i] - voltages[low_i]) / 1000)
-        mqtt_single_out(client, f"{device_topic}/cell_voltages/average", round(sum(voltages) / len(voltages)) / 1000)
-        mqtt_single_out(client, f"{device_topic}/cell_voltages/median", statistics.median(voltages) / 1000)
+    st = cell_stats(voltages) if stats and len(voltages) > 1 else None
+    if st:
+        mqtt_single_out(client, f"{device_topic}/cell_voltages/min", st.min / 1000)
+        mqtt_single_out(client, f"{device_topic}/cell_voltages/min_index", st.min_index + 1)
+        mqtt_single_out(client, f"{device_topic}/cell_voltages/max", st.max / 1000)
+        mqtt_single_out(client, f"{device_topic}/cell_voltages/max_index", st.max_index + 1)
+        mqtt_single_out(client, f"{device_topic}/cell_voltages/delta", st.delta / 1000)
+        mqtt_single_out(client, f"{device_topic}/cell_voltages/average", round(st.mean) / 1000)
+        mqtt_single_out(client, f"{device_topic}/cell_voltages/median", st.median / 1000)
 
 
 def publish_temperatures(client, device_topic, temperatures):
@@ -309,15 +360,14 @@ def publish_temperatures(client, device_topic, temperatures):
             mqtt_single_out(client, topic, round_to_n(temperatures[i], 4))
 
 
-def publish_hass_discovery(client, device_topic, expire_after_seconds: int, sample: BmsSample, num_cells,
-                           temperatures,
-                           device_info: DeviceInfo = None):
-    discovery_msg = {}
+def publish_binary_frame(client, device_topic, encoder: BinaryFrameEncoder, sample: BmsSample, voltages):
+    frame, schema = encoder.encode(sample, voltages)
+    if schema and mqtt_single_out(client, f"{device_topic}/bin/schema", json.dumps(schema), retain=True) is not False:
+        encoder.schema_published()  # otherwise retry with the next frame
+    mqtt_single_out(client, f"{device_topic}/bin", frame)
 
-    # HA discovery node_id must match [a-zA-Z0-9_-] (no slashes), so flatten
-    # any '/' in the alias. State topics below keep the original slashes.
-    node_id = device_topic.replace('/', '_')
 
+def _hass_device_json(device_topic, device_info: DeviceInfo = None):
     device_json = {
         "identifiers": [(device_info and device_info.sn) or device_topic],
         "manufacturer": (device_info and device_info.mnf) or None,
@@ -326,9 +376,25 @@ def publish_hass_discovery(client, device_topic, expire_after_seconds: int, samp
         "sw_version": (device_info and device_info.sw_version) or None,
         "hw_version": (device_info and device_info.hw_version) or None,
     }
+    remove_none_values(device_json)
+    return device_json
+
+
+def hass_discovery_components(device_topic, expire_after_seconds: int, sample: BmsSample, num_cells,
+                              temperatures, tier_periods: dict = None):
+    """
+    Entity configs (without the `device` block) for HA discovery.
+    :param tier_periods: publish period per tier, an entity expires after at least 2 periods of its tier
+    :return: dict (component, object_id) -> config
+    """
+    components = {}
+
+    def _expire(tier):
+        return max(expire_after_seconds, int(2 * (tier_periods or {}).get(tier, 0) + .5))
 
     def _hass_discovery(k, device_class, unit, state_class=None, icon=None, name=None, long_expiry=False,
-                        precision=None):
+                        precision=None, tier=STATE_TIER):
+        expire_after = _expire(tier)
         dm = {
             "unique_id": f"{device_topic}__{k.replace('/', '_')}",
             "name": name or capitalize_words(k.replace('/', ' ')),
@@ -340,14 +406,12 @@ def publish_hass_discovery(client, device_topic, expire_after_seconds: int, samp
             "suggested_display_precision": precision,
             # "json_attributes_topic": f"{device_topic}/{k}",
             "state_topic": f"{device_topic}/{k}",
-            "expire_after": max(expire_after_seconds, 3600 * 2) if long_expiry else expire_after_seconds,
-            "device": device_json,
+            "expire_after": max(expire_after, 3600 * 2) if long_expiry else expire_after,
         }
         if icon:
             dm['icon'] = 'mdi:' + icon
         remove_none_values(dm)
-        remove_none_values(dm['device'])
-        discovery_msg[f"homeassistant/sensor/{node_id}/_{k.replace('/', '_')}/config"] = dm
+        components[('sensor', f"_{k.replace('/', '_')}")] = dm
 
     for k, d in sample_desc.items():
         if not is_none_or_nan(getattr(sample, d["field"])):
@@ -356,28 +420,30 @@ def publish_hass_discovery(client, device_topic, expire_after_seconds: int, samp
                             unit=d["unit_of_measurement"],
                             icon=d.get('icon', None),
                             name=capitalize_words(d["field"]),
-                            precision=d.get("precision", None)
+                            precision=d.get("precision", None),
+                            tier=d["tier"],
                             )
 
     for i in range(0, num_cells):
         k = 'cell_voltages/%d' % (i + 1)
         n = 'Cell Volt %0*d' % (1 + int(math.log10(num_cells)), i + 1)
-        _hass_discovery(k, "voltage", name=n, unit="V", precision=3)
+        _hass_discovery(k, "voltage", name=n, unit="V", precision=3, tier=CELL_VOLTAGES_TIER)
 
     if num_cells > 1:
         statistic_fields = ["min", "max", "average", "median", "delta"]
         for f in statistic_fields:
             k = 'cell_voltages/%s' % f
-            _hass_discovery(k, name="Cell Volt %s" % f, device_class="voltage", unit="V", precision=3)
+            _hass_discovery(k, name="Cell Volt %s" % f, device_class="voltage", unit="V", precision=3,
+                            tier=CELL_STATS_TIER)
 
         for f in ["min_index", "max_index"]:
             k = 'cell_voltages/%s' % f
-            _hass_discovery(k, name="Cell Index %s" % f[:3], device_class=None, unit="")
+            _hass_discovery(k, name="Cell Index %s" % f[:3], device_class=None, unit="", tier=CELL_STATS_TIER)
 
     for i in range(0, len(temperatures or [])):
         k = 'temperatures/%d' % (i + 1)
         if not is_none_or_nan(temperatures[i]):
-            _hass_discovery(k, "temperature", unit="°C", precision=1)
+            _hass_discovery(k, "temperature", unit="°C", precision=1, tier=TEMPERATURES_TIER)
 
     meters = {
         # state_class see https://developers.home-assistant.io/docs/core/entity/sensor/#long-term-statistics
@@ -392,79 +458,243 @@ def publish_hass_discovery(client, device_topic, expire_after_seconds: int, samp
         'total_cycles': dict(device_class=None, unit="N", icon="battery-sync", name="total cycle count"),
     }
     for name, m in meters.items():
-        _hass_discovery('meter/%s' % name, **m, long_expiry=True, precision=2)
+        _hass_discovery('meter/%s' % name, **m, long_expiry=True, precision=2, tier=METERS_TIER)
 
     if sample.problem is not None:
-        discovery_msg[f"homeassistant/binary_sensor/{node_id}/problem/config"] = {
+        components[('binary_sensor', 'problem')] = {
             "unique_id": f"{device_topic}__problem",
             "name": "problem",
             "device_class": "problem",
             "entity_category": "diagnostic",
             "state_topic": f"{device_topic}/problem",
-            "expire_after": expire_after_seconds,
-            "device": device_json,
+            "expire_after": _expire(STATE_TIER),
         }
     if sample.problem_code is not None:
-        discovery_msg[f"homeassistant/sensor/{node_id}/problem_code/config"] = {
+        components[('sensor', 'problem_code')] = {
             "unique_id": f"{device_topic}__problem_code",
             "name": "problem code",
             "entity_category": "diagnostic",
             "state_topic": f"{device_topic}/problem_code",
-            "expire_after": expire_after_seconds,
-            "device": device_json,
+            "expire_after": _expire(STATE_TIER),
             "icon": "mdi:alert-circle-outline",
         }
 
     if sample.battery_charging is not None:
-        discovery_msg[f"homeassistant/binary_sensor/{node_id}/battery_charging/config"] = {
+        components[('binary_sensor', 'battery_charging')] = {
             "unique_id": f"{device_topic}__battery_charging",
             "name": "battery charging",
             "device_class": "battery_charging",
             "state_topic": f"{device_topic}/battery_charging",
-            "expire_after": expire_after_seconds,
-            "device": device_json,
+            "expire_after": _expire(STATE_TIER),
         }
     if sample.battery_mode is not None:
-        discovery_msg[f"homeassistant/sensor/{node_id}/battery_mode/config"] = {
+        components[('sensor', 'battery_mode')] = {
             "unique_id": f"{device_topic}__battery_mode",
             "name": "battery mode",
             "device_class": "enum",
             "options": ["UNKNOWN", "BULK", "ABSORPTION", "FLOAT"],
             "state_topic": f"{device_topic}/battery_mode",
-            "expire_after": expire_after_seconds,
-            "device": device_json,
+            "expire_after": _expire(STATE_TIER),
             "icon": "mdi:battery-charging-medium",
         }
 
+    node_id = device_topic.replace('/', '_')
     switches = (sample.switches and sample.switches.keys())
     if switches:
         for switch_name in switches:
-            discovery_msg[f"homeassistant/switch/{node_id}/{switch_name}/config"] = {
+            components[('switch', switch_name)] = {
                 "unique_id": f"{device_topic}__switch_{switch_name}",
                 "name": f"{switch_name}",
                 "device_class": 'outlet',
                 # "json_attributes_topic": f"{device_topic}/{switch_name}",
                 "state_topic": f"{device_topic}/switch/{switch_name}",
-                "expire_after": expire_after_seconds,
-                "device": device_json,
+                "expire_after": _expire(STATE_TIER),
                 "command_topic": f"homeassistant/switch/{node_id}/{switch_name}/set",
             }
 
-            discovery_msg[f"homeassistant/binary_sensor/{node_id}/{switch_name}/config"] = {
+            components[('binary_sensor', switch_name)] = {
                 "unique_id": f"{device_topic}__switch_{switch_name}",
                 "name": f"{switch_name} switch",
                 "device_class": 'power',
                 # "json_attributes_topic": f"{device_topic}/{switch_name}",
-                "expire_after": expire_after_seconds,
-                "device": device_json,
+                "expire_after": _expire(STATE_TIER),
                 "state_topic": f"{device_topic}/switch/{switch_name}",
                 "command_topic": f"homeassistant/switch/{node_id}/{switch_name}/set",
             }
 
-    for topic, data in discovery_msg.items():
-        j = json.dumps(data)
+    return components
+
+
+# https://www.home-assistant.io/integrations/mqtt/#supported-abbreviations-in-mqtt-discovery-messages
+HASS_ABBREVIATIONS = {
+    "unique_id": "uniq_id",
+    "device_class": "dev_cla",
+    "state_class": "stat_cla",
+    "unit_of_measurement": "unit_of_meas",
+    "suggested_display_precision": "sug_dsp_prc",
+    "state_topic": "stat_t",
+    "command_topic": "cmd_t",
+    "expire_after": "exp_aft",
+    "entity_category": "ent_cat",
+    "icon": "ic",
+    "options": "ops",
+    "platform": "p",
+}
+HASS_DEVICE_ABBREVIATIONS = {
+    "identifiers": "ids",
+    "manufacturer": "mf",
+    "model": "mdl",
+    "sw_version": "sw",
+    "hw_version": "hw",
+}
+
+# the MQTT sensor schema doesn't know these, HA drops them. only sent with the legacy entity discovery
+_HASS_DEVICE_DISCOVERY_SKIP = {"native_unit_of_measurement", "suggested_unit_of_measurement"}
+
+# node_ids whose per-entity discovery topics were migrated to device discovery, persisted so it runs once
+_hass_migrated: Optional[set] = None
+_hass_migrated_fn: Optional[str] = None  # defaults to hass_discovery_migrated.json in the data dir
+
+
+def _hass_migrated_store() -> Tuple[set, str]:
+    global _hass_migrated, _hass_migrated_fn
+    if _hass_migrated_fn is None:
+        from bmslib.store import store_file
+        _hass_migrated_fn = store_file('hass_discovery_migrated.json')
+    if _hass_migrated is None:
+        try:
+            with open(_hass_migrated_fn) as fh:
+                _hass_migrated = set(json.load(fh))
+        except FileNotFoundError:
+            _hass_migrated = set()
+        except Exception as e:
+            logger.warning('error reading %s: %s', _hass_migrated_fn, e)
+            _hass_migrated = set()
+    return _hass_migrated, _hass_migrated_fn
+
+
+def _set_hass_migrated(node_id):
+    migrated, fn = _hass_migrated_store()
+    migrated.add(node_id)
+    try:
+        with open(fn + '.tmp', 'w') as fh:
+            json.dump(sorted(migrated), fh)
+        os.replace(fn + '.tmp', fn)
+    except OSError as e:
+        logger.warning('error storing %s: %s', fn, e)
+
+
+def hass_device_discovery_payload(device_topic, components: dict, device_json: dict) -> dict:
+    """
+    Single device-based discovery payload (HA >= 2024.11) with abbreviated keys.
+    Topics below the device topic are written relative to the `~` base topic.
+    """
+    cmps = {}
+    for (component, object_id), config in components.items():
+        key = object_id.lstrip('_')
+        if key in cmps:
+            key = f"{component}_{key}"
+        c = {"p": component}
+        for k, v in config.items():
+            if k in _HASS_DEVICE_DISCOVERY_SKIP:
+                continue
+            if isinstance(v, str) and v.startswith(device_topic + '/') and k.endswith('_topic'):
+                v = '~' + v[len(device_topic):]
+            c[HASS_ABBREVIATIONS.get(k, k)] = v
+        cmps[key] = c
+
+    return {
+        "dev": {HASS_DEVICE_ABBREVIATIONS.get(k, k): v for k, v in device_json.items()},
+        "o": {"name": "batmon", "url": "https://github.com/fl4p/batmon-ha"},
+        "~": device_topic,
+        "cmps": cmps,
+    }
+
+
+def publish_hass_discovery(client, device_topic, expire_after_seconds: int, sample: BmsSample, num_cells,
+                           temperatures,
+                           device_info: DeviceInfo = None,
+                           device_based=False,
+                           tier_periods: dict = None):
+    """
+    :param device_based: send one device-based discovery message (`homeassistant/device/{node_id}/config`) with
+    abbreviated keys instead of one message per entity.
+    :param tier_periods: publish period per tier, see `hass_discovery_components`
+    """
+
+    # HA discovery node_id must match [a-zA-Z0-9_-] (no slashes), so flatten
+    # any '/' in the alias. State topics below keep the original slashes.
+    node_id = device_topic.replace('/', '_')
+
+    device_json = _hass_device_json(device_topic, device_info)
+    components = hass_discovery_components(device_topic, expire_after_seconds, sample, num_cells, temperatures,
+                                           tier_periods=tier_periods)
+    entity_topics = {f"homeassistant/{component}/{node_id}/{object_id}/config": (component, object_id)
+                     for component, object_id in components}
+
+    if device_based:
+        migrate = node_id not in _hass_migrated_store()[0]
+        results = []
+        if migrate:
+            # hand entities discovered through the per-entity topics over to the device config (keeps unique_ids
+            # and entity history), then clear the old topics
+            for topic in entity_topics:
+                results.append(mqtt_single_out(client, topic, json.dumps({"migrate_discovery": True}), state=False))
+
+        j = json.dumps(hass_device_discovery_payload(device_topic, components, device_json), separators=(',', ':'))
+        topic = f"homeassistant/device/{node_id}/config"
         logger.debug('discovery msg %s: %s', topic, j)
-        mqtt_single_out(client, topic, j)
+        results.append(mqtt_single_out(client, topic, j, state=False))
+
+        if migrate:
+            for topic in entity_topics:
+                results.append(mqtt_single_out(client, topic, '', state=False))
+            if client is not None and False not in results:
+                _set_hass_migrated(node_id)
+        return
+
+    for topic, key in entity_topics.items():
+        j = json.dumps({**components[key], "device": device_json})
+        logger.debug('discovery msg %s: %s', topic, j)
+        mqtt_single_out(client, topic, j, state=False)
+
+
+ADDON_TOPIC = 'batmon'  # add-on wide state, not tied to a BMS
+
+_t_addon_stats = 0.
+_t_addon_discovery = 0.
+
+
+def publish_addon_stats(client, stats: dict, period=30., discovery_period=300.):
+    """
+    Add-on wide diagnostics (the memory cache stats, see CACHE_STATS) below `ADDON_TOPIC`, discovered as one HA
+    device. Every sampler calls this, it publishes at most once per `period`.
+    """
+    global _t_addon_stats, _t_addon_discovery
+    now = time.time()
+    if now - _t_addon_discovery >= discovery_period:
+        _t_addon_discovery = now
+        device = {"identifiers": [ADDON_TOPIC], "name": "batmon", "model": "add-on"}
+        for k in stats:
+            config = {
+                "unique_id": f"{ADDON_TOPIC}__cache_{k}",
+                "name": "Cache %s" % k.replace('_', ' '),
+                "state_topic": f"{ADDON_TOPIC}/cache/{k}",
+                "unit_of_measurement": '%' if k == 'hit_percent' else None,
+                "icon": "mdi:memory",
+                "entity_category": "diagnostic",
+                "device": device,
+            }
+            remove_none_values(config)
+            mqtt_single_out(client, f"homeassistant/sensor/{ADDON_TOPIC}/cache_{k}/config", json.dumps(config),
+                            state=False)
+
+    if now - _t_addon_stats < period:
+        return
+    _t_addon_stats = now
+    for k, v in stats.items():
+        if v is not None:
+            mqtt_single_out(client, f"{ADDON_TOPIC}/cache/{k}", v)
 
 
 _switch_callbacks = {}
@@ -125,6 +125,11 @@ class Integrator:
     def restore(self, value):
         self._integrator = value
 
+    def seed(self, x, y):
+        """ continue from sample (x, y) without integrating up to it, e.g. after the clock stepped back """
+        self._last_x = x
+        self._last_y = y
+
 
 class DiffAbsSum(Integrator):
     """
@@ -157,6 +162,255 @@ class DiffAbsSum(Integrator):
         return self
 
 
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+class FilterBank:
+    """
+    One filter for many channels (all cells, all temperatures, all devices of a fleet), updated with one call.
+
+    With numpy the state is held in arrays and an update is a few vector ops for all channels. Without numpy (it is
+    not a dependency of the add-on) the bank falls back to one scalar filter per channel, with the same results.
+    Channels are added when an update is longer than the bank. A nan (or None) input leaves its channel untouched.
+    Per-channel times can be given as a sequence, devices of a fleet are sampled at different times.
+    """
+
+    def __init__(self, size=0, use_numpy: bool = None):
+        np = _numpy() if use_numpy is not False else None
+        if use_numpy and np is None:
+            raise ImportError("numpy is required for use_numpy=True")
+        self.np = np
+        self.size = 0
+        self.resize(size)
+
+    def resize(self, size: int):
+        if size <= self.size:
+            return
+        n = size - self.size
+        if self.np is not None:
+            self._grow_arrays(n)
+        else:
+            self._grow_filters(n)
+        self.size = size
+
+    def _grow_arrays(self, n):
+        raise NotImplementedError()
+
+    def _grow_filters(self, n):
+        raise NotImplementedError()
+
+    def _grow(self, arr, n, fill):
+        return self.np.concatenate((arr, self.np.full(n, fill, dtype=float))) if arr is not None \
+            else self.np.full(n, fill, dtype=float)
+
+    def _input(self, x):
+        """ :return: x as float array (nan for None), resizing the bank """
+        np = self.np
+        x = np.array(x, dtype=float) if None not in x else np.array([math.nan if v is None else v for v in x])
+        self.resize(len(x))
+        return x
+
+    def _time(self, t, n):
+        if self.np is not None:
+            return self.np.broadcast_to(self.np.asarray(t, dtype=float), (n,))
+        return t if isinstance(t, (list, tuple)) else [t] * n
+
+    @staticmethod
+    def _missing(x):
+        return x is None or not math.isfinite(x)
+
+
+class EWMABank(FilterBank):
+    """
+    EWMA per channel. EWMA is sample-indexed, with `dt_max` a channel not updated for more than dt_max
+    (in units of `t`) forgets its history and is seeded with its next value.
+    """
+
+    def __init__(self, span: int, size=0, dt_max: float = None, use_numpy: bool = None):
+        self.span = span
+        self.alpha = 2 / (span + 1)
+        self.dt_max = dt_max
+        self.y = self.t = None
+        super().__init__(size, use_numpy)
+
+    def _grow_arrays(self, n):
+        self.y = self._grow(self.y, n, math.nan)
+        self.t = self._grow(self.t, n, math.nan)
+
+    def _grow_filters(self, n):
+        self.y = (self.y or []) + [EWMA(self.span) for _ in range(n)]
+        self.t = (self.t or []) + [math.nan] * n
+
+    def update(self, x, t=None):
+        """ :return: the smoothed values of the first len(x) channels """
+        if self.np is None:
+            return self._update_filters(x, t)
+        np = self.np
+        x = self._input(x)
+        n = len(x)
+        y = self.y[:n]  # views
+        ok = np.isfinite(x)
+        if t is not None:
+            t = self._time(t, n)
+            if self.dt_max is not None:
+                with np.errstate(invalid='ignore'):
+                    stale = ok & ~(t - self.t[:n] <= self.dt_max)
+                y[stale] = math.nan
+            self.t[:n][ok] = t[ok]
+        seed = ok & ~np.isfinite(y)
+        y[seed] = x[seed]
+        y[ok] = (1 - self.alpha) * y[ok] + self.alpha * x[ok]
+        return y
+
+    def _update_filters(self, x, t):
+        self.resize(len(x))
+        if t is not None:
+            t = self._time(t, len(x))
+        out = []
+        for i, v in enumerate(x):
+            f = self.y[i]
+            if not self._missing(v):
+                if t is not None:
+                    if self.dt_max is not None and not (t[i] - self.t[i] <= self.dt_max):
+                        f.reset()
+                    self.t[i] = t[i]
+                f.add(v)
+            out.append(f.value)
+        return out
+
+    @property
+    def value(self):
+        return self.y if self.np is not None else [f.value for f in self.y]
+
+
+class LHQBank(FilterBank):
+    """ LHQ per channel """
+
+    def __init__(self, span=20, inp_q=0.1, size=0, use_numpy: bool = None):
+        self.inp_q = inp_q
+        self.ewma = EWMABank(span, use_numpy=use_numpy)
+        self.last = None
+        super().__init__(size, use_numpy)
+
+    def _grow_arrays(self, n):
+        self.last = self._grow(self.last, n, math.nan)
+
+    def _grow_filters(self, n):
+        self.last = (self.last or []) + [LHQ(self.ewma.span, self.inp_q) for _ in range(n)]
+
+    def update(self, x):
+        """ :return: the quantized values of the first len(x) channels """
+        if self.np is None:
+            self.resize(len(x))
+            return [f.last if self._missing(v) else f.add(v) for f, v in zip(self.last, x)]
+        np = self.np
+        x = self._input(x)
+        n = len(x)
+        last = self.last[:n]
+        ok = np.isfinite(x)
+        seed = ok & np.isnan(last)
+        last[seed] = x[seed]
+        y = self.ewma.update(x)
+        m = (last[ok] + 2 * y[ok]) / 3
+        last[ok] = np.round(m * 2 / self.inp_q) * .5 * self.inp_q
+        return last
+
+
+class IntegratorBank(FilterBank):
+    """
+    Trapezoidal integration per channel (see Integrator), discarding samples with dx > dx_max.
+    `x` is a scalar or per channel. A channel whose x steps back (clock jump of one device) is re-seeded with its
+    sample instead of integrated, the other channels are not affected. Their indices are in `stepped_back`.
+    """
+
+    def __init__(self, dx_max, size=0, use_numpy: bool = None):
+        self.dx_max = dx_max
+        self._acc = self._last_x = self._last_y = None
+        self.stepped_back = []  # channel indices
+        super().__init__(size, use_numpy)
+
+    def _new_filter(self):
+        return Integrator('', dx_max=self.dx_max)
+
+    def _grow_arrays(self, n):
+        self._acc = self._grow(self._acc, n, 0.)
+        self._last_x = self._grow(self._last_x, n, math.nan)
+        self._last_y = self._grow(self._last_y, n, math.nan)
+
+    def _grow_filters(self, n):
+        self._acc = (self._acc or []) + [self._new_filter() for _ in range(n)]
+
+    def _increment(self, dx, y, last_y):
+        return dx * (last_y + y) / 2
+
+    def _add_filter(self, f, x, y):
+        f.add_linear(x, y)
+
+    def update(self, x, y):
+        """ :return: the integrals of the first len(y) channels """
+        if self.np is None:
+            self.resize(len(y))
+            x = self._time(x, len(y))
+            self.stepped_back = []
+            for i, (f, xi, yi) in enumerate(zip(self._acc, x, y)):
+                if not self._missing(yi):
+                    try:
+                        self._add_filter(f, xi, yi)
+                    except ValueError:
+                        self.stepped_back.append(i)
+                        f.seed(xi, yi)
+            return [f.get() for f in self._acc[:len(y)]]
+        np = self.np
+        y = self._input(y)
+        n = len(y)
+        x = self._time(x, n)
+        ok = np.isfinite(y) & np.isfinite(x)
+        dx = x - self._last_x[:n]
+        with np.errstate(invalid='ignore'):
+            back = ok & (dx < 0)
+            add = ok & (dx >= 0) & (dx <= self.dx_max)
+        self.stepped_back = np.flatnonzero(back).tolist()
+        last_y = self._last_y[:n]
+        self._acc[:n][add] += self._increment(dx[add], y[add], last_y[add])
+        self._last_x[:n][ok] = x[ok]
+        last_y[ok] = y[ok]
+        return self._acc[:n]
+
+    def get(self):
+        return self._acc if self.np is not None else [f.get() for f in self._acc]
+
+    def restore(self, values):
+        self.resize(len(values))
+        for i, v in enumerate(values):
+            if self.np is not None:
+                self._acc[i] = v
+            else:
+                self._acc[i].restore(v)
+
+
+class DiffAbsSumBank(IntegratorBank):
+    """ differential absolute sum per channel (see DiffAbsSum) """
+
+    def __init__(self, dx_max, dy_max, size=0, use_numpy: bool = None):
+        self.dy_max = dy_max
+        super().__init__(dx_max, size, use_numpy)
+
+    def _new_filter(self):
+        return DiffAbsSum('', dx_max=self.dx_max, dy_max=self.dy_max)
+
+    def _increment(self, dx, y, last_y):
+        dy_abs = self.np.abs(y - last_y)
+        return self.np.where(dy_abs <= self.dy_max, dy_abs, 0.)
+
+    def _add_filter(self, f, x, y):
+        f.add_diff(x, y)
+
+
 def test_integrator():
     i = Integrator("test", dx_max=1)
     i += (0, 1)
@@ -0,0 +1,171 @@
+"""
+Native QuestDB InfluxDB-line-protocol (ILP) ingestion, without the C-extension `questdb` client.
+
+Transports:
+* http: POST to /write on the REST port (9000), uncompressed by default. The server validates the whole request
+  and answers with an error, so a rejected batch is reported (and spooled/retried by the sink).
+* tcp: a persistent socket to the ILP port (9009). No acknowledgements: the server closes the connection on a bad
+  line, which is noticed before the next write and retried once on a new connection. No authentication.
+
+`IlpEncoder` maps measurements to table names (`table_prefix` + measurement), writes tags as SYMBOL columns and the
+line timestamp (ns) as the designated timestamp. Column types are pinned on first use, so a later int/float flip of
+the same field is coerced instead of failing the batch.
+
+https://questdb.io/docs/reference/api/ilp/overview/
+"""
+import math
+import re
+import select
+import socket
+import ssl as ssl_
+from typing import Dict, Optional
+
+from bmslib.influx_writer import InfluxHttpWriter, line_batch_end, split_host_port
+from bmslib.lineproto import LineProtocolEncoder, escape_key, format_value
+from bmslib.util import get_logger
+
+logger = get_logger()
+
+# characters QuestDB rejects in table and column names
+_BAD_TABLE_CHARS = re.compile(r'[.?,\'"\\/:()+*%~\r\n\t\x00]')
+_BAD_COLUMN_CHARS = re.compile(r'[.?,\'"\\/:()+\-*%~\r\n\t\x00]')
+
+
+def table_name(s: str) -> str:
+    return _BAD_TABLE_CHARS.sub('_', s)
+
+
+def column_name(s: str) -> str:
+    return _BAD_COLUMN_CHARS.sub('_', s)
+
+
+def _ilp_type(v) -> Optional[str]:
+    if isinstance(v, bool):
+        return 'boolean'
+    if isinstance(v, int):
+        return 'long'
+    if isinstance(v, float):
+        return 'double'
+    if isinstance(v, str):
+        return 'string'
+    return None
+
+
+class IlpEncoder(LineProtocolEncoder):
+
+    def __init__(self, table_prefix='', max_prefixes=4096):
+        super().__init__(max_prefixes=max_prefixes)
+        self.table_prefix = table_prefix
+        self.column_types: Dict[tuple, str] = {}  # (table, column) -> type of the first written value
+
+    def _coerce(self, table, col, v):
+        t = _ilp_type(v)
+        if t is None:
+            return v
+        pinned = self.column_types.setdefault((table, col), t)
+        if pinned == t:
+            return v
+        if pinned == 'double' and t == 'long':
+            return float(v)
+        if pinned == 'long' and t == 'double':
+            return round(v) if math.isfinite(v) else None
+        logger.warning('questdb: dropping %s.%s=%r, column type is %s', table, col, v, pinned)
+        return None
+
+    def encode(self, measurement: str, tags: Optional[dict], fields: dict, time_ns: int) -> Optional[bytes]:
+        table = table_name(self.table_prefix + measurement)
+        parts = []
+        for k in sorted(fields):
+            col = column_name(k)
+            v = format_value(self._coerce(table, col, fields[k]))
+            if v is not None:
+                parts.append(escape_key(col) + '=' + v)
+        if not parts:
+            return None
+        tags = tags and {column_name(k): v for k, v in tags.items()}
+        return b'%s %s %d\n' % (self.prefix(table, tags), ','.join(parts).encode('utf-8'), time_ns)
+
+
+class IlpHttpWriter(InfluxHttpWriter):
+
+    def __init__(self, host='localhost', port=None, compresslevel=None, **kwargs):
+        kwargs.pop('database', None)  # tables are named by the encoder
+        if port is None:
+            host, port = split_host_port(host, 9000)
+        super().__init__(host, port, compresslevel=compresslevel, **kwargs)
+
+
+class IlpTcpWriter:
+
+    def __init__(self, host='localhost', port=None, ssl=False, verify_ssl=False, timeout=10.,
+                 batch_bytes=256 * 1024, **kwargs):
+        if kwargs.get('username'):
+            logger.warning('questdb: ILP/TCP authentication is not supported, use the http transport')
+        if port is None:
+            host, port = split_host_port(host, 9009)
+        self.host = host
+        self.port = int(port)
+        self.ssl = ssl
+        self.verify_ssl = verify_ssl
+        self.timeout = timeout
+        self.batch_bytes = batch_bytes
+        self._sock = None
+        self.num_connects = 0
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.ssl:
+            ctx = ssl_.create_default_context()
+            if not self.verify_ssl:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl_.CERT_NONE
+            sock = ctx.wrap_socket(sock, server_hostname=self.host)
+        self.num_connects += 1
+        return sock
+
+    def _closed_by_server(self) -> bool:
+        """ the server never sends on this connection, so a readable socket means it was closed (error or idle) """
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        return bool(readable)
+
+    def write(self, data):
+        """ Send one batch. Raises on failure. Delivery is not acknowledged by the server. """
+        if not data:
+            return
+        for attempt in range(2):
+            reused = self._sock is not None
+            if reused and self._closed_by_server():
+                logger.warning('questdb: connection closed by server, previous batch may be incomplete')
+                self.close()
+                reused = False
+            if not reused:
+                self._sock = self._connect()
+            try:
+                self._sock.sendall(data)
+                return
+            except (BrokenPipeError, ConnectionResetError):
+                self.close()
+                if not reused or attempt:
+                    raise
+            except Exception:
+                self.close()
+                raise
+
+    def batch_end(self, data, start=0) -> int:
+        return line_batch_end(data, start, self.batch_bytes)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            finally:
+                self._sock = None
+
+
+def make_ilp_writer(transport='http', **kwargs):
+    if transport == 'http':
+        return IlpHttpWriter(**kwargs)
+    if transport == 'tcp':
+        return IlpTcpWriter(**kwargs)
+    raise ValueError('unknown questdb transport %r (http, tcp)' % transport)
@@ -0,0 +1,195 @@
+"""
+Raw BLE/serial frame recorder, to reproduce decode problems and load-test the pipeline without a live pack.
+
+`RecordingClient` wraps the client of a BtBms (BleakClient, SerialBleakClientWrapper, ...) and records every
+notification it receives and every `write_gatt_char` it sends, with the services found on connect, to a compact
+rotating file per device: `<directory>/<device>.bmsrec` (current), `.1`, `.2`, ... (older).
+
+File format: `MAGIC`, then records `<f64 time><u8 kind><u8 char id><u16 length><payload>`. Characteristics are
+numbered per file by CHAR records (payload: the characteristic uuid/handle as text). SERVICES holds the GATT table as
+JSON. Replay with `BleakReplayClient` (bmslib.models.dummy), device address `replay:<file>[@<speed>]`.
+"""
+import json
+import os
+import re
+import struct
+import threading
+import time
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from bmslib.util import get_logger
+
+logger = get_logger()
+
+MAGIC = b'BMSREC\x01\n'
+_HEADER = struct.Struct('<dBBH')
+
+CHAR, RX, TX, SERVICES = 0, 1, 2, 3
+
+_directory: Optional[str] = None
+_recorder_kwargs = {}
+_recorders: Dict[str, 'FrameRecorder'] = {}
+
+
+class Frame(NamedTuple):
+    t: float
+    kind: int
+    char: Optional[str]
+    data: bytes
+
+
+def enable(directory: str, max_bytes=8 * 2 ** 20, backups=3):
+    """ record all BMS clients created from now on """
+    global _directory
+    os.makedirs(directory, exist_ok=True)
+    _directory = directory
+    _recorder_kwargs.update(max_bytes=max_bytes, backups=backups)
+    _recorders.clear()
+
+
+def get_recorder(device_name: str) -> Optional['FrameRecorder']:
+    if _directory is None:
+        return None
+    fn = os.path.join(_directory, re.sub(r'[^\w.-]', '_', device_name) + '.bmsrec')
+    rec = _recorders.get(fn)
+    if rec is None:
+        rec = _recorders[fn] = FrameRecorder(fn, **_recorder_kwargs)
+    return rec
+
+
+def _char_key(char_specifier) -> str:
+    return str(getattr(char_specifier, 'uuid', char_specifier))
+
+
+class FrameRecorder:
+
+    def __init__(self, path: str, max_bytes=8 * 2 ** 20, backups=3, flush_interval=1.):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._fh = None
+        self._size = 0
+        self._chars: Dict[str, int] = {}
+        self._t_flush = 0.
+
+    def _open(self):
+        """ start a new file, each file has its own char table """
+        if os.path.exists(self.path):
+            self._rotate()  # of a previous run, may end with a torn record
+        self._fh = open(self.path, 'wb')
+        self._fh.write(MAGIC)
+        self._size = len(MAGIC)
+        self._chars = {}
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.replace(src, '%s.%d' % (self.path, i + 1))
+        if self.backups:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def _write(self, kind, char_id, payload: bytes, t):
+        self._fh.write(_HEADER.pack(t, kind, char_id, len(payload)) + payload)
+        self._size += _HEADER.size + len(payload)
+
+    def record(self, kind: int, char_specifier, data, t=None):
+        data = bytes(data)[:0xFFFF]
+        t = time.time() if t is None else t
+        with self._lock:
+            if self._fh is None:
+                self._open()
+            elif self._size >= self.max_bytes:
+                self._fh.close()
+                self._open()
+            char_id = 0
+            if char_specifier is not None:
+                key = _char_key(char_specifier)
+                char_id = self._chars.get(key)
+                if char_id is None:
+                    char_id = self._chars[key] = len(self._chars) + 1
+                    self._write(CHAR, char_id, key.encode('utf-8'), t)
+            self._write(kind, char_id, data, t)
+            if t - self._t_flush >= self.flush_interval:
+                self._fh.flush()
+                self._t_flush = t
+
+    def record_services(self, services):
+        table = [dict(uuid=str(s.uuid), characteristics=[
+            dict(uuid=str(c.uuid), handle=c.handle, properties=list(c.properties)) for c in s.characteristics])
+                 for s in services]
+        self.record(SERVICES, None, json.dumps(table).encode('utf-8'))
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+def read_frames(path: str) -> Iterator[Frame]:
+    """ frames of the recording `path` including its rotated files, oldest first """
+    files = []
+    i = 1
+    while os.path.exists('%s.%d' % (path, i)):
+        files.insert(0, '%s.%d' % (path, i))
+        i += 1
+    files.append(path)
+    for fn in files:
+        if not os.path.exists(fn):
+            continue
+        with open(fn, 'rb') as f:
+            buf = f.read()
+        if not buf.startswith(MAGIC):
+            raise ValueError('%s is not a frame recording' % fn)
+        chars = {0: None}
+        off = len(MAGIC)
+        while off + _HEADER.size <= len(buf):
+            t, kind, char_id, n = _HEADER.unpack_from(buf, off)
+            off += _HEADER.size
+            data = buf[off:off + n]
+            if len(data) < n:
+                break  # torn last record
+            off += n
+            if kind == CHAR:
+                chars[char_id] = data.decode('utf-8')
+            else:
+                yield Frame(t, kind, chars.get(char_id), data)
+
+
+class RecordingClient:
+    """ Proxy of a BLE client recording notifications and writes, everything else is passed through """
+
+    def __init__(self, client, recorder: FrameRecorder):
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, item):
+        return getattr(self._client, item)
+
+    async def connect(self, *args, **kwargs):
+        res = await self._client.connect(*args, **kwargs)
+        try:
+            services = self._client.services
+            if services:
+                self._recorder.record_services(services)
+        except Exception as e:
+            logger.debug('recorder: no services of %s: %s', self._recorder.path, e)
+        return res
+
+    async def start_notify(self, char_specifier, callback, **kwargs):
+        recorder = self._recorder
+
+        def _recording_callback(sender, data):
+            recorder.record(RX, char_specifier, data)
+            return callback(sender, data)
+
+        return await self._client.start_notify(char_specifier, _recording_callback, **kwargs)
+
+    async def write_gatt_char(self, char_specifier, data, *args, **kwargs):
+        self._recorder.record(TX, char_specifier, data)
+        return await self._client.write_gatt_char(char_specifier, data, *args, **kwargs)
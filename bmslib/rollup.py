@@ -0,0 +1,121 @@
+"""
+In-process multi-resolution rollups, replacing server-side continuous queries.
+
+For each resolution (seconds, buckets aligned to the epoch) the engine keeps min/max/mean/last of a few sample
+fields and the per-bucket delta of the meters (energy, charge, cycles). A bucket is closed and returned by `add()`
+when the first sample of a later bucket arrives. Meter deltas are taken against the last reading of the previous
+bucket, so no energy is lost between buckets.
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bmslib.bms import BmsSample
+from bmslib.cellstats import cell_stats
+from bmslib.fields import SUMMARY_FIELDS
+
+ROLLUP_FIELDS = SUMMARY_FIELDS
+
+
+def resolution_label(seconds: float) -> str:
+    """ 60 -> '1m', 900 -> '15m', 3600 -> '1h' """
+    seconds = int(seconds)
+    for unit, n in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds % n == 0:
+            return '%d%s' % (seconds // n, unit)
+    return '%ds' % seconds
+
+
+class _Agg:
+    __slots__ = ('min', 'max', 'sum', 'n', 'last')
+
+    def __init__(self):
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.
+        self.n = 0
+        self.last = math.nan
+
+    def add(self, v):
+        if v is None or v != v:  # nan
+            return
+        if v < self.min:
+            self.min = v
+        if v > self.max:
+            self.max = v
+        self.sum += v
+        self.n += 1
+        self.last = v
+
+
+class _Bucket:
+    def __init__(self, start):
+        self.start = start
+        self.aggs: Dict[str, _Agg] = {}
+        self.meters: Dict[str, float] = {}
+
+    def fields(self, prev_meters: Dict[str, float]) -> dict:
+        out = {}
+        for name, a in self.aggs.items():
+            if a.n:
+                out[name + '_min'] = a.min
+                out[name + '_max'] = a.max
+                out[name + '_mean'] = a.sum / a.n
+                out[name + '_last'] = a.last
+        for name, reading in self.meters.items():
+            prev = prev_meters.get(name)
+            if prev is not None:
+                out[name + '_delta'] = reading - prev
+        out['num_samples'] = max((a.n for a in self.aggs.values()), default=0)
+        return out
+
+
+class _Resolution:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.bucket: Optional[_Bucket] = None
+        self.prev_meters: Dict[str, float] = {}  # readings at the end of the previous bucket
+
+
+class RollupEngine:
+
+    def __init__(self, resolutions: Sequence[float] = (60, 900), fields: Sequence[str] = ROLLUP_FIELDS):
+        assert resolutions and all(r > 0 for r in resolutions), "invalid rollup resolutions %s" % (resolutions,)
+        self.resolutions = [_Resolution(float(r)) for r in sorted(set(resolutions))]
+        self.fields = tuple(fields)
+
+    def add(self, sample: BmsSample, voltages: Optional[List[int]] = None,
+            meters: Optional[Dict[str, float]] = None) -> List[Tuple[float, float, dict]]:
+        """
+        :param voltages: cell voltages, rolled up as voltage_cell_min/max
+        :param meters: current meter readings
+        :return: closed buckets [(resolution, bucket start time, fields)]
+        """
+        t = sample.timestamp
+        values = {f: getattr(sample, f) for f in self.fields}
+        st = cell_stats(voltages)
+        if st:
+            values['voltage_cell_min'] = st.min
+            values['voltage_cell_max'] = st.max
+
+        closed = []
+        for res in self.resolutions:
+            start = math.floor(t / res.seconds) * res.seconds
+            b = res.bucket
+            if b is not None and start != b.start:
+                if start < b.start:
+                    continue  # clock went back, ignore until it catches up
+                closed.append((res.seconds, b.start, b.fields(res.prev_meters)))
+                res.prev_meters.update(b.meters)
+                b = None
+            if b is None:
+                b = res.bucket = _Bucket(start)
+                if meters and not res.prev_meters:
+                    res.prev_meters.update(meters)  # first bucket: deltas from the first reading
+            for name, v in values.items():
+                a = b.aggs.get(name)
+                if a is None:
+                    a = b.aggs[name] = _Agg()
+                a.add(v)
+            if meters:
+                b.meters.update(meters)
+        return closed
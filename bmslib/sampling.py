@@ -4,7 +4,6 @@ import random
 import re
 import sys
 import time
-from collections import defaultdict
 from copy import copy
 from typing import Optional, List, Dict
 
@@ -13,12 +12,17 @@ import paho.mqtt.client
 
 import bmslib.bt
 from bmslib.algorithm import create_algorithm
+from bmslib.binframe import BinaryFrameEncoder
 from bmslib.bms import DeviceInfo, BmsSample, MIN_VALUE_EXPIRY
-from bmslib.cache.mem import mem_cache_deco
+from bmslib.cache.mem import mem_cache_deco, shared_managed_mem_cache
+from bmslib.cellstats import CellVoltages
+from bmslib.fleet import FleetProcessor
 from bmslib.group import BmsGroup, GroupNotReady
 from bmslib.mqtt_util import publish_sample, publish_cell_voltages, publish_temperatures, publish_hass_discovery, \
-    subscribe_switches, mqtt_single_out
-from bmslib.pwmath import Integrator, DiffAbsSum, LHQ
+    subscribe_switches, mqtt_single_out, publish_binary_frame, PUBLISH_TIERS, tier_mean_fields, CELL_VOLTAGES_TIER, \
+    CELL_STATS_TIER, TEMPERATURES_TIER, METERS_TIER, publish_addon_stats
+from bmslib.pwmath import Integrator, DiffAbsSum, LHQ, LHQBank
+from bmslib.rollup import RollupEngine
 from bmslib.util import get_logger, summarize_exc
 
 logger = get_logger(verbose=False)
@@ -54,6 +58,23 @@ class PeriodicBoolSignal:
             self.state = True
 
 
+class PublishTier:
+    """
+    A group of MQTT topics published at its own period. With `aggregate='mean'` the tier's numeric fields are averaged
+    over the samples since the last publish, with `last` the latest sample is published.
+    """
+
+    def __init__(self, name, period, aggregate='mean'):
+        assert aggregate in ('mean', 'last'), "unknown aggregate %s" % aggregate
+        self.name = name
+        self.aggregate = aggregate
+        self.period = PeriodicBoolSignal(period=period or 0)
+        self.downsampler = Downsampler(fields=tier_mean_fields(name) if aggregate == 'mean' else ())
+
+    def __repr__(self):
+        return 'PublishTier(%s,%.1fs,%s)' % (self.name, self.period.period, self.aggregate)
+
+
 class BmsSampleSink:
     """ Interface of an arbitrary data sink of battery samples """
 
@@ -66,6 +87,10 @@ class BmsSampleSink:
     def publish_meters(self, bms_name: str, readings: Dict[str, float]):
         raise NotImplementedError()
 
+    def publish_rollup(self, bms_name: str, resolution: float, timestamp: float, fields: Dict[str, float]):
+        """ a closed rollup bucket (see bmslib.rollup) starting at `timestamp` """
+        raise NotImplementedError()
+
 
 class BmsSampler:
     """
@@ -84,8 +109,19 @@ class BmsSampler:
                  algorithms: Optional[list] = None,
                  current_calibration_factor=1.0,
                  over_power=None,
-                 bms_group: Optional[BmsGroup] = None
+                 bms_group: Optional[BmsGroup] = None,
+                 hass_discovery='entity',
+                 mqtt_binary=False,
+                 publish_tiers: Optional[dict] = None,
+                 rollups: Optional[List[float]] = None,
+                 fleet: Optional[FleetProcessor] = None,
                  ):
+        """
+        :param publish_tiers: per tier (fast, medium, slow) an optional `<tier>_period` and `<tier>_aggregate`
+        (mean|last). Periods default to `publish_period`.
+        :param rollups: resolutions in seconds of the rollups written to the sinks
+        :param fleet: integrate the meters in batch with the other samplers of the fleet
+        """
 
         self.bms = bms
         self.mqtt_topic_prefix = re.sub(r'[^\w_.-/]', '_', bms.name)
@@ -97,14 +133,21 @@ class BmsSampler:
         self.bms_group = bms_group  # group, virtual, parent
         self.current_calibration_factor = current_calibration_factor
         self.over_power = over_power or math.nan
+        self.hass_discovery = hass_discovery or 'entity'
+        self.bin_encoder = BinaryFrameEncoder() if mqtt_binary else None
 
         self.sinks = sinks or []
+        self.rollup = RollupEngine(rollups) if (rollups and self.sinks) else None
 
-        self.downsampler = Downsampler()
+        publish_tiers = publish_tiers or {}
+        self.tiers = {t: PublishTier(t, period=publish_tiers.get(t + '_period') or publish_period,
+                                     aggregate=(publish_tiers.get(t + '_aggregate')
+                                                or ('last' if t == 'slow' else 'mean')))
+                      for t in PUBLISH_TIERS}
 
-        self.period_pub = PeriodicBoolSignal(period=publish_period or 0)
+        self.period_pub = self.tiers['fast'].period
         self.period_discov = PeriodicBoolSignal(60 * 5)
-        self.period_30s = PeriodicBoolSignal(period=30)
+        self.period_meters = PeriodicBoolSignal(period=max(30, self.tiers[METERS_TIER].period.period))
 
         self._t_wd_reset = time.time()  # watchdog
         self._last_time_log = 0
@@ -123,6 +166,22 @@ class BmsSampler:
             algorithm = algorithms[0]
             self.algorithm = create_algorithm(algorithm, bms_name=bms.name)
 
+        if fleet:
+            self.meters = fleet.register(bms.name, meter_state)
+            (self.current_integrator, self.power_integrator, self.power_integrator_discharge,
+             self.power_integrator_charge, self.cycle_integrator, self.charge_integrator) = self.meters
+        else:
+            self._init_meters(dt_max_seconds, meter_state)
+
+        # self.power_stats = EWM(span=120, std_regularisation=0.1)
+
+        temp_step = getattr(bms, 'TEMPERATURE_STEP', 0)
+        temp_smooth = getattr(bms, 'TEMPERATURE_SMOOTH', 10)
+        # one filter bank for all temperature sensors, the MOS sensor separately
+        self._lhq_temp = LHQBank(span=temp_smooth, inp_q=temp_step) if temp_step else None
+        self._lhq_mos = LHQ(span=temp_smooth, inp_q=temp_step) if temp_step else None
+
+    def _init_meters(self, dt_max_seconds, meter_state):
         dx_max = dt_max_seconds / 3600
         self.current_integrator = Integrator(name="total_charge", dx_max=dx_max)
         self.power_integrator = Integrator(name="total_energy", dx_max=dx_max)
@@ -141,12 +200,6 @@ class BmsSampler:
             if meter_state and meter.name in meter_state:
                 meter.restore(meter_state[meter.name]['reading'])
 
-        # self.power_stats = EWM(span=120, std_regularisation=0.1)
-
-        temp_step = getattr(bms, 'TEMPERATURE_STEP', 0)
-        temp_smooth = getattr(bms, 'TEMPERATURE_SMOOTH', 10)
-        self._lhq_temp = defaultdict(lambda: LHQ(span=temp_smooth, inp_q=temp_step)) if temp_step else None
-
     def get_meter_state(self):
         return {meter.name: dict(reading=meter.get()) for meter in self.meters}
 
@@ -229,17 +282,21 @@ class BmsSampler:
 
             raise
 
-    @mem_cache_deco(ttl=30)
+    @mem_cache_deco(ttl=30, error_ttl=10)
     async def _fetch_temperatures_cached(self):
+        return await self.bms.fetch_temperatures()
+
+    async def _fetch_temperatures(self):
+        """ temperatures from the (cached) separate fetch, None if the BMS has none or the fetch failed """
         try:
-            return await self.bms.fetch_temperatures()
-        except:
+            return await self._fetch_temperatures_cached()
+        except Exception:
             return None
 
     def _filter_temperatures(self, temperatures):
         if not temperatures or self._lhq_temp is None:
             return temperatures
-        return [round(self._lhq_temp[i].add(temperatures[i]), 2) for i in range(len(temperatures))]
+        return [round(float(t), 2) for t in self._lhq_temp.update(temperatures)]
 
     async def _sample_inner(self):
         bms = self.bms
@@ -299,12 +356,12 @@ class BmsSampler:
             # self.power_stats.add(sample.power)
 
             if (self.sinks or self.bms_group) and not sample.temperatures:
-                sample.temperatures = await self._fetch_temperatures_cached()
+                sample.temperatures = await self._fetch_temperatures()
 
             sample.temperatures = self._filter_temperatures(sample.temperatures)
 
-            if not math.isnan(sample.mos_temperature) and self._lhq_temp is not None:
-                sample.mos_temperature = self._lhq_temp['mos'].add(sample.mos_temperature)
+            if not math.isnan(sample.mos_temperature) and self._lhq_mos is not None:
+                sample.mos_temperature = self._lhq_mos.add(sample.mos_temperature)
 
             if self.bms_group:
                 # update before invert current
@@ -369,7 +426,8 @@ class BmsSampler:
                     logger.error('sink %s publish_sample failed: %s',
                                  type(sink).__name__, summarize_exc(e))
 
-            self.downsampler += sample
+            for tier in self.tiers.values():
+                tier.downsampler += sample
 
             log_data = (t_now - self._last_time_log) >= (60 if self.num_samples < 1000 else 300) or bms.verbose_log
             if log_data:
@@ -385,6 +443,8 @@ class BmsSampler:
                 # TODO fetch_voltages at t_fetch interval and down-sampling?
                 try:
                     voltages = await bms.fetch_voltages()
+                    if voltages is not None:
+                        voltages = CellVoltages(voltages)  # statistics computed once for all consumers
 
                     if self.bms_group:
                         self.bms_group.update_voltages(bms, voltages)
@@ -398,7 +458,16 @@ class BmsSampler:
             if self.sinks:
                 voltages = await cached_fetch_voltages()
                 for sink in self.sinks:
-                    sink.publish_voltages(bms.name, voltages)
+                    try:
+                        sink.publish_voltages(bms.name, voltages)
+                    except Exception as e:
+                        logger.error('sink %s publish_voltages failed: %s',
+                                     type(sink).__name__, summarize_exc(e))
+
+            if self.rollup:
+                readings = {m.name: m.get() for m in self.meters}
+                for res, t_bucket, fields in self.rollup.add(sample, voltages, readings):
+                    self.publish_rollup(res, t_bucket, fields)
 
             # z_score = self.power_stats.z_score(sample.power)
             # if abs(z_score) > 12:
@@ -416,38 +485,51 @@ class BmsSampler:
                 self._t_last_power_jump = t_now
             self._last_power = sample.power
 
-            if self.period_discov or self.period_pub or \
-                    (t_now - self._t_last_power_jump) < PWR_CHG_HOLD or abs(sample.power) > self.over_power:
-                self._t_pub = t_now
+            power_event = (t_now - self._t_last_power_jump) < PWR_CHG_HOLD or abs(sample.power) > self.over_power
+            due = [t.name for t in self.tiers.values()
+                   if self.period_discov or t.period or (power_event and t.name == 'fast')]
 
-                sample = self.downsampler.pop()
+            if due:
+                self._t_pub = t_now
 
-                publish_sample(mqtt_client, device_topic=self.mqtt_topic_prefix, sample=sample)
+                tier_samples = {t: self.tiers[t].downsampler.pop() for t in due}
+                for t, tier_sample in tier_samples.items():
+                    publish_sample(mqtt_client, device_topic=self.mqtt_topic_prefix, sample=tier_sample, tiers=(t,))
+                sample = tier_samples.get('fast') or next(iter(tier_samples.values()))
                 log_data and logger.info('%s: %s', bms.name, sample)
 
-                voltages = await cached_fetch_voltages()
-                publish_cell_voltages(mqtt_client, device_topic=self.mqtt_topic_prefix, voltages=voltages)
-
-                # Publish temperatures every cycle so the HA entity doesn't
-                # flicker to "unavailable" (#207). Temps change slowly, so
-                # gating them to a 30s tick meant nothing republished them
-                # between ticks while expire_after defaults to 20s. Publishing
-                # every cycle lets mqtt_single_out's keep-alive republish
-                # unchanged values every MIN_VALUE_EXPIRY/2 s, well within
-                # expire_after. The separate BMS fetch stays rate-limited by its
+                if CELL_VOLTAGES_TIER in due or CELL_STATS_TIER in due:
+                    voltages = await cached_fetch_voltages()
+                    publish_cell_voltages(mqtt_client, device_topic=self.mqtt_topic_prefix, voltages=voltages,
+                                          cells=CELL_VOLTAGES_TIER in due, stats=CELL_STATS_TIER in due)
+
+                # Publish temperatures on every tick of their tier so the HA entity doesn't
+                # flicker to "unavailable" (#207). Discovery sets expire_after to at least two
+                # tier periods, and mqtt_single_out's keep-alive republishes unchanged values
+                # every MIN_VALUE_EXPIRY/2 s. The separate BMS fetch stays rate-limited by its
                 # 30s mem-cache, so this adds no extra BLE traffic.
                 if not sample.temperatures:
-                    sample.temperatures = await self._fetch_temperatures_cached()
+                    sample.temperatures = await self._fetch_temperatures()
                     sample.temperatures = self._filter_temperatures(sample.temperatures)
-                publish_temperatures(mqtt_client, device_topic=self.mqtt_topic_prefix,
-                                     temperatures=sample.temperatures)
+                if TEMPERATURES_TIER in due:
+                    publish_temperatures(mqtt_client, device_topic=self.mqtt_topic_prefix,
+                                         temperatures=sample.temperatures)
+
+                if self.bin_encoder and 'fast' in due:
+                    voltages = await cached_fetch_voltages()
+                    try:
+                        publish_binary_frame(mqtt_client, device_topic=self.mqtt_topic_prefix,
+                                             encoder=self.bin_encoder, sample=sample, voltages=voltages)
+                    except ValueError as e:
+                        logger.error('%s binary frames disabled: %s', bms.name, e)
+                        self.bin_encoder = None
 
                 if log_data and (voltages or sample.temperatures) and not bms.is_virtual:
                     logger.info('%s volt=[%s] temp=%s', bms.name,
                                 ','.join(map(str, voltages)) if voltages else voltages,
                                 sample.temperatures)
 
-            if self.period_discov or self.period_30s:
+            if self.period_discov or self.period_meters:
                 self.publish_meters()
 
             # publish home assistant discovery every 60 samples
@@ -462,10 +544,12 @@ class BmsSampler:
                     num_cells=len(voltages) if voltages else 0,
                     temperatures=sample.temperatures,
                     device_info=self.device_info,
+                    device_based=self.hass_discovery == 'device',
+                    tier_periods={t.name: t.period.period for t in self.tiers.values()},
                 )
 
                 # publish sample again after discovery
-                if self.period_pub.period > 2:
+                if max(t.period.period for t in self.tiers.values()) > 2:
                     await asyncio.sleep(1)
                     publish_sample(mqtt_client, device_topic=self.mqtt_topic_prefix, sample=sample)
 
@@ -473,8 +557,9 @@ class BmsSampler:
         t_disc = time.time()
         self._t_wd_reset = sample.timestamp or t_disc
 
-        self.period_pub.set_time(t_now)
-        self.period_30s.set_time(t_now)
+        for tier in self.tiers.values():
+            tier.period.set_time(t_now)
+        self.period_meters.set_time(t_now)
         self.period_discov.set_time(t_now)
 
         dt_conn = t_fetch - t_conn
@@ -496,6 +581,8 @@ class BmsSampler:
             s = round(meter.get(), 3)
             mqtt_single_out(self.mqtt_client, topic, s)
 
+        publish_addon_stats(self.mqtt_client, shared_managed_mem_cache().stats())
+
         if self.sinks:
             readings = {m.name: m.get() for m in self.meters}
             for sink in self.sinks:
@@ -507,6 +594,15 @@ class BmsSampler:
                     logger.error('sink %s publish_meters failed: %s',
                                  type(sink).__name__, summarize_exc(e))
 
+    def publish_rollup(self, resolution, t_bucket, fields):
+        for sink in self.sinks:
+            try:
+                sink.publish_rollup(self.bms.name, resolution, t_bucket, fields)
+            except NotImplementedError:
+                pass
+            except Exception as e:
+                logger.error('sink %s publish_rollup failed: %s', type(sink).__name__, summarize_exc(e))
+
     async def _try_fetch_device_info(self):
         try:
             di = await self.bms.fetch_device_info()
@@ -520,19 +616,21 @@ class BmsSampler:
 
 
 class Downsampler:
-    """ Averages multiple BmsSamples """
+    """ Averages `fields` of multiple BmsSamples (ignoring nan), other fields are taken from the last sample """
 
-    def __init__(self):
-        self._power = 0
-        self._current = 0
-        self._voltage = 0
+    def __init__(self, fields=('power', 'current', 'voltage')):
+        self.fields = tuple(fields)
+        self._sum = dict.fromkeys(self.fields, 0.)
+        self._cnt = dict.fromkeys(self.fields, 0)
         self._num = 0
         self._last: Optional[BmsSample] = None
 
     def __iadd__(self, s: BmsSample):
-        self._power += s.power
-        self._current += s.current
-        self._voltage += s.voltage
+        for f in self.fields:
+            v = getattr(s, f)
+            if v is not None and not math.isnan(v):
+                self._sum[f] += v
+                self._cnt[f] += 1
         self._num += 1
         self._last = s
         return self
@@ -541,20 +639,17 @@ class Downsampler:
         if self._num == 0:
             return None
 
-        if self._num == 1:
-            return self._last
-
-        n = 1 / self._num
-        s = copy(self._last)
-
-        if not math.isnan(s._power):
-            s._power = self._power * n
-        s.current = self._current * n
-        s.voltage = self._voltage * n
-
-        self._power = 0
-        self._current = 0
-        self._voltage = 0
+        s = self._last
+        if self._num > 1 and self.fields:
+            s = copy(s)
+            for f in self.fields:
+                if self._cnt[f]:
+                    # power is a property, set the backing field
+                    setattr(s, '_power' if f == 'power' else f, self._sum[f] / self._cnt[f])
+
+        for f in self.fields:
+            self._sum[f] = 0.
+            self._cnt[f] = 0
         self._num = 0
         self._last = None
 
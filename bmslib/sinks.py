@@ -1,21 +1,27 @@
 import base64
-import datetime
 import hashlib
 import math
 import os
-import queue
-import random
-import statistics
+import re
 import threading
 import time
-import zlib
-from typing import List, Dict, Union
+from typing import List, Dict, Optional, Union
 
 from bmslib.bms import BmsSample
 from bmslib.bt import BtBms
+from bmslib.cellenc import CellEncoding
+from bmslib.cellstats import cell_stats
+from bmslib.fields import QUESTDB_INT_SCALE, SUMMARY_FIELDS, serializer
+from bmslib.changes import ChangeTracker
 from bmslib.circuit_breaker import CircuitBreaker
-from bmslib.mqtt_util import remove_none_values, remove_equal_values
+from bmslib.influx_writer import InfluxHttpWriter
+from bmslib.lineproto import LineProtocolEncoder
+from bmslib.mqtt_util import remove_none_values
+from bmslib.questdb_writer import IlpEncoder, make_ilp_writer
+from bmslib.rollup import resolution_label
 from bmslib.sampling import BmsSampleSink
+from bmslib.streamstats import StreamStats
+from bmslib.tsstore import TimeSeriesStore
 from bmslib.util import get_logger, sid_generator
 
 logger = get_logger()
@@ -36,185 +42,257 @@ def flatten(dictionary, parent_key='', separator='_'):
     return dict(items)
 
 
+# sample -> flat fields, compiled from the field registry (bmslib.fields)
+_serialize_influx = serializer('influx')
+_serialize_questdb = serializer('questdb')
+_serialize_raw = serializer('raw')
+
+
+def _valid_voltage(v):
+    return v is not None and not (isinstance(v, float) and not math.isfinite(v))
+
+
+def _cells_mv(voltages) -> Dict[int, int]:
+    """ integer mV of the valid cells by index """
+    return {i: int(round(v)) for i, v in enumerate(voltages) if _valid_voltage(v)}
+
+
 class InfluxDBSink(BmsSampleSink):
-    def __init__(self, flush_interval=2, backoff_interval=0, **kwargs):
-        import influxdb
-        self.influxdb_client = influxdb.InfluxDBClient(**kwargs)
-
-        def _request_gzip(data, headers, **kwargs):
-            if headers is None:
-                headers = {}
-            if data:
-                headers['content-encoding'] = 'gzip'
-                compress = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
-                # n = len(data)
-                data = compress.compress(data) + compress.flush()
-                headers['Content-Length'] = str(len(data))
-                # logger.debug("comp ratio %.2f %s %s", len(data) / n, len(data), self.influxdb_client._database)
-
-            return self.influxdb_client._session.request_(data=data, headers=headers, **kwargs)
-
-        self.influxdb_client._session.request_ = self.influxdb_client._session.request
-        self.influxdb_client._session.request = _request_gzip
-
-        self.Q = queue.Queue(50_000)
+    """
+    Points are encoded to line protocol at publish time into a byte buffer (bounded to `max_lines`); the flush
+    thread only compresses and POSTs it to /write (see InfluxHttpWriter). The buffer is flushed every
+    `flush_interval` seconds, or earlier once it holds `flush_bytes`.
+
+    Unchanged values are skipped, but each field is written at least every `heartbeat` seconds (see ChangeTracker).
+    Cell voltages are written as integer mV in `cell_encoding` (wide, packed and/or rows, see bmslib.cellenc).
+
+    With `spool` batches the server didn't take go to an on-disk spool (see bmslib.spool) instead of being dropped.
+    Once the spool holds data, new batches queue up behind it to keep the order, and the spool is sent
+    (backfilled) at most `backfill_rate` bytes/s.
+    """
+
+    def __init__(self, flush_interval=2, backoff_interval=0, max_lines=50_000, spool=None, spool_max_mb=256,
+                 backfill_rate=256_000, compression_level=6, flush_bytes=None, heartbeat=300, cell_encoding='wide,rows',
+                 **kwargs):
+        """
+        :param spool: spool directory, True for the default directory under /data
+        :param kwargs: connection (host, port, username, password, database, ssl, verify_ssl, timeout)
+        """
+        self.writer = self._make_writer(compression_level=compression_level, **kwargs)
+
+        self.encoder = self._make_encoder(kwargs.get('database'))
+        self.max_lines = max_lines
+        self.flush_bytes = flush_bytes
+        self._buf = bytearray()
+        self._spare = bytearray()  # the buffer of the last flush, reused
+        self._num_lines = 0
+        self._buf_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # the spare buffer is in use until a flush completes
         self.db = kwargs.get('database')
-        self._last_volt: Dict[str, List[int]] = {}
+        self.changes = ChangeTracker(heartbeat=float(heartbeat))
+        self.cell_encoding = CellEncoding(cell_encoding)
         self.flush_interval = flush_interval
         self.silent = False
         self.cb = CircuitBreaker(backoff_interval)
 
-        self._prev_fields = {}
-
-        if not kwargs.get('verify_ssl', False):
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.spool = None
+        self.backfill_rate = backfill_rate
+        if spool:
+            from bmslib.spool import SegmentSpool
+            from bmslib.store import store_file
+            if not isinstance(spool, str):
+                spool = store_file('spool/%s_%s' % (type(self).__name__.lower(), re.sub(r'[^\w.-]', '_', str(
+                    kwargs.get('host')) + '_' + str(self.db))))
+            self.spool = SegmentSpool(spool, max_bytes=int(spool_max_mb * 2 ** 20))
 
         self._stop_event = threading.Event()
+        self._wake = threading.Event()
         self._flush_thread = threading.Thread(
             target=self._flush_loop, name='InfluxDBSinkFlush', daemon=True)
         self._flush_thread.start()
 
+    def _make_writer(self, compression_level, **kwargs):
+        return InfluxHttpWriter(compresslevel=int(compression_level), **kwargs)
+
+    def _make_encoder(self, database):
+        return LineProtocolEncoder()
+
     def publish_voltages(self, bms_name, voltages: List[Union[int,float]], short=False, tags=None):
         if not voltages:
             return
-        tags = tags or {}
-
-        if bms_name not in self._last_volt or len(voltages) != len(self._last_volt[bms_name]):
-            self._last_volt[bms_name] = [-1] * len(voltages)
-
-        last_volt = self._last_volt[bms_name]
-
-        pub_anyway = random.random() < (1 / 100)
-
-        def _valid(v):
-            return v is not None and not (isinstance(v, float) and not math.isfinite(v))
+        fields = {}
+        if not short:
+            st = cell_stats(voltages)
+            if st:
+                fields["voltage_cell_max"] = int(st.max)
+                fields["voltage_cell_min"] = int(st.min)
+                fields["voltage_cell_mean"] = float(st.mean)
+                fields["voltage_cell_median"] = float(st.median)
 
-        fields = {(f"voltage_cell%03i" % i): int(voltages[i]) for i in range(len(voltages)) if
-                  _valid(voltages[i]) and (voltages[i] != last_volt[i] or pub_anyway)}
+        self._publish_cells(bms_name, _cells_mv(voltages), tags or {}, fields, rows=not short)
 
-        if not short:
-            valid_voltages = [v for v in voltages if _valid(v)]
-            if valid_voltages:
-                fields["voltage_cell_max"] = int(max(valid_voltages))
-                fields["voltage_cell_min"] = int(min(valid_voltages))
-                fields["voltage_cell_mean"] = float(statistics.mean(valid_voltages))
-                fields["voltage_cell_median"] = float(statistics.median(valid_voltages))
+    def _publish_cells(self, bms_name, cells: Dict[int, int], tags: dict, fields: dict, rows: bool):
+        """ write the changed cells in the configured encoding, `fields` are added to the device row """
+        now = time.time()
+        changed = self.changes.changed((bms_name, 'cells'), cells, now)
+        fields.update(self.cell_encoding.fields(cells, changed))
 
+        now_ns = int(now * 1e9)
         if fields:
-            point = {
-                "measurement": 'batmon',
-                "time": datetime.datetime.utcnow(),
-                "fields": fields,
-                "tags": dict(device=bms_name, **tags)
-            }
-            self._enqueue(point)
-
-        for i in range(len(voltages)):
-            if not _valid(voltages[i]):
-                continue
-            if voltages[i] == last_volt[i] and not pub_anyway:
-                continue
-            last_volt[i] = voltages[i]
-
-            if not short:
-                point = {
-                    "measurement": 'cells',
-                    "time": datetime.datetime.utcnow(),
-                    "fields": dict(voltage=int(round(voltages[i]))),
-                    "tags": dict(device=bms_name, cell_index=i, **tags),
-                }
-                self._enqueue(point)
+            self._enqueue('batmon', dict(device=bms_name, **tags), fields, now_ns)
 
-    def publish_sample(self, bms_name, sample: BmsSample, tags=None):
-        fields = flatten({**sample.values(), "timestamp": None})
-        remove_none_values(fields)
-        for k, v in fields.items():
-            if isinstance(v, int):
-                fields[k] = float(v)
-            elif isinstance(v, float):
-                fields[k] = round(v, 3)
-        fields1 = dict(fields)
-        if random.random() > (1 / 200):
-            remove_equal_values(fields, self._prev_fields.get(bms_name))
-        self._prev_fields[bms_name] = fields1
+        if rows:
+            for i, cell_fields in self.cell_encoding.cell_rows(changed):
+                self._enqueue('cells', dict(device=bms_name, cell_index=i, **tags), cell_fields, now_ns)
 
+    def publish_sample(self, bms_name, sample: BmsSample, tags=None):
+        fields = self.changes.changed((bms_name, 'sample'), _serialize_influx(sample), sample.timestamp)
         if not fields:
             return
-        point = {
-            "measurement": 'batmon',
-            "time": int(math.ceil(sample.timestamp * 1e3)),
-            "fields": fields,
-            "tags": dict(device=bms_name)
-        }
+        point_tags = dict(device=bms_name)
         if tags:
-            point['tags'].update(tags)
-        self._enqueue(point)
+            point_tags.update(tags)
+        self._enqueue('batmon', point_tags, fields, int(sample.timestamp * 1e9))
 
     def publish_meters(self, bms_name, readings: Dict[str, float]):
-        now = datetime.datetime.utcnow()
-        point = {
-            "measurement": 'batmon',
-            "time": now,
-            "fields": {(f"meter_%s" % name): round(value, 5) for name, value in readings.items()},
-            "tags": dict(device=bms_name)
-        }
-        self._enqueue(point)
-
-    def _enqueue(self, point):
+        self._enqueue('batmon', dict(device=bms_name),
+                      {(f"meter_%s" % name): round(value, 5) for name, value in readings.items()},
+                      time.time_ns())
+
+    def publish_rollup(self, bms_name, resolution: float, timestamp: float, fields: Dict[str, float]):
+        """ one point per bucket in measurement `batmon_<resolution>`, e.g. batmon_1m """
+        fields = {k: round(v, 4) if isinstance(v, float) else v for k, v in fields.items()}
+        self._enqueue('batmon_' + resolution_label(resolution), dict(device=bms_name), fields,
+                      int(timestamp * 1e9))
+
+    def _enqueue(self, measurement, tags, fields, time_ns):
         # During an outage backoff with no prior success, drop new points so
         # memory stays flat (the server may be unreachable for this user).
-        remove_none_values(point['tags'])
         if self.cb.enabled and not self.cb.keep_batch_on_failure \
-                and not self.cb.should_attempt():
+                and not self.cb.should_attempt() and self.spool is None:
             return
-        try:
-            self.Q.put_nowait(point)
-        except queue.Full:
-            pass  # bounded memory: drop the newest point
+        line = self.encoder.encode(measurement, tags, fields, time_ns)
+        if line is None:
+            return
+        with self._buf_lock:
+            if self._num_lines >= self.max_lines:
+                return  # bounded memory: drop the newest point
+            self._buf += line
+            self._num_lines += 1
+            if self.flush_bytes and len(self._buf) >= self.flush_bytes:
+                self._wake.set()
+
+    def qsize(self):
+        """ number of buffered points """
+        return self._num_lines
 
     def _drain_queue(self):
-        try:
-            while True:
-                self.Q.get_nowait()
-        except queue.Empty:
-            pass
+        with self._buf_lock:
+            self._buf.clear()
+            self._num_lines = 0
+
+    def _requeue(self, data: bytearray, num_lines):
+        """ put a failed batch back in front of the points buffered since """
+        with self._buf_lock:
+            if self._num_lines + num_lines <= self.max_lines:
+                self._buf[0:0] = data
+                self._num_lines += num_lines
+
+    def _send(self, data) -> bool:
+        """ POST line protocol in batches of the writer's adaptive size. If a batch fails after others went through
+        the whole buffer is retried later, InfluxDB overwrites points of the same series and timestamp. """
+        start = 0
+        while start < len(data):
+            end = self.writer.batch_end(data, start)
+            self.writer.write(data if (start == 0 and end == len(data)) else data[start:end])
+            start = end
+        return True
 
     def flush(self):
-        """Drain the queue and attempt one write. Always attempts regardless of
+        """Take the buffer and attempt one write. Always attempts regardless of
         the circuit breaker (callers like shutdown want a final flush);
         _flush_loop is the backoff-gated periodic entry point."""
+        with self._flush_lock:
+            self._flush()
+
+    def _take_buffer(self):
+        with self._buf_lock:
+            data, num_lines = self._buf, self._num_lines
+            self._buf, self._spare, self._num_lines = self._spare, data, 0
+        return data, num_lines
+
+    def _flush(self):
+        if self.spool is not None and not self.spool.empty():
+            self._spool_buffer()
+            self._backfill()
+            return
+
         now = time.time()
-        batch = []
-        while not self.Q.empty() and len(batch) < 20_000:
-            batch.append(self.Q.get())
-        if batch:
+        if not self._num_lines:
+            return
+        data, num_lines = self._take_buffer()
+        try:
+            res = self._send(data)
+        except Exception as e:
+            res = False
+            if not self.silent:
+                from bmslib.util import summarize_exc
+                logger.error('influxdb write failed: %s', summarize_exc(e))
+        if res:
+            self.cb.on_success(now)
+        else:
+            if not self.silent:
+                logger.error('Failed to write points to influxdb')
+            self.cb.on_failure(now)
+            if self.spool is not None:
+                self.spool.append(data)
+            elif self.cb.keep_batch_on_failure:
+                self._requeue(data, num_lines)  # retry after backoff window
+            elif self.cb.enabled:
+                self._drain_queue()  # never succeeded: drop, stay flat
+        data.clear()
+
+    def _spool_buffer(self):
+        """ move the buffered points to the spool (caller holds the flush lock) """
+        if self._num_lines:
+            data, _ = self._take_buffer()
+            self.spool.append(data)
+            data.clear()
+
+    def _backfill(self):
+        """ send spooled batches, oldest first, until the rate budget of one flush interval is spent """
+        budget = self.backfill_rate * self.flush_interval
+        while budget > 0:
+            data = self.spool.peek()
+            if data is None:
+                break
+            now = time.time()
             try:
-                res = self.influxdb_client.write_points(batch, time_precision='ms')
+                self._send(data)
             except Exception as e:
-                res = False
                 if not self.silent:
                     from bmslib.util import summarize_exc
-                    logger.error('influxdb write failed: %s', summarize_exc(e))
-            if res:
-                self.cb.on_success(now)
-            else:
-                if not self.silent:
-                    logger.error('Failed to write points to influxdb')
+                    logger.error('influxdb backfill failed: %s', summarize_exc(e))
                 self.cb.on_failure(now)
-                if self.cb.keep_batch_on_failure:
-                    for point in batch:
-                        self._enqueue(point)  # re-queue for retry after backoff window
-                elif self.cb.enabled:
-                    self._drain_queue()  # never succeeded: drop, stay flat
+                break
+            self.cb.on_success(now)
+            self.spool.ack()
+            budget -= len(data)
 
     def _maybe_flush(self):
         """One circuit-breaker-gated flush attempt (the periodic loop's body)."""
         if self.cb.should_attempt():
             self.flush()
+        elif self.spool is not None:
+            with self._flush_lock:
+                self._spool_buffer()  # keep memory flat while the server is down
 
     def _flush_loop(self):
-        while not self._stop_event.wait(self.flush_interval):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
             try:
                 self._maybe_flush()
             except Exception as e:
@@ -223,178 +301,92 @@ class InfluxDBSink(BmsSampleSink):
 
     def close(self):
         self._stop_event.set()
+        self._wake.set()
         self._flush_thread.join(timeout=5)
         try:
             self.flush()
         except Exception:
             pass
+        self.writer.close()
+        if self.spool is not None:
+            try:
+                with self._flush_lock:
+                    self._spool_buffer()
+            except Exception:
+                pass
+            self.spool.close()
 
 
 # --- QuestDB native writer ------------------------------------------------
 #
-# batmon_tele_batmon columns stored as SCALED INTEGERS: field -> scale. The sink
-# writes round(raw * scale) as an integer (decode on read: stored / scale). The
-# scale fixes the unit, so the column type stays stable across samples. Scales
-# come from measured pco gains (doc/QuestDB-compression.md). `current` is scaled
-# at the user's request despite a slight measured regression (it is signed and
-# oscillates around zero, which pco's delta/int-mult dislikes) -- revisit if its
-# Parquet size matters more than uniformity.
+# The column types and scales (QUESTDB_INT_SCALE, ...) are declared in the field registry, bmslib.fields.
 #
 # IMPORTANT: the matching QuestDB column must be INT/LONG, NOT FLOAT. ILP into a
 # FLOAT column silently coerces the integer back to a float (e.g. 3300 -> 3300.0)
 # and the pco win is lost; worse, the unit changes (mV vs V), so this cannot be
 # pointed at a table that already holds FLOAT volt/amp history -- it needs a
 # fresh table whose columns are integer from row one.
-QUESTDB_INT_SCALE = {
-    "voltage": 1000,          # V  -> mV
-    "current": 1000,          # A  -> mA
-    "balance_current": 1000,  # A  -> mA
-    "soc": 100,               # %  -> centi-%
-    "soh": 100,               # %  -> centi-%
-    "capacity": 100,          # Ah -> centi-Ah
-    "aged_capacity": 100,     # Ah -> centi-Ah
-    "cycle_capacity": 100,    # Ah -> centi-Ah
-    "mos_temperature": 100,   # degC -> centi-degC
-    **{("temperatures_%d" % i): 100 for i in range(8)},  # degC -> centi-degC
-}
-
-# Stored as a plain integer (LONG) at native scale -- a bitmask / count, no unit.
-QUESTDB_LONG_FIELDS = frozenset({"problem_code"})
-
-# Stored as BOOLEAN. Every value across the export is 0/1/null; emit Python bool
-# so the line protocol carries a boolean (ILP will not coerce 0/1 floats into a
-# BOOLEAN column).
-QUESTDB_BOOL_FIELDS = frozenset({
-    "switches_charge", "switches_discharge", "switches_balance", "switches_float_charge",
-    "switches_status_normal", "switches_status_charging", "switches_status_discharging",
-    "switches_status_protection", "switches_status_overvolt_protection",
-    "switches_status_undervolt_protection", "switches_status_overtemp",
-    "switches_status_undertemp", "switches_status_short",
-})
-
-# Kept as FLOAT: wide dynamic range or already-derived values where a linear int
-# grid would overflow or earn nothing (see doc/QuestDB-compression.md).
-QUESTDB_FLOAT_FIELDS = frozenset({
-    "power", "_power", "charge", "total_charge_throughput", "num_cycles",
-    "num_samples", "battery_charging", "problem", "uptime", "runtime",
-})
 
 # batmon_tele_batmon has exactly 32 per-cell columns (voltage_cell000..031).
 QUESTDB_MAX_CELLS = 32
 
 
-def _qdb_finite_number(v):
-    """True if v is a finite int/float (and not a bool, which we route by name)."""
-    if isinstance(v, bool):
-        return False
-    return isinstance(v, int) or (isinstance(v, float) and math.isfinite(v))
-
-
 class QuestDBSink(InfluxDBSink):
     """Telemetry sink tuned for QuestDB's pco Parquet codec.
 
-    Reuses InfluxDBSink's transport (QuestDB ingests InfluxDB v1 line protocol on
-    its /write endpoint, and the fork maps measurement `m` written with
-    `?db=batmon_tele` to the table `batmon_tele_m`). Only the field encoding
-    differs from the InfluxDB sink:
+    Writes QuestDB's native ILP (bmslib.questdb_writer) over `transport` 'http'
+    (REST port 9000) or 'tcp' (port 9009), with tables named `table_prefix` +
+    measurement (default `<database>_`). Transport 'influx' reuses InfluxDBSink's
+    /write with `?db=` instead (the telemetry fork maps measurement `m` written
+    with `?db=batmon_tele` to the table `batmon_tele_m`). Batches go out every
+    `flush_interval` seconds or once `flush_bytes` are buffered. Only the field
+    encoding differs from the InfluxDB sink:
 
       - scaled-integer columns (QUESTDB_INT_SCALE) -> `field=Ni` -> INT/LONG;
       - problem_code -> LONG; switches_* -> BOOLEAN; the rest -> FLOAT;
       - fields absent from the batmon_tele_* schema are DROPPED, because ILP
         auto-create is on and any stray field would re-create a dropped column.
 
-    The destination columns must be integer (see QUESTDB_INT_SCALE note). For a
-    truly native transport (QuestDB ILP on port 9000/9009) the official `questdb`
-    client could replace the base class, at the cost of a C-extension dependency
-    this addon currently avoids on constrained platforms.
+    The destination columns must be integer (see QUESTDB_INT_SCALE note). The
+    native encoder pins each column's type on first write, so an int/float flip
+    is coerced rather than failing the batch.
     """
 
-    def _encode_sample_fields(self, fields):
-        """Map flattened sample fields to QuestDB-schema-typed values, dropping
-        anything not in the schema."""
-        out = {}
-        for k, v in fields.items():
-            scale = QUESTDB_INT_SCALE.get(k)
-            if scale is not None:
-                if _qdb_finite_number(v):
-                    out[k] = int(round(v * scale))      # INT (scaled)
-            elif k in QUESTDB_BOOL_FIELDS:
-                out[k] = bool(v)                         # BOOLEAN
-            elif k in QUESTDB_LONG_FIELDS:
-                if _qdb_finite_number(v):
-                    out[k] = int(v)                      # LONG
-            elif k in QUESTDB_FLOAT_FIELDS:
-                if isinstance(v, bool):
-                    out[k] = float(v)                    # FLOAT (0.0/1.0)
-                elif _qdb_finite_number(v):
-                    out[k] = round(float(v), 3)          # FLOAT
-            # else: not a schema column -> drop (avoid ILP auto-create).
-        return out
+    def __init__(self, transport='http', table_prefix=None, flush_bytes=1024 * 1024, **kwargs):
+        self.transport = transport
+        self.table_prefix = table_prefix
+        super().__init__(flush_bytes=flush_bytes, **kwargs)
 
-    def publish_sample(self, bms_name, sample: BmsSample, tags=None):
-        fields = self._encode_sample_fields(flatten({**sample.values(), "timestamp": None}))
-        remove_none_values(fields)
-        fields1 = dict(fields)
-        if random.random() > (1 / 200):
-            remove_equal_values(fields, self._prev_fields.get(bms_name))
-        self._prev_fields[bms_name] = fields1
+    def _make_writer(self, compression_level, **kwargs):
+        if self.transport == 'influx':
+            return super()._make_writer(compression_level, **kwargs)
+        return make_ilp_writer(self.transport, **kwargs)
 
+    def _make_encoder(self, database):
+        if self.transport == 'influx':
+            return super()._make_encoder(database)
+        prefix = self.table_prefix
+        if prefix is None:
+            prefix = database + '_' if database else ''
+        return IlpEncoder(prefix)
+
+    def publish_sample(self, bms_name, sample: BmsSample, tags=None):
+        fields = self.changes.changed((bms_name, 'sample'), _serialize_questdb(sample), sample.timestamp)
         if not fields:
             return
-        point = {
-            "measurement": 'batmon',
-            "time": int(math.ceil(sample.timestamp * 1e3)),
-            "fields": fields,
-            "tags": dict(device=bms_name),
-        }
+        point_tags = dict(device=bms_name)
         if tags:
-            point['tags'].update(tags)
-        self._enqueue(point)
+            point_tags.update(tags)
+        self._enqueue('batmon', point_tags, fields, int(sample.timestamp * 1e9))
 
     def publish_voltages(self, bms_name, voltages: List[Union[int, float]], short=False, tags=None):
         if not voltages:
             return
-        tags = tags or {}
-
-        if bms_name not in self._last_volt or len(self._last_volt[bms_name]) != len(voltages):
-            self._last_volt[bms_name] = [-1] * len(voltages)
-        last_volt = self._last_volt[bms_name]
-        pub_anyway = random.random() < (1 / 100)
-        n = min(len(voltages), QUESTDB_MAX_CELLS)
-
-        def _valid(v):
-            return v is not None and not (isinstance(v, float) and not math.isfinite(v))
-
-        # Per-cell columns on batmon_tele_batmon (INT mV). No aggregates: the
-        # schema dropped voltage_cell_min/max/mean/median and ILP auto-create
-        # would re-add them.
-        fields = {}
-        for i in range(n):
-            v = voltages[i]
-            if _valid(v) and (v != last_volt[i] or pub_anyway):
-                fields["voltage_cell%03i" % i] = int(round(v))
-        if fields:
-            self._enqueue({
-                "measurement": 'batmon',
-                "time": datetime.datetime.utcnow(),
-                "fields": fields,
-                "tags": dict(device=bms_name, **tags),
-            })
-
-        # One row per changed cell on batmon_tele_cells (INT mV).
-        for i in range(n):
-            v = voltages[i]
-            if not _valid(v):
-                continue
-            if v == last_volt[i] and not pub_anyway:
-                continue
-            last_volt[i] = v
-            self._enqueue({
-                "measurement": 'cells',
-                "time": datetime.datetime.utcnow(),
-                "fields": dict(voltage=int(round(v))),
-                "tags": dict(device=bms_name, cell_index=i, **tags),
-            })
+        # Per-cell columns on batmon_tele_batmon and one row per changed cell on
+        # batmon_tele_cells (INT mV, with the default encoding). No aggregates:
+        # the schema dropped voltage_cell_min/max/mean/median and ILP
+        # auto-create would re-add them.
+        self._publish_cells(bms_name, _cells_mv(voltages[:QUESTDB_MAX_CELLS]), tags or {}, {}, rows=True)
 
 
 def hash_urlsafe(s: str):
@@ -424,77 +416,252 @@ def get_disk_id():
     return str(r['data']['data_disk']) or None
 
 
+TELEMETRY_FIELDS = SUMMARY_FIELDS
+TELEMETRY_IDLE_CURRENT = .5  # A, below counts as neither charging nor discharging
+
+
+class _TelemetryWindow:
+    """ streaming summary of one device over a telemetry window """
+
+    def __init__(self, now):
+        self.t_start = now
+        self.stats = {f: StreamStats() for f in TELEMETRY_FIELDS}
+        self.temperature = StreamStats()
+        self.dt = StreamStats(quantiles=(.5,))
+        self.cell_spread = StreamStats()
+        self.cell_min = math.inf
+        self.cell_max = -math.inf
+        self.cell_sum: Dict[int, float] = {}
+        self.cell_n: Dict[int, int] = {}
+        self.num_samples = self.num_invalid = self.num_problem = self.num_gaps = self.num_direction_changes = 0
+        self.charge_ah = self.discharge_ah = self.energy_in_wh = self.energy_out_wh = 0.
+        self.soc_first = math.nan
+        self.num_cycles = math.nan
+        self._prev = None  # (t, current, power)
+        self._direction = 0
+
+    def add_sample(self, s: BmsSample):
+        self.num_samples += 1
+        if not math.isfinite(s.voltage) or not math.isfinite(s.current):
+            self.num_invalid += 1
+            return
+        if s.problem:
+            self.num_problem += 1
+        for f, st in self.stats.items():
+            st.add(getattr(s, f))
+        if s.temperatures:
+            self.temperature.add(max((t for t in s.temperatures if t is not None), default=None))
+        if self.soc_first != self.soc_first:
+            self.soc_first = s.soc
+        if s.num_cycles == s.num_cycles:
+            self.num_cycles = s.num_cycles
+
+        t, i, p = s.timestamp, s.current, s.power
+        if self._prev is not None:
+            t0, i0, p0 = self._prev
+            dt = t - t0
+            if dt > 0:
+                dt_p50 = self.dt.quantiles[0].value()
+                if self.dt.n >= 5 and dt > 3 * dt_p50:
+                    self.num_gaps += 1
+                self.dt.add(dt)
+                ah = (i0 + i) / 2 * dt / 3600  # trapezoid, positive = discharge
+                wh = (p0 + p) / 2 * dt / 3600
+                if ah >= 0:
+                    self.discharge_ah += ah
+                else:
+                    self.charge_ah -= ah
+                if wh >= 0:
+                    self.energy_out_wh += wh
+                elif wh == wh:
+                    self.energy_in_wh -= wh
+        direction = (i > TELEMETRY_IDLE_CURRENT) - (i < -TELEMETRY_IDLE_CURRENT)
+        if direction and direction != self._direction:
+            if self._direction:
+                self.num_direction_changes += 1
+            self._direction = direction
+        self._prev = (t, i, p if p == p else 0.)
+
+    def add_voltages(self, cells: Dict[int, int], st=None):
+        if not cells:
+            return
+        if st is None:
+            lo, hi = min(cells.values()), max(cells.values())
+        else:
+            lo, hi = int(round(st.min)), int(round(st.max))
+        self.cell_min = min(self.cell_min, lo)
+        self.cell_max = max(self.cell_max, hi)
+        self.cell_spread.add(hi - lo)
+        for i, v in cells.items():
+            self.cell_sum[i] = self.cell_sum.get(i, 0) + v
+            self.cell_n[i] = self.cell_n.get(i, 0) + 1
+
+    def fields(self) -> dict:
+        out = dict(num_samples=self.num_samples, num_invalid=self.num_invalid, num_problem=self.num_problem,
+                   num_gaps=self.num_gaps, num_direction_changes=self.num_direction_changes,
+                   duration=self.dt.sum, charge_ah=self.charge_ah, discharge_ah=self.discharge_ah,
+                   energy_in_wh=self.energy_in_wh, energy_out_wh=self.energy_out_wh)
+        for f, st in self.stats.items():
+            out.update(st.fields(f))
+        out.update(self.temperature.fields('temperature_max'))
+        if self.dt.n:
+            out['dt_p50'] = self.dt.quantiles[0].value()
+        soc_last = self.stats['soc'].last
+        if soc_last == soc_last and self.soc_first == self.soc_first:
+            out['soc_delta'] = soc_last - self.soc_first
+        if self.num_cycles == self.num_cycles:
+            out['num_cycles'] = self.num_cycles
+        if self.cell_spread.n:
+            out.update(self.cell_spread.fields('cell_spread'))
+            out['voltage_cell_min'] = self.cell_min
+            out['voltage_cell_max'] = self.cell_max
+            for i in sorted(self.cell_sum)[:QUESTDB_MAX_CELLS]:
+                out['voltage_cell%03i' % i] = int(round(self.cell_sum[i] / self.cell_n[i]))
+        return {k: round(v, 4) if isinstance(v, float) else v for k, v in out.items()
+                if not (isinstance(v, float) and not math.isfinite(v))}
+
+
 class TelemetrySink(QuestDBSink):
+    """
+    Keeps a streaming summary per device (quantiles, min/max, counts, invalid/problem samples, sampling gaps,
+    charge/energy throughput and direction changes, cell spread) and sends one `summary` row per device and
+    `window` seconds instead of the samples. At most `max_devices` rows are sent per window (the devices waiting
+    longest first, the others keep accumulating), so the upload size doesn't grow with the fleet.
+    """
 
-    def __init__(self, bms_by_name: Dict[str, BtBms]):
+    def __init__(self, bms_by_name: Dict[str, BtBms], host="tm.fabi.me", port=None, ssl=False, window=120,
+                 max_devices=32):
         super().__init__(
-            flush_interval=120,
+            flush_interval=window,
             backoff_interval=3600,
-            host="tm.fabi.me",
+            host=host,
+            port=port,
             username="batmon_wo",
             password="no" + "secret",
             database="batmon_tele",
-            ssl=False
+            ssl=ssl,
+            transport='influx',
+            heartbeat=3600,
         )
         bms_by_name = {n: bms for n, bms in bms_by_name.items() if not bms.is_virtual}
         self.uid = get_user_id()
-        try:
-            self.did = hash_urlsafe(get_disk_id())
-        except:
-            self.did = None
+        self.did = None  # resolved on first publish (HTTP request, off the event loop)
+        self._did_resolved = False
 
         self.addrh_by_name = {n: hash_urlsafe(bms.address) for n, bms in bms_by_name.items()}
         self.slug_by_name = {n: bms.slug for n, bms in bms_by_name.items()}
 
-        self.sample_interval = 15
-        self._last_pub: Dict[str, float] = {}
+        self.window = window
+        self.max_devices = max_devices
+        self._windows: Dict[str, _TelemetryWindow] = {}
+        self._t_window = time.time()
 
         # logger.info("tele started, uid='%s' did='%s' addr=%s", self.uid, self.did, self.slug_by_name)
         self.silent = True
 
-    def _should_sample(self, bms_name) -> bool:
-        now = time.time()
-        if now - self._last_pub.get(bms_name, 0) < self.sample_interval:
-            return False
-        self._last_pub[bms_name] = now
-        return True
+    def _disk_id(self):
+        if not self._did_resolved:
+            self._did_resolved = True
+            try:
+                self.did = hash_urlsafe(get_disk_id())
+            except:
+                self.did = None
+        return self.did
+
+    def _get_window(self, bms_name, now) -> Optional[_TelemetryWindow]:
+        if bms_name not in self.slug_by_name or 'dummy' in self.slug_by_name[bms_name]:
+            return None
+        w = self._windows.get(bms_name)
+        if w is None:
+            w = self._windows[bms_name] = _TelemetryWindow(now)
+        return w
 
     def publish_sample(self, bms_name, sample: BmsSample, tags=None):
-        if bms_name not in self.slug_by_name:
-            return
-        if 'dummy' in self.slug_by_name[bms_name]:
-            return
-        if not self._should_sample(bms_name):
-            return
-        tags_ = dict(uid=self.uid, did=self.did, addrh=self.addrh_by_name[bms_name], slug=self.slug_by_name[bms_name])
-        tags and tags_.update(tags)
+        now = time.time()
         try:
-            QuestDBSink.publish_sample(self,
-                                       self.slug_by_name[bms_name] + '_' + self.addrh_by_name[bms_name],
-                                       sample, tags=tags_)
+            w = self._get_window(bms_name, now)
+            if w is not None:
+                w.add_sample(sample)
+            self._maybe_emit(now, tags)
         except Exception as e:
             pass
 
     def publish_voltages(self, bms_name, voltages: List[int], short=True, tags=None):
-        if bms_name not in self.slug_by_name:
-            return
-        if 'dummy' in self.slug_by_name[bms_name]:
-            return
-        if not self._should_sample(bms_name):
-            return
-        tags_ = dict(uid=self.uid, did=self.did, addrh=self.addrh_by_name[bms_name], slug=self.slug_by_name[bms_name])
-        tags and tags_.update(tags)
+        now = time.time()
         try:
-            # Telemetry only collects raw per-cell voltages, never the computed
-            # aggregates (voltage_cell_min/max/mean/median). QuestDBSink already
-            # drops the aggregates; short=True is kept for belt-and-suspenders.
-            QuestDBSink.publish_voltages(self, self.slug_by_name[bms_name] + '_' + self.addrh_by_name[bms_name], voltages, short=True, tags=tags_)
+            w = self._get_window(bms_name, now)
+            if w is not None and voltages:
+                cells = voltages[:QUESTDB_MAX_CELLS]
+                w.add_voltages(_cells_mv(cells), cell_stats(voltages) if len(cells) == len(voltages) else None)
+            self._maybe_emit(now, tags)
         except Exception:
             pass
 
+    def _maybe_emit(self, now, tags=None):
+        if now - self._t_window < self.window:
+            return
+        self._t_window = now
+        self.emit(now, tags)
+
+    def emit(self, now=None, tags=None):
+        """ enqueue the summaries of the (up to max_devices) longest waiting devices """
+        now = time.time() if now is None else now
+        due = sorted(self._windows.items(), key=lambda kv: kv[1].t_start)[:self.max_devices]
+        for bms_name, w in due:
+            del self._windows[bms_name]
+            tags_ = dict(uid=self.uid, did=self._disk_id(), addrh=self.addrh_by_name[bms_name],
+                         slug=self.slug_by_name[bms_name])
+            tags and tags_.update(tags)
+            remove_none_values(tags_)
+            self._enqueue('summary', tags_, w.fields(), int(now * 1e9))
+
     def publish_meters(self, bms_name, readings: Dict[str, float]):
         raise NotImplementedError()
 
+    def publish_rollup(self, bms_name, resolution: float, timestamp: float, fields: Dict[str, float]):
+        raise NotImplementedError()
+
+    def close(self):
+        try:
+            self.emit()
+        except Exception:
+            pass
+        super().close()
+
+
+class LocalStoreSink(BmsSampleSink):
+    """
+    Stores every sample, the cell voltages, meters and rollups in the embedded time-series store (bmslib.tsstore),
+    for sites without a database server. Tables per device: sample, cells, meters and rollup_<resolution>.
+    Values are scaled like the QuestDB sink (QUESTDB_INT_SCALE), other floats with 3 decimals.
+    """
+
+    def __init__(self, directory, retention_days=30, flush_interval=300):
+        self.store = TimeSeriesStore(directory, retention_days=float(retention_days),
+                                     flush_interval=float(flush_interval), scales=QUESTDB_INT_SCALE)
+
+    def publish_sample(self, bms_name, sample: BmsSample, tags=None):
+        self.store.append(bms_name, 'sample', sample.timestamp, _serialize_raw(sample))
+
+    def publish_voltages(self, bms_name, voltages: List[Union[int, float]]):
+        if not voltages:
+            return
+        cells = _cells_mv(voltages)
+        self.store.append(bms_name, 'cells', time.time(), {("voltage_cell%03i" % i): v for i, v in cells.items()})
+
+    def publish_meters(self, bms_name, readings: Dict[str, float]):
+        self.store.append(bms_name, 'meters', time.time(), readings)
+
+    def publish_rollup(self, bms_name, resolution: float, timestamp: float, fields: Dict[str, float]):
+        self.store.append(bms_name, 'rollup_' + resolution_label(resolution), timestamp, fields)
+
+    def query(self, bms_name, hours=24., table='sample', fields=None) -> Dict[str, list]:
+        """ columns of the last `hours`, see TimeSeriesStore.query """
+        return self.store.last_hours(bms_name, hours, table=table, fields=fields)
+
+    def close(self):
+        self.store.close()
+
 
 """
 # Telemtry
@@ -0,0 +1,180 @@
+"""
+Segmented on-disk spool (write-ahead log) of opaque records, used by the InfluxDB/QuestDB sinks to keep batches the
+database didn't accept (sleeping NAS, network outage) across restarts.
+
+Layout of `directory`:
+    000000000001.seg ...  segments of records `<u32 length><u32 crc32><payload>`, appended in order
+    cursor                read position `<segment seq> <offset>` of the oldest unacknowledged record
+
+A new segment is started on open and when the active one reaches `segment_bytes`. Fully consumed segments are
+deleted, and when the spool grows beyond `max_bytes` the oldest segments are dropped. Writes are flushed to the
+OS right away and fsync'ed at most every `fsync_interval` seconds, so a crash loses at most that window. A torn or
+corrupt record (crash during write) ends its segment, the reader continues with the next one.
+"""
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Optional
+
+from bmslib.util import get_logger
+
+logger = get_logger()
+
+_HEADER = struct.Struct('<II')
+_SUFFIX = '.seg'
+
+
+class SegmentSpool:
+
+    def __init__(self, directory, max_bytes=256 * 2 ** 20, segment_bytes=2 ** 20, fsync_interval=5.):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.num_dropped_bytes = 0
+
+        self._lock = threading.Lock()
+        self._fh = None  # active segment
+        self._t_fsync = 0.
+        self._dirty = False
+        self._peeked = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(int(fn[:-len(_SUFFIX)]) for fn in os.listdir(directory)
+                                if fn.endswith(_SUFFIX) and fn[:-len(_SUFFIX)].isdigit())
+        self._sizes = {seq: os.path.getsize(self._path(seq)) for seq in self._segments}
+        self._read_seq, self._read_off = self._load_cursor()
+        while self._segments and self._segments[0] < self._read_seq:
+            self._remove_head()  # consumed, but not deleted before a crash
+        if self._segments:
+            logger.info('spool %s: replaying %d bytes in %d segments', directory, self.size_bytes,
+                        len(self._segments))
+
+    def _path(self, seq):
+        return os.path.join(self.directory, '%012d%s' % (seq, _SUFFIX))
+
+    def _load_cursor(self):
+        seq, off = (self._segments[0] if self._segments else 0), 0
+        try:
+            with open(os.path.join(self.directory, 'cursor')) as f:
+                c_seq, c_off = map(int, f.read().split())
+            if c_seq in self._sizes:
+                seq, off = c_seq, c_off
+        except (OSError, ValueError):
+            pass
+        return seq, off
+
+    def _store_cursor(self):
+        fn = os.path.join(self.directory, 'cursor')
+        with open(fn + '.tmp', 'w') as f:
+            f.write('%d %d' % (self._read_seq, self._read_off))
+        os.replace(fn + '.tmp', fn)
+
+    @property
+    def size_bytes(self) -> int:
+        """ bytes on disk, including acknowledged records of the oldest segment """
+        return sum(self._sizes.values())
+
+    def empty(self) -> bool:
+        with self._lock:
+            return self._next_record() is None
+
+    def append(self, payload: bytes):
+        payload = bytes(payload)
+        with self._lock:
+            if self._fh is None or self._sizes[self._segments[-1]] >= self.segment_bytes:
+                self._rotate()
+            self._fh.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._fh.flush()
+            self._sizes[self._segments[-1]] += _HEADER.size + len(payload)
+            self._dirty = True
+            self._enforce_cap()
+            now = time.time()
+            if now - self._t_fsync >= self.fsync_interval:
+                self._fsync(now)
+
+    def _rotate(self):
+        if self._fh is not None:
+            self._fsync(time.time())
+            self._fh.close()
+        seq = (self._segments[-1] if self._segments else 0) + 1
+        self._fh = open(self._path(seq), 'ab')
+        self._segments.append(seq)
+        self._sizes[seq] = 0
+        if len(self._segments) == 1:
+            self._read_seq, self._read_off = seq, 0
+
+    def _fsync(self, now):
+        if self._dirty and self._fh is not None:
+            os.fsync(self._fh.fileno())
+            self._dirty = False
+        self._t_fsync = now
+
+    def _enforce_cap(self):
+        while self.size_bytes > self.max_bytes and len(self._segments) > 1:
+            seq = self._segments[0]
+            dropped = self._sizes[seq] - (self._read_off if seq == self._read_seq else 0)
+            self.num_dropped_bytes += dropped
+            logger.warning('spool %s full (%d bytes), dropping %d bytes of the oldest data', self.directory,
+                           self.max_bytes, dropped)
+            self._remove_head()
+
+    def _remove_head(self):
+        seq = self._segments.pop(0)
+        del self._sizes[seq]
+        try:
+            os.remove(self._path(seq))
+        except OSError:
+            pass
+        if self._read_seq == seq or self._read_seq not in self._sizes:
+            self._read_seq, self._read_off = (self._segments[0] if self._segments else 0), 0
+            self._store_cursor()
+
+    def _next_record(self):
+        """ :return: (payload, record size) of the oldest unacknowledged record or None """
+        while self._segments:
+            seq = self._read_seq
+            active = self._fh is not None and seq == self._segments[-1]
+            if self._read_off < self._sizes[seq]:
+                with open(self._path(seq), 'rb') as f:
+                    f.seek(self._read_off)
+                    header = f.read(_HEADER.size)
+                    if len(header) == _HEADER.size:
+                        length, crc = _HEADER.unpack(header)
+                        payload = f.read(length)
+                        if len(payload) == length and zlib.crc32(payload) == crc:
+                            return payload, _HEADER.size + length
+                if active:
+                    return None
+                logger.warning('spool %s: corrupt record in segment %d at %d, skipping the rest', self.directory,
+                               seq, self._read_off)
+            elif active:
+                return None
+            # segment consumed
+            self._remove_head()
+        return None
+
+    def peek(self) -> Optional[bytes]:
+        """ :return: the oldest unacknowledged record """
+        with self._lock:
+            rec = self._next_record()
+            self._peeked = rec and (self._read_seq, self._read_off, rec[1])
+            return rec and rec[0]
+
+    def ack(self):
+        """ acknowledge the record returned by the last `peek()` """
+        with self._lock:
+            if not self._peeked or self._peeked[:2] != (self._read_seq, self._read_off):
+                return  # dropped by the size cap meanwhile
+            self._read_off += self._peeked[2]
+            self._peeked = None
+            self._store_cursor()
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fsync(time.time())
+                self._fh.close()
+                self._fh = None
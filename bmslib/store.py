@@ -1,6 +1,9 @@
 import json
 import os
 import re
+import threading
+import time
+import zlib
 from os import access, R_OK
 from os.path import isfile
 from threading import Lock
@@ -17,6 +20,7 @@ def is_readable(file):
 
 root_dir = '/data/' if is_readable('/data/options.json') else ''
 bms_meter_states_fn = root_dir + 'bms_meter_states.json'
+bms_meter_journal_fn = root_dir + 'bms_meter_states.journal'
 
 lock = Lock()
 
@@ -25,38 +29,233 @@ def store_file(fn):
     return root_dir + fn
 
 
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # not supported (Windows)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class MeterJournal:
+    """
+    Meter states persisted as a snapshot plus an append-only journal.
+
+    `store()` appends one line with only the meters whose reading changed since the last store, so a write is
+    proportional to the change. Each store with a change is still an fsync'd write, and the energy meters change on
+    almost every sample while current flows. Each line is
+    `<crc32 hex> <json>`, with the same nesting as the snapshot ({bms: {meter: {reading}}}). Readings are absolute,
+    so replaying a record twice is harmless.
+
+    Beyond `compact_bytes` the journal is compacted after the append: the full state is written to the snapshot (temp
+    file, fsync, rename, directory fsync), then the journal is truncated. Every change is in the journal before the
+    compaction starts, so a crash before the rename replays it onto the old snapshot and a crash after it replays it
+    onto the new one, both yield the same state. `load()` stops at the first damaged line (a write torn by a power
+    cut) and cuts it off.
+    """
+
+    def __init__(self, snapshot_fn, journal_fn, compact_bytes=64 * 1024):
+        self.snapshot_fn = snapshot_fn
+        self.journal_fn = journal_fn
+        self.compact_bytes = compact_bytes
+        self._state = None  # last stored, {(bms, meter): reading dict}
+        self._journal = None
+        self._journal_size = 0
+
+    @staticmethod
+    def _flat(meter_states):
+        return {(bms, meter): dict(v) for bms, meters in meter_states.items() for meter, v in meters.items()}
+
+    @staticmethod
+    def _nested(flat):
+        states = {}
+        for (bms, meter), v in flat.items():
+            states.setdefault(bms, {})[meter] = v
+        return states
+
+    def load(self) -> dict:
+        """ :return: the meter states, raises FileNotFoundError if nothing was stored yet """
+        try:
+            with open(self.snapshot_fn) as f:
+                flat = self._flat(json.load(f))
+        except FileNotFoundError:
+            if not os.path.exists(self.journal_fn):
+                raise
+            flat = {}
+
+        valid_size = 0
+        try:
+            with open(self.journal_fn, 'rb') as f:
+                for line in f:
+                    try:
+                        crc, data = line.rstrip(b'\n').split(b' ', 1)
+                        if not line.endswith(b'\n') or int(crc, 16) != zlib.crc32(data):
+                            raise ValueError('crc mismatch')
+                        flat.update(self._flat(json.loads(data)))
+                    except ValueError as e:
+                        logger.warning('meter journal damaged after %d bytes (%s), dropping the rest', valid_size, e)
+                        break
+                    valid_size += len(line)
+            if valid_size != os.path.getsize(self.journal_fn):
+                os.truncate(self.journal_fn, valid_size)
+        except FileNotFoundError:
+            pass
+
+        self._state = flat
+        self._journal_size = valid_size
+        return self._nested(flat)
+
+    def store(self, meter_states):
+        flat = self._flat(meter_states)
+        if self._state is None:
+            try:
+                self.load()
+            except FileNotFoundError:
+                self._state = {}
+        changed = {k: v for k, v in flat.items() if self._state.get(k) != v}
+        if not changed:
+            return
+        self._state.update(changed)
+
+        data = json.dumps(self._nested(changed), separators=(',', ':')).encode()
+        line = b'%08x %s\n' % (zlib.crc32(data), data)
+        if self._journal is None:
+            self._journal = open(self.journal_fn, 'ab')
+        self._journal.write(line)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_size += len(line)
+
+        if self._journal_size > self.compact_bytes:
+            self.compact()
+
+    def compact(self):
+        """ write the full state to the snapshot and truncate the journal """
+        s = f'.{random_str(6)}.tmp'
+        with open(self.snapshot_fn + s, 'w') as f:
+            json.dump(self._nested(self._state), f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.snapshot_fn + s, self.snapshot_fn)
+        _fsync_dir(os.path.dirname(os.path.abspath(self.snapshot_fn)))  # the rename is durable before the truncate
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_fn, 'wb')
+        self._journal_size = 0
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+_meter_journal = MeterJournal(bms_meter_states_fn, bms_meter_journal_fn)
+
+
 def load_meter_states():
     with lock:
-        with open(bms_meter_states_fn) as f:
-            meter_states = json.load(f)
-        return meter_states
+        return _meter_journal.load()
 
 
 def store_meter_states(meter_states):
     with lock:
-        s = f'.{random_str(6)}.tmp'
-        with open(bms_meter_states_fn + s, 'w') as f:
-            json.dump(meter_states, f, indent=2)
-        os.replace(bms_meter_states_fn + s, bms_meter_states_fn)
+        _meter_journal.store(meter_states)
 
 
-def store_algorithm_state(bms_name, algorithm_name, state=None):
-    fn = root_dir + 'bat_state_' + re.sub(r'[^\w_. -]', '_', bms_name) + '.json'
-    with lock:
-        with open(fn, 'a+') as f:
+class AlgorithmStateStore:
+    """
+    Write-behind store of the algorithm states, one file per BMS (bat_state_<name>.json).
+
+    A BMS file is read once, by `preload()` at startup (or on first access). Updates change the state in memory and
+    schedule a flush on a timer thread, at most one per `min_interval` seconds; updates in between are coalesced into
+    that flush. Files are replaced atomically, so the event loop never waits on file I/O. `flush()` writes pending
+    states synchronously (at shutdown). Flushes are serialized, so a slow timer flush can't overwrite a newer shutdown
+    flush. A failed write is retried with the next flush.
+    """
+
+    def __init__(self, directory='', min_interval=10.):
+        self.directory = directory
+        self.min_interval = min_interval
+        self._states = {}  # bms name -> {'algorithm_state': {algorithm name: state}}
+        self._dirty = set()
+        self._lock = Lock()
+        self._write_lock = Lock()  # taken before _lock, held while writing the files
+        self._timer = None
+        self._t_flush = 0.
+        self.num_writes = 0
+
+    def _fn(self, bms_name):
+        return self.directory + 'bat_state_' + re.sub(r'[^\w_. -]', '_', bms_name) + '.json'
+
+    def _bms_state(self, bms_name):
+        bms_state = self._states.get(bms_name)
+        if bms_state is None:
             try:
-                f.seek(0)
-                bms_state = json.load(f)
-            except:
+                with open(self._fn(bms_name)) as f:
+                    bms_state = json.load(f)
+            except Exception:
                 logger.info('init %s bms state storage', bms_name)
                 bms_state = dict(algorithm_state=dict())
+            self._states[bms_name] = bms_state
+        return bms_state
+
+    def preload(self, bms_names):
+        """ read the files of `bms_names`, so later accesses from the event loop don't wait on file I/O """
+        with self._lock:
+            for bms_name in bms_names:
+                self._bms_state(bms_name)
+
+    def get(self, bms_name, algorithm_name):
+        with self._lock:
+            return self._bms_state(bms_name)['algorithm_state'].get(algorithm_name, None)
+
+    def put(self, bms_name, algorithm_name, state):
+        with self._lock:
+            self._bms_state(bms_name)['algorithm_state'][algorithm_name] = dict(state)  # callers pass live dicts
+            self._dirty.add(bms_name)
+            if self._timer is None:
+                delay = max(0., self._t_flush + self.min_interval - time.time())
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
 
-            if state is not None:
-                bms_state['algorithm_state'][algorithm_name] = state
-                f.seek(0), f.truncate()
-                json.dump(bms_state, f, indent=2)
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                dirty, self._dirty = self._dirty, set()
+                # serialize under the lock, the states are mutated by put()
+                pending = {bms_name: json.dumps(self._states[bms_name], indent=2) for bms_name in dirty}
+                self._t_flush = time.time()
+            for bms_name, data in pending.items():
+                fn = self._fn(bms_name)
+                s = f'.{random_str(6)}.tmp'
+                try:
+                    with open(fn + s, 'w') as f:
+                        f.write(data)
+                    os.replace(fn + s, fn)
+                    self.num_writes += 1
+                except Exception as e:
+                    logger.error('error storing %s algorithm state: %s', bms_name, e)
+                    with self._lock:
+                        self._dirty.add(bms_name)  # retried with the next flush
 
-            return bms_state['algorithm_state'].get(algorithm_name, None)
+
+algorithm_state_store = AlgorithmStateStore(root_dir)
+
+
+def store_algorithm_state(bms_name, algorithm_name, state=None):
+    """ :return: the stored state. if `state` is given, stores it (write-behind, see AlgorithmStateStore) """
+    if state is not None:
+        algorithm_state_store.put(bms_name, algorithm_name, state)
+    return algorithm_state_store.get(bms_name, algorithm_name)
 
 
 def load_user_config():
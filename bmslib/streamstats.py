@@ -0,0 +1,107 @@
+"""
+Streaming summary statistics with constant memory: min/max/mean/count and quantiles estimated with the P² algorithm
+(Jain & Chlamtac, 1985), five markers per quantile, no samples kept.
+"""
+import math
+from typing import Dict, Sequence
+
+
+class P2Quantile:
+    __slots__ = ('p', 'q', 'n', 'np', 'dn', 'count')
+
+    def __init__(self, p: float):
+        assert 0 < p < 1
+        self.p = p
+        self.q = []  # marker heights, the first 5 observations until initialized
+        self.n = [0, 1, 2, 3, 4]  # marker positions
+        self.np = [0, 2 * p, 4 * p, 2 + 2 * p, 4]  # desired positions
+        self.dn = [0, p / 2, p, (1 + p) / 2, 1]
+        self.count = 0
+
+    def add(self, x: float):
+        self.count += 1
+        q = self.q
+        if self.count <= 5:
+            q.append(x)
+            if self.count == 5:
+                q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.n
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+
+        for i in (1, 2, 3):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = self._parabolic(i, d)
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])  # linear
+                q[i] = qp
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.q, self.n
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self) -> float:
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            s = sorted(self.q)
+            return s[min(len(s) - 1, int(round(self.p * (len(s) - 1))))]
+        return self.q[2]
+
+
+class StreamStats:
+    __slots__ = ('n', 'min', 'max', 'sum', 'last', 'quantiles')
+
+    def __init__(self, quantiles: Sequence[float] = (.1, .5, .9)):
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.
+        self.last = math.nan
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        if x is None or x != x:  # nan
+            return
+        self.n += 1
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        self.sum += x
+        self.last = x
+        for q in self.quantiles:
+            q.add(x)
+
+    @property
+    def mean(self):
+        return self.sum / self.n if self.n else math.nan
+
+    def fields(self, prefix: str) -> Dict[str, float]:
+        """ {prefix_min, prefix_max, prefix_mean, prefix_p50, ...}, empty without observations """
+        if not self.n:
+            return {}
+        out = {prefix + '_min': self.min, prefix + '_max': self.max, prefix + '_mean': self.mean}
+        for q in self.quantiles:
+            out['%s_p%02d' % (prefix, round(q.p * 100))] = q.value()
+        return out
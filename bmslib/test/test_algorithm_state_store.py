@@ -0,0 +1,81 @@
+"""Write-behind algorithm state store: loaded once, coalesced bounded-rate flushes, atomic files, legacy format."""
+import json
+import os
+import threading
+import time
+
+from bmslib.store import AlgorithmStateStore
+
+
+def test_coalesced_write_behind(tmp_path):
+    store = AlgorithmStateStore(str(tmp_path) + '/', min_interval=.2)
+    for i in range(20):
+        state = dict(charging=True, counter=i)
+        store.put('bat 1', 'soc', state)
+        state['counter'] = -1  # the store keeps a copy
+    assert store.get('bat 1', 'soc') == dict(charging=True, counter=19)
+    time.sleep(.1)
+    assert store.num_writes == 1  # the first flush runs right away, the rest is coalesced
+    store.put('bat 1', 'soc', dict(charging=False))
+    time.sleep(.05)
+    assert store.num_writes == 1  # rate bounded
+    time.sleep(.3)
+    assert store.num_writes == 2
+    fn = tmp_path / 'bat_state_bat 1.json'
+    assert json.loads(fn.read_text()) == dict(algorithm_state=dict(soc=dict(charging=False)))
+    assert [f for f in os.listdir(tmp_path) if f.endswith('.tmp')] == []
+
+
+def test_loads_existing_file_once(tmp_path):
+    fn = tmp_path / 'bat_state_b.json'
+    fn.write_text(json.dumps(dict(algorithm_state=dict(soc=dict(charging=True)))))
+    store = AlgorithmStateStore(str(tmp_path) + '/')
+    assert store.get('b', 'soc') == dict(charging=True)
+    fn.unlink()
+    assert store.get('b', 'soc') == dict(charging=True) and store.get('b', 'other') is None
+    store.put('b', 'other', dict(x=1))
+    store.flush()
+    assert json.loads(fn.read_text())['algorithm_state'] == dict(soc=dict(charging=True), other=dict(x=1))
+
+
+def test_concurrent_flushes_keep_the_newest(tmp_path, monkeypatch):
+    store = AlgorithmStateStore(str(tmp_path) + '/', min_interval=60)
+    store._t_flush = time.time()  # the timer waits, flushes are explicit
+    replace = os.replace
+    calls = []
+
+    def slow_replace(src, dst):
+        calls.append(src)
+        if len(calls) == 1:
+            time.sleep(.1)  # the first flush is still writing when the second one starts
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', slow_replace)
+    store.put('b', 'soc', dict(counter=1))
+    t = threading.Thread(target=store.flush)
+    t.start()
+    time.sleep(.02)
+    store.put('b', 'soc', dict(counter=2))
+    store.flush()
+    t.join()
+    assert json.loads((tmp_path / 'bat_state_b.json').read_text())['algorithm_state']['soc'] == dict(counter=2)
+
+
+def test_preload_and_failed_write_retried(tmp_path, monkeypatch):
+    fn = tmp_path / 'bat_state_b.json'
+    fn.write_text(json.dumps(dict(algorithm_state=dict(soc=dict(charging=True)))))
+    store = AlgorithmStateStore(str(tmp_path) + '/', min_interval=60)
+    store.preload(['b'])
+    fn.unlink()
+    store._t_flush = time.time()
+    store.put('b', 'soc', dict(charging=False))
+    replace = os.replace
+
+    def read_only(*_):
+        raise OSError('read-only file system')
+
+    monkeypatch.setattr(os, 'replace', read_only)
+    store.flush()
+    monkeypatch.setattr(os, 'replace', replace)
+    store.flush()  # shutdown
+    assert json.loads(fn.read_text())['algorithm_state'] == dict(soc=dict(charging=False))
@@ -0,0 +1,76 @@
+"""Binary telemetry frame (mqtt_binary option): round trip, size, n/a values and schema republish."""
+import json
+import math
+
+import bmslib.mqtt_util as mqtt_util
+from bmslib.binframe import BinaryFrameEncoder, decode
+from bmslib.bms import BmsSample
+
+
+def _sample(**kwargs):
+    return BmsSample(voltage=53.12, current=-12.5, soc=87.45, temperatures=[21.3, -4.0, 25.1, 19.9],
+                     switches={'discharge': True, 'charge': False}, timestamp=1700000000.25, **kwargs)
+
+
+def test_roundtrip_16s_under_80_bytes():
+    voltages = [3300 + i for i in range(16)]
+    frame, schema = BinaryFrameEncoder().encode(_sample(), voltages)
+    assert len(frame) < 80
+
+    d = decode(frame)
+    assert d['timestamp'] == 1700000000.25
+    assert math.isclose(d['voltage'], 53.12, rel_tol=1e-6) and d['current'] == -12.5
+    assert d['soc'] == 87.45
+    assert d['temperatures'] == [21.3, -4.0, 25.1, 19.9]
+    assert d['cell_voltages'] == [v / 1000 for v in voltages]
+    assert schema['switches'] == ['charge', 'discharge'] and d['switch_bits'] == [False, True]
+    assert schema['cell_voltages']['count'] == 16
+
+
+def test_missing_values_decode_as_nan():
+    s = BmsSample(voltage=12.1, current=0.5, temperatures=[math.nan])
+    d = decode(BinaryFrameEncoder().encode(s, None)[0])
+    assert math.isnan(d['soc']) and math.isnan(d['temperatures'][0])
+    assert d['cell_voltages'] == [] and d['switch_bits'] == []
+
+
+def test_schema_retained_and_republished_on_layout_change(monkeypatch):
+    monkeypatch.setattr(mqtt_util, '_last_values', {})
+    sent = []
+
+    class _Client:
+        def publish(self, topic, data, retain=False, properties=None):
+            sent.append((topic, data, retain))
+            return type('Info', (), {'rc': 0})()
+
+    enc = BinaryFrameEncoder()
+    mqtt_util.publish_binary_frame(_Client(), 'bat1', enc, _sample(), [3300] * 16)
+    mqtt_util.publish_binary_frame(_Client(), 'bat1', enc, _sample(), [3301] * 16)
+    mqtt_util.publish_binary_frame(_Client(), 'bat1', enc, _sample(), [3301] * 8)
+
+    schemas = [(json.loads(d)['cell_voltages']['count'], r) for t, d, r in sent if t == 'bat1/bin/schema']
+    assert schemas == [(16, True), (8, True)]
+    assert [len(d) for t, d, _ in sent if t == 'bat1/bin'] == [66, 66, 50]
+
+
+def test_switches_truncated_and_schema_retried_until_published(monkeypatch):
+    monkeypatch.setattr(mqtt_util, '_last_values', {})
+    sent = []
+
+    class _Client:
+        rc = 4  # MQTT_ERR_NO_CONN
+
+        def publish(self, topic, data, retain=False, properties=None):
+            sent.append((topic, data))
+            return type('Info', (), {'rc': self.rc})()
+
+    client, enc = _Client(), BinaryFrameEncoder()
+    s = _sample()
+    s.switches = {'sw%02d' % i: True for i in range(20)}
+    mqtt_util.publish_binary_frame(client, 'bat1', enc, s, [3300] * 16)
+    client.rc = 0
+    mqtt_util.publish_binary_frame(client, 'bat1', enc, s, [3300] * 16)
+    mqtt_util.publish_binary_frame(client, 'bat1', enc, s, [3300] * 16)
+    schemas = [json.loads(d) for t, d in sent if t == 'bat1/bin/schema']
+    assert len(schemas) == 2 and len(schemas[1]['switches']) == 16
+    assert decode(sent[-1][1])['switch_bits'] == [True] * 16
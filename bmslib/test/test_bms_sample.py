@@ -0,0 +1,43 @@
+"""BmsSample: slotted schema, values(), cheap copies and current scaling."""
+import math
+from copy import copy
+
+import pytest
+
+from bmslib.bms import BmsSample, SAMPLE_FIELDS
+
+
+def _sample():
+    return BmsSample(voltage=52.1, current=-3.5, charge=50, capacity=100, temperatures=[20., 21.],
+                     switches=dict(charge=True), problem_code=4, timestamp=1700000000)
+
+
+def test_values_follow_schema():
+    s = _sample()
+    v = s.values()
+    assert list(v) == list(SAMPLE_FIELDS) + ['power']
+    assert (v['soc'], v['power'], v['problem']) == (50, pytest.approx(-182.35), True)
+    assert math.isnan(v['_power'])
+
+
+def test_slots():
+    s = _sample()
+    assert not hasattr(s, '__dict__')
+    with pytest.raises(AttributeError):
+        s.no_such_field = 1
+
+
+def test_copy_is_shallow_and_independent():
+    s = _sample()
+    c = copy(s)
+    c.voltage = 1
+    assert s.voltage == 52.1 and c.values().keys() == s.values().keys()
+    assert c.temperatures is s.temperatures
+
+
+def test_multiply_and_invert_current():
+    s = _sample()
+    m = s.multiply_current(2)
+    assert (m.current, m.power, s.current) == (-7, pytest.approx(-364.7), -3.5)
+    p = BmsSample(voltage=50, current=0, power=10).invert_current()
+    assert (math.copysign(1, p.current), p.power) == (1, -10)
@@ -0,0 +1,50 @@
+"""Cell voltage encodings of the time-series sinks: wide, packed (delta), rows."""
+import pytest
+
+from bmslib.cellenc import CellEncoding, pack_cells, unpack_cells
+from bmslib.sinks import InfluxDBSink, QuestDBSink
+
+
+def test_pack_roundtrip():
+    v = [3301, 3303, None, 3302, 3302]
+    s = pack_cells(v)
+    assert s == '3301,2,,-1,0'
+    assert unpack_cells(s) == v
+    assert unpack_cells(pack_cells([None, 3300])) == [None, 3300]
+
+
+def test_unknown_encoding():
+    with pytest.raises(AssertionError):
+        CellEncoding('wide,columnar')
+
+
+def _lines(sink, *voltage_lists):
+    sent = []
+    sink._send = lambda data: sent.append(bytes(data)) or True
+    for v in voltage_lists:
+        sink.publish_voltages('bat', v)
+    sink.flush()
+    sink.close()
+    return sent[0].decode().splitlines() if sent else []
+
+
+def test_default_is_wide_and_rows():
+    lines = _lines(InfluxDBSink(host="localhost", flush_interval=3600), [3300.4, 3301])
+    assert lines[0].startswith('batmon,device=bat ') and 'voltage_cell000=3300i,voltage_cell001=3301i' in lines[0]
+    assert [ln.split(' ')[0] for ln in lines[1:]] == ['cells,cell_index=0,device=bat', 'cells,cell_index=1,device=bat']
+
+
+def test_packed_single_point_per_device():
+    sink = InfluxDBSink(host="localhost", flush_interval=3600, cell_encoding='packed')
+    lines = _lines(sink, [3300, 3301, float('nan'), 3299], [3300, 3301, float('nan'), 3299], [3300, 3302, None, 3299])
+    assert len(lines) == 3  # unchanged second call writes only the aggregates
+    assert 'voltage_cells="3300,1,,-2"' in lines[0]
+    assert 'voltage_cells' not in lines[1]
+    assert 'voltage_cells="3300,2,,-3"' in lines[2] and 'voltage_cell001' not in lines[2]
+
+
+def test_questdb_shares_encoding():
+    sink = QuestDBSink(host="localhost", transport='influx', flush_interval=3600, cell_encoding='packed,rows')
+    lines = _lines(sink, [3300, 3301])
+    assert lines[0] == lines[0].split(' ')[0] + ' voltage_cells="3300,1" ' + lines[0].split(' ')[2]
+    assert len(lines) == 3
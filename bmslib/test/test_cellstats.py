@@ -0,0 +1,49 @@
+"""Cell statistics kernel: selection median, invalid cells, the per-fetch cache and the MQTT cell topics."""
+import math
+import random
+import statistics
+from copy import copy
+
+import pytest
+
+from bmslib import cellstats, mqtt_util
+from bmslib.cellstats import CellVoltages, cell_stats, median, select
+
+
+@pytest.mark.parametrize('n', [1, 2, 7, 16, 64, 65, 200, 201])
+def test_median_matches_statistics(n):
+    rnd = random.Random(n)
+    for _ in range(20):
+        xs = [rnd.randint(3200, 3400) for _ in range(n)]  # many duplicates
+        assert median(list(xs)) == statistics.median(xs)
+        k = rnd.randrange(n)
+        assert select(list(xs), k) == sorted(xs)[k]
+
+
+def test_stats_skip_invalid_cells():
+    st = cell_stats([3301, None, 3290, math.nan, 3310, 3290])
+    assert (st.num_cells, st.num_valid) == (6, 4)
+    assert (st.min, st.min_index, st.max, st.max_index, st.delta) == (3290, 2, 3310, 4, 20)
+    assert st.mean == pytest.approx(3297.75) and st.median == 3295.5
+    assert cell_stats([]) is None and cell_stats(None) is None and cell_stats([None, math.nan]) is None
+
+
+def test_cached_once_and_kept_by_copy(monkeypatch):
+    calls = []
+    compute = cellstats.compute
+    monkeypatch.setattr(cellstats, 'compute', lambda v: calls.append(1) or compute(v))
+    v = CellVoltages([3300, 3310, 3305])
+    assert cell_stats(v) is cell_stats(v) is v.stats
+    c = copy(v)
+    assert type(c) is CellVoltages and c == v and c is not v and c.stats is v.stats
+    assert len(calls) == 1
+
+
+def test_mqtt_cell_topics(monkeypatch):
+    out = {}
+    monkeypatch.setattr(mqtt_util, 'mqtt_single_out', lambda client, topic, data, **kw: out.__setitem__(topic, data))
+    mqtt_util.publish_cell_voltages(object(), 'bms', CellVoltages([3300, 3312, 3290, 3305]), cells=False)
+    assert out == {'bms/cell_voltages/min': 3.29, 'bms/cell_voltages/min_index': 3,
+                   'bms/cell_voltages/max': 3.312, 'bms/cell_voltages/max_index': 2,
+                   'bms/cell_voltages/delta': .022, 'bms/cell_voltages/average': 3.302,
+                   'bms/cell_voltages/median': 3.3025}
@@ -0,0 +1,54 @@
+"""Deterministic change tracking of the time-series sinks: changes, heartbeat, ride-along refresh."""
+from bmslib.bms import BmsSample
+from bmslib.changes import ChangeTracker
+from bmslib.sinks import InfluxDBSink
+
+
+def test_changes_and_heartbeat():
+    ct = ChangeTracker(heartbeat=100)
+    assert ct.changed('s', {'a': 1, 'b': 2}, 0) == {'a': 1, 'b': 2}
+    assert ct.changed('s', {'a': 1, 'b': 2}, 10) == {}
+    assert ct.changed('s', {'a': 1, 'b': 3}, 20) == {'b': 3}
+    assert ct.changed('s', {'a': 1, 'b': 3}, 99) == {}
+    assert ct.changed('s', {'a': 1, 'b': 3}, 100) == {'a': 1, 'b': 3}  # heartbeat of a, b rides along
+    assert ct.changed('s', {'a': 1, 'b': 3}, 101) == {}
+    assert ct.changed('other', {'a': 1}, 100) == {'a': 1}
+
+
+def test_heartbeat_rides_along():
+    ct = ChangeTracker(heartbeat=100)
+    ct.changed('s', {'a': 1, 'b': 2}, 0)
+    assert ct.changed('s', {'a': 1, 'b': 5}, 60) == {'a': 1, 'b': 5}  # a is older than heartbeat/2
+    assert ct.changed('s', {'a': 1, 'b': 5}, 150) == {}  # a refreshed at 60
+
+
+def test_max_gap_is_bounded():
+    ct = ChangeTracker(heartbeat=30)
+    written = [t for t in range(1000) if ct.changed('s', {'v': 1}, t)]
+    assert max(b - a for a, b in zip(written, written[1:])) == 30
+
+
+def test_nan_is_unchanged():
+    ct = ChangeTracker(heartbeat=100)
+    assert set(ct.changed('s', dict(a=1, t=float('nan')), 0)) == {'a', 't'}
+    assert ct.changed('s', dict(a=1, t=float('nan')), 1) == {}
+    assert ct.changed('s', dict(a=2, t=float('nan')), 2) == dict(a=2)
+
+
+def test_sink_sample_and_cells():
+    sink = InfluxDBSink(host="localhost", database="x", heartbeat=60, flush_interval=3600)
+    sent = []
+    sink._send = lambda data: sent.append(bytes(data)) or True
+
+    for t in (0, 1, 2):
+        sink.publish_sample('bat', BmsSample(voltage=53, current=1 if t < 2 else 2, timestamp=1000 + t))
+    sink.publish_voltages('bat', [3300, 3301])
+    sink.publish_voltages('bat', [3300, 3302])
+    sink.flush()
+    lines = sent[0].decode().splitlines()
+
+    samples = [ln for ln in lines if ln.startswith('batmon,device=bat ') and 'current=' in ln]
+    assert len(samples) == 2 and 'current=2.0' in samples[1] and 'voltage=' not in samples[1]
+    cells = [ln.split(' ')[0] for ln in lines if ln.startswith('cells,')]
+    assert cells == ['cells,cell_index=0,device=bat', 'cells,cell_index=1,device=bat', 'cells,cell_index=1,device=bat']
+    sink.close()
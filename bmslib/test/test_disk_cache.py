@@ -0,0 +1,77 @@
+"""Disk cache: LRU eviction by size, max age, compression, index rebuild, decorator keys and lazy imports."""
+import os
+import subprocess
+import sys
+
+from bmslib.cache.disk import INDEX_FILE, PickleFileStore, disk_cache_deco, get_store
+
+
+def _store(tmp_path, **kwargs):
+    store = PickleFileStore(str(tmp_path), **kwargs)
+    store.time = lambda: store.now
+    store.now = 1000.
+    return store
+
+
+def test_lru_eviction_by_size(tmp_path):
+    store = _store(tmp_path, max_bytes=3000)
+    for k in 'abc':
+        store.now += 1
+        store.write('m/' + k, b'x' * 900)
+    store.now += 1
+    assert store.read('m/a') == b'x' * 900  # a is now more recent than b
+    store.write('m/d', b'x' * 900)
+    assert sorted(store.index) == ['m/a', 'm/c', 'm/d'] and store.size() <= 3000
+    assert sorted(os.listdir(tmp_path / 'm')) == ['a.pickle', 'c.pickle', 'd.pickle']
+
+
+def test_max_age_and_compression(tmp_path):
+    store = _store(tmp_path, max_age=60, compress=True)
+    value = dict(cells=[3300] * 1000)
+    store.write('v', value)
+    assert os.path.getsize(tmp_path / 'v.pickle') < 200
+    assert store.read('v') == value
+    store.now += 61
+    assert store.read('v') is None and not os.path.exists(tmp_path / 'v.pickle')
+
+
+def test_index_persisted_and_rebuilt(tmp_path):
+    store = PickleFileStore(str(tmp_path))
+    store.write('a/b', [1, 2])
+    assert [f for f in os.listdir(tmp_path) if f.endswith('.tmp')] == []
+    assert PickleFileStore(str(tmp_path)).read('a/b') == [1, 2]
+    (tmp_path / INDEX_FILE).write_text('{broken')
+    assert PickleFileStore(str(tmp_path)).read('a/b') == [1, 2]
+
+
+def test_decorator_keys(tmp_path):
+    calls = []
+
+    @disk_cache_deco(directory=str(tmp_path))
+    def f(x):
+        calls.append(x)
+        return [x]
+
+    assert f(1) == [1] and f('1') == ['1'] and f(1) == [1]
+    assert calls == [1, '1'] and len(f.cache.index) == 2
+
+
+def test_decorators_share_the_directory_index(tmp_path):
+    @disk_cache_deco(directory=str(tmp_path), max_bytes=10 ** 6)
+    def f(x):
+        return [x]
+
+    @disk_cache_deco(directory=str(tmp_path / '.'), compress=True)
+    def g(x):
+        return dict(x=x)
+
+    assert f(1) == [1] and g(2) == dict(x=2)
+    assert f.cache is g.cache is get_store(str(tmp_path)) and f.cache.max_bytes == 10 ** 6
+    assert len(PickleFileStore(str(tmp_path)).index) == 2  # persisted index has both entries
+
+
+def test_no_pandas_import():
+    code = 'import sys, bmslib.cache.disk; print("pandas" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    assert out.stdout.strip() == 'False', out.stderr
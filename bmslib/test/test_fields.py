@@ -0,0 +1,82 @@
+"""Field registry: generated MQTT descriptions, QuestDB maps and compiled sink serializers vs flatten(values())."""
+import math
+import random
+
+import pytest
+
+from bmslib import bms
+from bmslib.bms import BmsSample
+from bmslib.fields import FIELDS, QUESTDB_BOOL_FIELDS, QUESTDB_FLOAT_FIELDS, QUESTDB_INT_SCALE, \
+    QUESTDB_LONG_FIELDS, SAMPLE_FIELDS, serializer
+from bmslib.mqtt_util import remove_none_values, sample_desc
+from bmslib.sinks import flatten
+
+
+def _flat(s):
+    fields = flatten({**s.values(), "timestamp": None})
+    remove_none_values(fields)
+    return {k: v for k, v in fields.items() if not (isinstance(v, float) and not math.isfinite(v))}
+
+
+def _influx_reference(s):
+    return {k: float(v) if isinstance(v, int) else (round(v, 3) if isinstance(v, float) else v)
+            for k, v in _flat(s).items()}
+
+
+def _questdb_reference(s):
+    out = {}
+    for k, v in _flat(s).items():
+        number = not isinstance(v, bool) and isinstance(v, (int, float))
+        if k in QUESTDB_INT_SCALE:
+            if number:
+                out[k] = int(round(v * QUESTDB_INT_SCALE[k]))
+        elif k in QUESTDB_BOOL_FIELDS:
+            out[k] = bool(v)
+        elif k in QUESTDB_LONG_FIELDS:
+            if number:
+                out[k] = int(v)
+        elif k in QUESTDB_FLOAT_FIELDS:
+            out[k] = float(v) if isinstance(v, bool) else round(float(v), 3)
+    return out
+
+
+def _random_samples(n):
+    rnd = random.Random(0)
+
+    def num():
+        return rnd.choice([math.nan, rnd.uniform(-100, 100), rnd.randint(0, 100)])
+
+    for _ in range(n):
+        s = BmsSample(voltage=num(), current=num(), power=rnd.choice([math.nan, 100.5, 0]), charge=num(),
+                      capacity=rnd.choice([math.nan, 100, 200.5]), soc=rnd.choice([math.nan, 50, 50.55]),
+                      num_cycles=rnd.choice([math.nan, 3]), mos_temperature=num(),
+                      temperatures=rnd.choice([None, [], [20.1, None, math.nan] + [1.] * rnd.randint(0, 10)]),
+                      switches=rnd.choice([None, dict(charge=True, discharge=False, unknown=True)]),
+                      problem_code=rnd.choice([None, 0, 5]), battery_charging=rnd.choice([None, True]),
+                      battery_mode=rnd.choice([None, 'BULK']), uptime=num(), timestamp=1e9)
+        s.num_samples = rnd.randint(0, 5)
+        yield s
+
+
+@pytest.mark.parametrize('encoding,reference', [('influx', _influx_reference), ('questdb', _questdb_reference),
+                                                ('raw', _flat)])
+def test_serializer_matches_flatten(encoding, reference):
+    fn = serializer(encoding)
+    for s in _random_samples(500):
+        out, ref = fn(s), reference(s)
+        assert out == ref
+        assert all(type(out[k]) is type(ref[k]) for k in ref)
+
+
+def test_registry_covers_sample():
+    s = BmsSample(voltage=1, current=1)
+    assert bms.SAMPLE_FIELDS == SAMPLE_FIELDS and BmsSample.__slots__ == SAMPLE_FIELDS
+    assert tuple(s.values())[:-1] == SAMPLE_FIELDS  # values() in registry order, then the derived power
+    assert all(f.slot in SAMPLE_FIELDS for f in FIELDS)
+
+
+def test_sample_desc():
+    assert list(sample_desc)[:4] == ['soc/total_voltage', 'soc/current', 'soc/balance_current', 'soc/soc_percent']
+    assert sample_desc['soc/cycle_capacity'] == dict(field='total_charge_throughput', tier='slow', aggregate='last',
+                                                     device_class=None, state_class=None, unit_of_measurement='Ah')
+    assert sample_desc['soc/power']['icon'] == 'flash' and sample_desc['soc/power']['precision'] == 1
@@ -0,0 +1,73 @@
+"""Filter banks: numpy and scalar fallback agree with the scalar filters, channel growth, per-channel time and gaps."""
+import math
+import random
+
+import pytest
+
+from bmslib.pwmath import EWMA, LHQ, DiffAbsSum, DiffAbsSumBank, EWMABank, Integrator, IntegratorBank, LHQBank
+
+BACKENDS = [True, False]
+
+
+def _series(n_ch, n, seed=1, missing=.1):
+    rnd = random.Random(seed)
+    return [[None if rnd.random() < missing else 20 + rnd.gauss(0, 2) for _ in range(n_ch)] for _ in range(n)]
+
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_ewma_and_lhq_match_scalar(use_numpy):
+    ewma, lhq = EWMABank(span=5, use_numpy=use_numpy), LHQBank(span=5, inp_q=.1, use_numpy=use_numpy)
+    ref_e = [EWMA(5) for _ in range(8)]
+    ref_l = [LHQ(5, .1) for _ in range(8)]
+    for row in _series(8, 200):
+        e, l = list(ewma.update(row)), list(lhq.update(row))
+        for i, v in enumerate(row):
+            if v is not None:
+                ref_e[i].add(v)
+                ref_l[i].add(v)
+        assert e == pytest.approx([f.value for f in ref_e], nan_ok=True)
+        assert l == pytest.approx([f.last for f in ref_l], nan_ok=True)
+
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_integrators_match_scalar(use_numpy):
+    rnd = random.Random(2)
+    bank = IntegratorBank(dx_max=5, use_numpy=use_numpy)
+    diff = DiffAbsSumBank(dx_max=5, dy_max=1, use_numpy=use_numpy)
+    ref = [Integrator('', dx_max=5) for _ in range(4)]
+    ref_d = [DiffAbsSum('', dx_max=5, dy_max=1) for _ in range(4)]
+    t = [0.] * 4
+    for row in _series(4, 300, seed=3):
+        t = [ti + rnd.choice((1, 1, 2, 9)) for ti in t]  # per channel time, with gaps > dx_max
+        bank.update(t, row)
+        diff.update(t, row)
+        for i, v in enumerate(row):
+            if v is not None:
+                ref[i] += (t[i], v)
+                ref_d[i] += (t[i], v)
+    assert list(bank.get()) == pytest.approx([f.get() for f in ref])
+    assert list(diff.get()) == pytest.approx([f.get() for f in ref_d])
+
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_integrator_channel_steps_back(use_numpy):
+    bank = IntegratorBank(dx_max=5, use_numpy=use_numpy)
+    bank.update([0, 0, 0], [1., 1., 1.])
+    bank.update([1, 1, 1], [1., 1., 1.])
+    assert list(bank.update([2, -10, 2], [1., 1., 1.])) == [2, 1, 2]  # channel 1 re-seeded, not integrated
+    assert bank.stepped_back == [1]
+    assert list(bank.update([3, -9, 3], [1., 1., 1.])) == [3, 2, 3] and bank.stepped_back == []
+
+
+@pytest.mark.parametrize('use_numpy', BACKENDS)
+def test_channels_grow_and_stale_reset(use_numpy):
+    bank = EWMABank(span=3, dt_max=10, use_numpy=use_numpy)
+    assert list(bank.update([1.], t=0)) == [1]
+    assert list(bank.update([2., 5.], t=[1, 1])) == pytest.approx([1.5, 5])
+    assert bank.size == 2
+    assert list(bank.update([9., math.nan], t=20)) == pytest.approx([9, 5])  # channel 0 is stale, re-seeded
+
+    integ = IntegratorBank(dx_max=1, use_numpy=use_numpy)
+    integ.restore([10.])
+    integ.update(0, [2., 2.])
+    assert list(integ.update(1, [4., 2.])) == [13, 2]
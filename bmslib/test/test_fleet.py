@@ -0,0 +1,66 @@
+"""Fleet processor: batched meters match the per-sampler integrators, early flush, restore and the sampler wiring."""
+import random
+
+import pytest
+
+from bmslib.fleet import METERS, FleetProcessor
+from bmslib.pwmath import DiffAbsSum, Integrator
+
+
+def _scalar_meters(dt_max_seconds):
+    return [Integrator(name, dx_max=dt_max_seconds / 3600) if dy is None
+            else DiffAbsSum(name, dx_max=1, dy_max=dy) for name, dy in METERS.items()]
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_batched_meters_match_scalar(use_numpy):
+    rnd = random.Random(4)
+    fleet = FleetProcessor(dt_max_seconds=120, use_numpy=use_numpy)
+    devices = ['bat%d' % i for i in range(12)]
+    batched = {d: fleet.register(d) for d in devices}
+    scalar = {d: _scalar_meters(120) for d in devices}
+    t = 1700000000 / 3600
+    for tick in range(300):
+        t += rnd.choice((1, 1, 1, 200)) / 3600  # some ticks exceed dt_max
+        for d in devices:
+            if rnd.random() < .2:
+                continue  # not sampled this tick
+            ys = [rnd.gauss(0, 50) for _ in METERS]
+            for b, s, y in zip(batched[d], scalar[d], ys):
+                b += (t, y)
+                s += (t, y)
+        fleet.flush()
+    for d in devices:
+        assert [m.get() for m in batched[d]] == pytest.approx([m.get() for m in scalar[d]])
+
+
+def test_resubmit_flushes_and_restore():
+    fleet = FleetProcessor(dt_max_seconds=3600, use_numpy=False)
+    a, = fleet.register('a', {'total_charge': dict(reading=5.)})[:1]
+    a += (0, 1.)
+    a += (1, 3.)  # before the tick ended
+    assert fleet.num_flushes == 1 and a.get() == 5
+    fleet.flush()
+    assert a.get() == 7
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_clock_step_back_of_one_device(use_numpy):
+    fleet = FleetProcessor(dt_max_seconds=3600, use_numpy=use_numpy)
+    a, b = fleet.register('a')[0], fleet.register('b')[0]
+    for x_a, x_b in ((0, 0), (1, 1), (2, -5), (3, -4)):
+        a += (x_a, 1.)
+        b += (x_b, 1.)
+        fleet.flush()
+    assert (a.get(), b.get()) == (3, 2)
+
+
+def test_sampler_uses_fleet_meters():
+    from bmslib.sampling import BmsSampler
+    from bmslib.test.test_sampling_backoff import _FakeBms
+
+    fleet = FleetProcessor(dt_max_seconds=120)
+    sampler = BmsSampler(_FakeBms(), mqtt_client=None, dt_max_seconds=120, expire_after_seconds=60,
+                         meter_state={'total_cycles': dict(reading=2.5)}, fleet=fleet)
+    assert [m.name for m in sampler.meters] == list(METERS)
+    assert sampler.get_meter_state()['total_cycles'] == dict(reading=2.5)
@@ -0,0 +1,94 @@
+"""Device-based HA discovery (hass_discovery: device): one compact message, same entities as per-entity discovery."""
+import json
+
+import pytest
+
+import bmslib.mqtt_util as mqtt_util
+from bmslib.bms import BmsSample, DeviceInfo
+from bmslib.mqtt_util import publish_hass_discovery
+
+
+class _Info:
+    rc = 0
+
+
+class _FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    def publish(self, topic, data, retain=False, properties=None):
+        self.sent.append((topic, data))
+        return _Info()
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch, tmp_path):
+    monkeypatch.setattr(mqtt_util, '_last_values', {})
+    monkeypatch.setattr(mqtt_util, '_hass_migrated', None)
+    monkeypatch.setattr(mqtt_util, '_hass_migrated_fn', str(tmp_path / 'hass_discovery_migrated.json'))
+
+
+def _publish(client, device_based):
+    sample = BmsSample(voltage=53.1, current=-2.5, soc=88, temperatures=[21.0, 22.5], problem=False,
+                       switches={'charge': True, 'discharge': True})
+    publish_hass_discovery(client, 'bat/1', expire_after_seconds=20, sample=sample, num_cells=16,
+                           temperatures=sample.temperatures, device_based=device_based,
+                           device_info=DeviceInfo('JK', 'BD6A20S', 'V11', '11.26', None, sn='1234'))
+
+
+def test_single_compact_message_with_same_entities():
+    legacy, dev = _FakeClient(), _FakeClient()
+    _publish(legacy, device_based=False)
+    _publish(dev, device_based=True)
+
+    configs = [(t, d) for t, d in dev.sent if t == 'homeassistant/device/bat_1/config']
+    assert len(configs) == 1
+    payload = json.loads(configs[0][1])
+    assert payload['dev'] == {'ids': ['1234'], 'mf': 'JK', 'mdl': 'BD6A20S', 'sw': '11.26', 'hw': 'V11',
+                              'name': 'bat/1'}
+    assert payload['~'] == 'bat/1' and payload['o']['name'] == 'batmon'
+
+    legacy_ids = sorted((t.split('/')[1], json.loads(d)['unique_id']) for t, d in legacy.sent)
+    assert sorted((c['p'], c['uniq_id']) for c in payload['cmps'].values()) == legacy_ids
+    assert len(payload['cmps']) == len(legacy.sent) >= 40
+
+    cell = payload['cmps']['cell_voltages_12']
+    assert cell == {'p': 'sensor', 'uniq_id': 'bat/1__cell_voltages_12', 'name': 'Cell Volt 12', 'dev_cla': 'voltage',
+                    'unit_of_meas': 'V', 'sug_dsp_prc': 3, 'stat_t': '~/cell_voltages/12', 'exp_aft': 20}
+    assert payload['cmps']['binary_sensor_charge']['stat_t'] == '~/switch/charge'
+    assert payload['cmps']['charge']['cmd_t'] == 'homeassistant/switch/bat_1/charge/set'
+
+    assert len(configs[0][1]) < sum(len(d) for _, d in legacy.sent) / 2
+
+
+def test_migrates_entity_topics_once():
+    c = _FakeClient()
+    _publish(c, device_based=True)
+    topics = [t for t, _ in c.sent]
+    i = topics.index('homeassistant/device/bat_1/config')
+    assert all(json.loads(d) == {'migrate_discovery': True} for _, d in c.sent[:i])
+    assert all(d == '' for _, d in c.sent[i + 1:])
+    assert topics[:i] == topics[i + 1:] and 'homeassistant/sensor/bat_1/_soc_soc_percent/config' in topics
+
+    mqtt_util._last_values.clear()
+    c.sent.clear()
+    _publish(c, device_based=True)
+    assert [t for t, _ in c.sent] == ['homeassistant/device/bat_1/config']
+
+    mqtt_util._hass_migrated = None  # add-on restart
+    mqtt_util._last_values.clear()
+    c.sent.clear()
+    _publish(c, device_based=True)
+    assert [t for t, _ in c.sent] == ['homeassistant/device/bat_1/config']
+
+
+def test_failed_migration_is_repeated():
+    c = _FakeClient()
+    _Info.rc = 4  # not connected
+    try:
+        _publish(c, device_based=True)
+    finally:
+        _Info.rc = 0
+    c.sent.clear()
+    _publish(c, device_based=True)
+    assert json.loads(c.sent[0][1]) == {'migrate_discovery': True}
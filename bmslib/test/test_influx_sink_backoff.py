@@ -1,8 +1,4 @@
 # bmslib/test/test_influx_sink_backoff.py
-import pytest
-
-pytest.importorskip("influxdb")
-
 from bmslib.sinks import InfluxDBSink, TelemetrySink
 
 
@@ -11,26 +7,27 @@ def _make_sink(backoff_interval):
     sink.silent = True
     calls = {"n": 0, "ok": True}
 
-    def fake_write_points(batch, time_precision=None):
+    def fake_send(data):
         calls["n"] += 1
+        calls["data"] = bytes(data)
         if not calls["ok"]:
             raise RuntimeError("server down")
         return True
 
-    sink.influxdb_client.write_points = fake_write_points
+    sink._send = fake_send
     return sink, calls
 
 
 def test_failure_before_success_drops_and_blocks():
     sink, calls = _make_sink(backoff_interval=3600)
     calls["ok"] = False
-    sink._enqueue({"measurement": "m", "fields": {"v": 1.0}, "tags": {}})
+    sink._enqueue("m", {}, {"v": 1.0}, 1)
     sink.flush()                      # attempt fails
     assert calls["n"] == 1
-    assert sink.Q.empty()             # never succeeded -> dropped, not buffered
+    assert sink.qsize() == 0          # never succeeded -> dropped, not buffered
     # new points are dropped while in backoff
-    sink._enqueue({"measurement": "m", "fields": {"v": 2.0}, "tags": {}})
-    assert sink.Q.empty()
+    sink._enqueue("m", {}, {"v": 2.0}, 1)
+    assert sink.qsize() == 0
     # _maybe_flush makes no attempt while the breaker is open
     sink._maybe_flush()
     assert calls["n"] == 1
@@ -38,15 +35,20 @@ def test_failure_before_success_drops_and_blocks():
 
 def test_buffers_and_replays_after_a_success():
     sink, calls = _make_sink(backoff_interval=3600)
-    sink._enqueue({"measurement": "m", "fields": {"v": 1.0}, "tags": {}})
+    sink._enqueue("m", {}, {"v": 1.0}, 1)
     sink.flush()                      # success -> ever_succeeded
     assert calls["n"] == 1
     assert sink.cb.ever_succeeded is True
     # now the server goes down
     calls["ok"] = False
-    sink._enqueue({"measurement": "m", "fields": {"v": 2.0}, "tags": {}})
+    sink._enqueue("m", {}, {"v": 2.0}, 1)
     sink.flush()                      # fails, but batch is re-enqueued
-    assert sink.Q.qsize() == 1        # buffered for replay
+    assert sink.qsize() == 1          # buffered for replay
+    calls["ok"] = True
+    sink._enqueue("m", {}, {"v": 3.0}, 2)
+    sink.flush()
+    assert calls["data"] == b"m v=2.0 1\nm v=3.0 2\n"  # replayed in order
+    assert sink.qsize() == 0
 
 
 def test_telemetry_publish_voltages_swallows_unknown_bms():
@@ -64,10 +66,10 @@ def test_telemetry_publish_voltages_swallows_unknown_bms():
 def test_disabled_breaker_preserves_drop_on_failure():
     sink, calls = _make_sink(backoff_interval=0)
     calls["ok"] = False
-    sink._enqueue({"measurement": "m", "fields": {"v": 1.0}, "tags": {}})
+    sink._enqueue("m", {}, {"v": 1.0}, 1)
     sink.flush()                      # fails
-    assert sink.Q.empty()             # dropped, no buffering
+    assert sink.qsize() == 0          # dropped, no buffering
     # not blocked: another attempt happens
-    sink._enqueue({"measurement": "m", "fields": {"v": 2.0}, "tags": {}})
+    sink._enqueue("m", {}, {"v": 2.0}, 1)
     sink._maybe_flush()
     assert calls["n"] == 2
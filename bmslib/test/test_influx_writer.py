@@ -0,0 +1,127 @@
+"""InfluxDB HTTP writer against a local stand-in server: keep-alive, chunked gzip, auth, batch sizing, errors."""
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bmslib.influx_writer import InfluxHttpWriter, InfluxWriteError
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.num_connects += 1
+
+    def _read_chunked(self):
+        body = b''
+        while True:
+            n = int(self.rfile.readline().split(b';')[0], 16)
+            if n == 0:
+                self.rfile.readline()
+                return body
+            body += self.rfile.read(n)
+            self.rfile.readline()
+
+    def do_POST(self):
+        assert self.headers['Transfer-Encoding'] == 'chunked'
+        body = gzip.decompress(self._read_chunked())
+        self.server.requests.append((self.path, dict(self.headers), body))
+        time.sleep(self.server.delay)
+        status = self.server.status
+        msg = b'' if status == 204 else b'{"error":"partial write"}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(msg)))
+        self.end_headers()
+        self.wfile.write(msg)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    srv.requests, srv.num_connects, srv.status, srv.delay = [], 0, 204, 0
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _lines(n, start=0):
+    return b''.join(b'batmon,device=bat voltage=53.%d %d\n' % (i, i) for i in range(start, start + n))
+
+
+def test_gzip_body_keepalive_and_auth(server):
+    w = InfluxHttpWriter('127.0.0.1', server.server_port, username='u', password='p', database='db',
+                         chunk_size=100, compresslevel=1)
+    w.write(_lines(50))
+    w.write(bytearray(_lines(3, 50)))
+    w.close()
+
+    assert server.num_connects == 1 and w.num_connects == 1
+    assert [r[2] for r in server.requests] == [_lines(50), _lines(3, 50)]
+    path, headers, _ = server.requests[0]
+    assert path == '/write?db=db&precision=n'
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Authorization'] == 'Basic dTpw'
+
+
+def test_reconnects_after_server_closed_connection(server):
+    w = InfluxHttpWriter('127.0.0.1', server.server_port, database='db')
+    w.write(_lines(1))
+    w._conn.sock.shutdown(2)  # stale keep-alive connection
+    w.write(_lines(1, 1))
+    assert len(server.requests) == 2 and w.num_connects == 2
+
+
+def test_error_status_raises(server):
+    server.status = 400
+    w = InfluxHttpWriter('127.0.0.1', server.server_port, database='db')
+    with pytest.raises(InfluxWriteError) as e:
+        w.write(_lines(2))
+    assert e.value.status == 400 and 'partial write' in str(e.value)
+
+
+def test_batch_end_splits_at_newlines():
+    w = InfluxHttpWriter(batch_bytes=100)
+    data = _lines(20)
+    start, batches = 0, []
+    while start < len(data):
+        end = w.batch_end(data, start)
+        batches.append(data[start:end])
+        start = end
+    assert b''.join(batches) == data
+    assert all(b.endswith(b'\n') and len(b) <= 100 for b in batches)
+    assert w.batch_end(b'x' * 300 + b'\nshort\n') == 301  # a single long line is not cut
+
+
+def test_batch_size_adapts_to_latency(server):
+    w = InfluxHttpWriter('127.0.0.1', server.server_port, database='db', batch_bytes=1000, min_batch_bytes=100,
+                         target_latency=.05)
+    for _ in range(3):
+        w.write(_lines(30))
+    assert w.batch_bytes > 1000  # fast server
+
+    server.delay = .1
+    grown = w.batch_bytes
+    for _ in range(3):
+        w.write(_lines(60))
+    assert w.batch_bytes < grown
+
+
+def test_sink_sends_batches(server):
+    from bmslib.sinks import InfluxDBSink
+    sink = InfluxDBSink(host='127.0.0.1', port=server.server_port, database='db', compression_level=9)
+    sink.writer.batch_bytes = 200
+    for i in range(20):
+        sink._enqueue('m', {'device': 'bat'}, {'v': i}, i)
+    sink.flush()
+    assert len(server.requests) > 1 and server.num_connects == 1
+    assert b''.join(r[2] for r in server.requests) == b''.join(b'm,device=bat v=%di %d\n' % (i, i) for i in range(20))
+    sink.close()
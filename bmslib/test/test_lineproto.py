@@ -0,0 +1,47 @@
+"""Line protocol encoder of the InfluxDB/QuestDB sinks: equivalent to influxdb's make_line, cached prefixes."""
+import math
+
+import pytest
+
+from bmslib.bms import BmsSample
+from bmslib.lineproto import LineProtocolEncoder
+
+lp = pytest.importorskip("influxdb.line_protocol")
+
+
+def test_matches_influxdb_make_line():
+    enc = LineProtocolEncoder()
+    tags = {'device': 'jk bms,1', 'cell_index': 3, 'slug': 'a=b'}
+    fields = {'voltage': 3301, 'soc': 87.5, 'battery_mode': 'FLOAT "x"', 'switches_charge': True}
+    line = enc.encode('batmon', tags, fields, 1700000000123456789).decode()
+    ref = lp.make_line('batmon', tags=tags, fields=fields, time=1700000000123456789)
+    assert line == ref.replace('=True', '=true') + '\n'
+
+
+def test_skips_unrepresentable_values_and_none_tags():
+    enc = LineProtocolEncoder()
+    assert enc.encode('m', {}, {'a': math.nan, 'b': None}, 1) is None
+    assert enc.encode('m', {'did': None, 'uid': 'x'}, {'a': math.inf, 'b': 1.5}, 2) == b'm,uid=x b=1.5 2\n'
+
+
+def test_prefix_cached_per_tags():
+    enc = LineProtocolEncoder()
+    assert enc.prefix('cells', {'device': 'b', 'cell_index': 1}) is enc.prefix('cells', {'cell_index': 1, 'device': 'b'})
+    assert enc.prefix('cells', {'device': 'b', 'cell_index': 2}) == b'cells,cell_index=2,device=b'
+
+
+def test_sink_encodes_at_publish_time():
+    from bmslib.sinks import InfluxDBSink
+
+    sink = InfluxDBSink(host="localhost", database="x")
+    sent = []
+    sink._send = lambda data: sent.append(bytes(data)) or True
+    sink.publish_sample('bat', BmsSample(voltage=53.1, current=-2.0, soc=80, timestamp=1700000000.5))
+    sink.publish_voltages('bat', [3300, 3310])
+    assert sink.qsize() == 4  # sample, cell stats row, 2 cell rows
+    sink.flush()
+    lines = sent[0].decode().splitlines()
+    assert lines[0].startswith('batmon,device=bat ') and lines[0].endswith(' 1700000000500000000')
+    assert 'voltage=53.1' in lines[0] and 'soc=80.0' in lines[0]
+    assert lines[2].startswith('cells,cell_index=0,device=bat voltage=3300i ')
+    sink.close()
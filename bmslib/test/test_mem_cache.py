@@ -0,0 +1,168 @@
+"""Memory cache: bounded TTL + LRU storage with stats, single-flight, stale-while-revalidate and error caching."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bmslib.cache.mem import CACHE_STATS, DictCacheStorage, mem_cache_deco
+
+
+class _Clock:
+    def __init__(self):
+        self.t = 1000.
+
+    def __call__(self):
+        return self.t
+
+
+def _storage(**kwargs):
+    c = DictCacheStorage(**kwargs)
+    c.time = _Clock()
+    return c
+
+
+def test_ttl_lazy_and_sweep():
+    c = _storage(sweep_interval=60)
+    c.set('a', 1, ttl=10, ignore_overwrite=False)
+    c.set('b', 2, ttl=100, ignore_overwrite=False)
+    c.time.t += 20
+    assert c.get('a') is None and 'a' not in c.d  # dropped on access
+    c.set('c', 3, ttl=5, ignore_overwrite=False)
+    c.time.t += 50
+    c.set('d', 4, ttl=100, ignore_overwrite=False)  # sweep due, drops c
+    assert set(c.d) == {'b', 'd'} and c.expirations == 2
+
+
+def test_lru_eviction_and_stats():
+    c = _storage(max_entries=3)
+    for k in 'abc':
+        c.set(k, k, ttl=100, ignore_overwrite=False)
+    assert c.get('a') == 'a'  # a is now the most recently used
+    c.set('d', 'd', ttl=100, ignore_overwrite=False)
+    assert list(c.d) == ['c', 'a', 'd'] and 'b' not in c
+    c.get('x')
+    st = c.stats()
+    assert tuple(st) == CACHE_STATS
+    assert (st['entries'], st['hits'], st['misses'], st['hit_percent'], st['evictions']) == (3, 1, 1, 50, 1)
+
+
+def test_decorator_bounded():
+    c = _storage(max_entries=16)
+    calls = []
+
+    @mem_cache_deco(ttl=60, cache_storage=c)
+    def f(x):
+        calls.append(x)
+        return x * 2
+
+    for i in range(100):
+        assert f(i) == 2 * i
+    assert f(99) == 198 and len(calls) == 100
+    assert len(c) == 16 and c.evictions == 84
+
+
+def test_async_single_flight():
+    calls = []
+
+    @mem_cache_deco(ttl=60, cache_storage=_storage())
+    async def fetch(addr):
+        calls.append(addr)
+        await asyncio.sleep(.01)
+        return addr.upper()
+
+    async def main():
+        first = asyncio.ensure_future(fetch('a'))
+        await asyncio.sleep(0)
+        first.cancel()  # doesn't cancel the shared call
+        res = await asyncio.gather(*[fetch('a') for _ in range(10)], fetch('b'))
+        return res, await fetch('a')
+
+    res, again = asyncio.run(main())
+    assert res == ['A'] * 10 + ['B'] and again == 'A' and calls == ['a', 'b']
+
+
+def test_stale_while_revalidate_and_error_ttl():
+    c = _storage()
+    calls = []
+
+    @mem_cache_deco(ttl=10, stale_ttl=100, error_ttl=5, cache_storage=c)
+    async def fetch():
+        calls.append(1)
+        if len(calls) > 2:
+            raise RuntimeError('ble')
+        return len(calls)
+
+    async def main():
+        assert await fetch() == 1
+        c.time.t += 20
+        assert await fetch() == 1  # stale, refreshing in the background
+        await asyncio.sleep(0)
+        assert await fetch() == 2
+        c.time.t += 20
+        assert await fetch() == 2  # the refresh fails, keeps serving the stale value
+        await asyncio.sleep(0)
+        assert await fetch() == 2
+        await asyncio.sleep(0)
+        c.time.t += 200  # gone
+        with pytest.raises(RuntimeError, match='ble'):
+            await fetch()
+        n = len(calls)
+        with pytest.raises(RuntimeError, match='ble'):
+            await fetch()  # cached error, the target is not called
+        assert len(calls) == n
+
+    asyncio.run(main())
+
+
+def test_synchronized_threads():
+    calls = []
+
+    @mem_cache_deco(ttl=60, synchronized=True, cache_storage=_storage())
+    def slow(x):
+        calls.append(x)
+        time.sleep(.05)
+        return x
+
+    threads = [threading.Thread(target=slow, args=(1,)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+
+
+def test_sampler_temperatures_without_fetch_temperatures():
+    from bmslib.sampling import BmsSampler
+    from bmslib.test.test_sampling_backoff import _FakeBms
+
+    class _NoTemps(_FakeBms):
+        async def fetch_temperatures(self):
+            raise NotImplementedError()
+
+    sampler = BmsSampler(_NoTemps(), mqtt_client=None, dt_max_seconds=120, expire_after_seconds=60)
+
+    async def main():
+        return [await sampler._fetch_temperatures() for _ in range(2)]  # the 2nd replays the cached error
+
+    assert asyncio.run(main()) == [None, None]
+
+
+def test_stats_published_once_for_all_devices(monkeypatch):
+    import bmslib.mqtt_util as mqtt_util
+    monkeypatch.setattr(mqtt_util, '_last_values', {})
+    monkeypatch.setattr(mqtt_util, '_t_addon_stats', 0.)
+    monkeypatch.setattr(mqtt_util, '_t_addon_discovery', 0.)
+    sent = []
+
+    class _Client:
+        def publish(self, topic, data, retain=False, properties=None):
+            sent.append(topic)
+            return type('Info', (), {'rc': 0})()
+
+    c = _storage()
+    c.get('x')
+    for _ in range(3):  # three samplers
+        mqtt_util.publish_addon_stats(_Client(), c.stats())
+    assert sorted(sent) == sorted(['batmon/cache/%s' % k for k in CACHE_STATS] +
+                                  ['homeassistant/sensor/batmon/cache_%s/config' % k for k in CACHE_STATS])
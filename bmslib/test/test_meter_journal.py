@@ -0,0 +1,77 @@
+"""Meter journal: only changes are appended, compaction, torn-write recovery and the legacy snapshot."""
+import json
+import os
+
+import pytest
+
+from bmslib.store import MeterJournal
+
+
+def _states(charge, energy=1.):
+    return {'bat1': {'total_charge': dict(reading=charge), 'total_energy': dict(reading=energy)},
+            'bat2': {'total_charge': dict(reading=5.)}}
+
+
+def _journal(tmp_path, **kwargs):
+    return MeterJournal(str(tmp_path / 'states.json'), str(tmp_path / 'states.journal'), **kwargs)
+
+
+def test_appends_only_changes(tmp_path):
+    j = _journal(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        j.load()
+    j.store(_states(1.))
+    size = os.path.getsize(tmp_path / 'states.journal')
+    j.store(_states(1.))  # unchanged, nothing written
+    assert os.path.getsize(tmp_path / 'states.journal') == size
+    j.store(_states(1.5))
+    lines = (tmp_path / 'states.journal').read_bytes().splitlines()
+    assert len(lines) == 2 and json.loads(lines[1].split(b' ', 1)[1]) == {'bat1': {'total_charge': {'reading': 1.5}}}
+    j.close()
+    assert _journal(tmp_path).load() == _states(1.5)
+
+
+def test_compaction(tmp_path):
+    j = _journal(tmp_path, compact_bytes=500)
+    for i in range(50):
+        j.store(_states(i, energy=i / 2))
+    assert os.path.getsize(tmp_path / 'states.journal') < 600
+    assert os.path.exists(tmp_path / 'states.json')
+    j.close()
+    assert _journal(tmp_path).load() == _states(49, energy=24.5)
+
+
+def test_crash_during_compaction(tmp_path, monkeypatch):
+    def power_cut(*_):
+        raise OSError('power cut')
+
+    j = _journal(tmp_path, compact_bytes=60)
+    j.store(_states(1.))
+    monkeypatch.setattr(os, 'replace', power_cut)
+    with pytest.raises(OSError):
+        j.store(_states(2., energy=2.))  # exceeds compact_bytes, the snapshot is never written
+    monkeypatch.undo()
+    assert _journal(tmp_path).load() == _states(2., energy=2.)
+
+
+def test_torn_write_recovered(tmp_path):
+    j = _journal(tmp_path)
+    j.store(_states(1.))
+    j.store(_states(2.))
+    j.close()
+    with open(tmp_path / 'states.journal', 'ab') as f:
+        f.write(b'1234abcd {"bat1": {"total_ch')  # power cut
+    j = _journal(tmp_path)
+    assert j.load() == _states(2.)
+    j.store(_states(3.))
+    j.close()
+    assert _journal(tmp_path).load() == _states(3.)
+
+
+def test_legacy_snapshot_only(tmp_path):
+    (tmp_path / 'states.json').write_text(json.dumps(_states(7.)))
+    j = _journal(tmp_path)
+    assert j.load() == _states(7.)
+    j.store(_states(8.))
+    j.close()
+    assert _journal(tmp_path).load() == _states(8.)
@@ -0,0 +1,90 @@
+"""MQTT v5 topic aliases, message expiry and timestamp user property (mqtt_v5 option)."""
+import paho.mqtt.client as paho
+import pytest
+
+import bmslib.mqtt_util as mqtt_util
+from bmslib.mqtt_util import Mqtt5Options, mqtt_single_out
+
+
+class _Props:
+    TopicAliasMaximum = 2
+
+
+class _FakeClient:
+    def __init__(self, rc=paho.MQTT_ERR_SUCCESS):
+        self.rc = rc
+        self.sent = []
+
+    def publish(self, topic, data, retain=False, properties=None):
+        self.sent.append((topic, data, retain, properties))
+        return _Info(self.rc)
+
+
+class _Info:
+    def __init__(self, rc):
+        self.rc = rc
+
+
+@pytest.fixture
+def v5(monkeypatch):
+    opts = Mqtt5Options(message_expiry=20)
+    opts.on_connect(_Props())
+    monkeypatch.setattr(mqtt_util, '_mqtt5', opts)
+    monkeypatch.setattr(mqtt_util, '_last_values', {})
+    return opts
+
+
+def _alias(props):
+    return getattr(props, 'TopicAlias', None)
+
+
+def test_alias_sent_with_topic_once_then_empty(v5):
+    c = _FakeClient()
+    mqtt_single_out(c, 'bat/cell_voltages/1', 3.3)
+    mqtt_single_out(c, 'bat/cell_voltages/1', 3.31)
+    (t1, _, _, p1), (t2, _, _, p2) = c.sent
+    assert (t1, _alias(p1)) == ('bat/cell_voltages/1', 1)
+    assert (t2, _alias(p2)) == ('', 1)
+    assert p2.MessageExpiryInterval == 20
+
+
+def test_alias_max_and_retained_topics(v5):
+    c = _FakeClient()
+    mqtt_single_out(c, 'homeassistant/sensor/bat/_x/config', '{}', retain=True)
+    for t in ('bat/a', 'bat/b', 'bat/c'):
+        mqtt_single_out(c, t, 1)
+    retained = c.sent[0][3]
+    assert _alias(retained) is None
+    assert not hasattr(retained, 'MessageExpiryInterval')
+    assert [_alias(p) for _, _, _, p in c.sent[1:]] == [1, 2, None]  # broker allows 2
+
+
+def test_failed_publish_does_not_confirm_alias(v5):
+    c = _FakeClient(rc=paho.MQTT_ERR_NO_CONN)
+    mqtt_single_out(c, 'bat/a', 1)
+    c.rc = paho.MQTT_ERR_SUCCESS
+    mqtt_single_out(c, 'bat/a', 2)
+    assert c.sent[1][0] == 'bat/a'  # broker never saw the binding, so send the topic again
+
+
+def test_reconnect_resets_aliases(v5):
+    c = _FakeClient()
+    mqtt_single_out(c, 'bat/a', 1)
+    v5.on_connect(_Props())
+    mqtt_single_out(c, 'bat/a', 2)
+    assert c.sent[1][0] == 'bat/a'
+
+
+def test_timestamp_user_property(v5):
+    c = _FakeClient()
+    mqtt_single_out(c, 'bat/soc/current', 1.5, timestamp=1700000000.1234)
+    assert c.sent[0][3].UserProperty == [('ts', '1700000000.123')]
+
+
+def test_discovery_topics_get_no_alias(v5):
+    c = _FakeClient()
+    for i in range(3):
+        mqtt_single_out(c, 'homeassistant/sensor/bat/_%d/config' % i, '{}', state=False)
+    mqtt_single_out(c, 'bat/soc/soc_percent', 80)
+    assert [_alias(p) for _, _, _, p in c.sent] == [None, None, None, 1]
+    assert not hasattr(c.sent[0][3], 'MessageExpiryInterval')
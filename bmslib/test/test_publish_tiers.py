@@ -0,0 +1,123 @@
+"""Publish tiers: fast/medium/slow topic groups with their own period and aggregation."""
+import asyncio
+
+import pytest
+
+import bmslib.mqtt_util as mqtt_util
+from bmslib.bms import BmsSample
+from bmslib.mqtt_util import hass_discovery_components
+from bmslib.sampling import BmsSampler, Downsampler, PublishTier
+
+
+class _Info:
+    rc = 0
+
+
+class _FakeClient:
+    def __init__(self):
+        self.topics = []
+
+    def publish(self, topic, data, retain=False, properties=None):
+        self.topics.append(topic)
+        return _Info()
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+
+class _FakeBms:
+    name = "bat"
+    address = 'serial'
+    is_virtual = False
+    is_connected = True
+    connect_time = 0
+    verbose_log = False
+
+    def __init__(self):
+        self.n = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def fetch(self):
+        self.n += 1
+        return BmsSample(voltage=52 + self.n, current=self.n, soc=50 + self.n, temperatures=[20.])
+
+    async def fetch_voltages(self):
+        return [3300, 3310]
+
+    async def fetch_device_info(self):
+        raise NotImplementedError()
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    monkeypatch.setattr(mqtt_util, '_last_values', {})
+
+
+def test_downsampler_mean_and_reset():
+    ds = Downsampler(fields=('current', 'soc'))
+    for i in range(3):
+        ds += BmsSample(voltage=50 + i, current=i, soc=float('nan') if i == 1 else 10 * i)
+    s = ds.pop()
+    assert (s.current, s.soc, s.voltage) == (1, 10, 52)  # nan skipped, voltage is taken from the last sample
+    assert ds.pop() is None
+
+    ds += BmsSample(voltage=1, current=7)
+    assert ds.pop().current == 7
+    ds += BmsSample(voltage=1, current=9)
+    assert ds.pop().current == 9  # a single-sample pop must not leak into the next window
+
+
+def test_tier_aggregation():
+    mean, last = PublishTier('fast', 1), PublishTier('fast', 1, aggregate='last')
+    for i in range(4):
+        s = BmsSample(voltage=50, current=i)
+        mean.downsampler += s
+        last.downsampler += s
+    assert mean.downsampler.pop().power == pytest.approx(50 * 1.5)
+    assert last.downsampler.pop().current == 3
+
+
+def test_publish_sample_tier_filter():
+    c = _FakeClient()
+    s = BmsSample(voltage=53, current=2, soc=80, switches={'charge': True})
+    mqtt_util.publish_sample(c, 'bat', s, tiers=('medium',))
+    assert sorted(c.topics) == ['bat/soc/soc_percent', 'bat/soc/total_voltage']
+
+
+def test_discovery_expire_after_covers_tier_period():
+    s = BmsSample(voltage=53, current=2, soc=80)
+    comps = hass_discovery_components('bat', 20, s, num_cells=2, temperatures=[20.],
+                                      tier_periods=dict(fast=1, medium=5, slow=60))
+    exp = {oid: c['expire_after'] for (_, oid), c in comps.items()}
+    assert exp['_soc_power'] == 20
+    assert exp['_soc_soc_percent'] == 20
+    assert exp['_temperatures_1'] == exp['_cell_voltages_min'] == 120
+    assert exp['_meter_total_energy'] == 7200
+
+
+def test_sampler_publishes_tiers_at_their_period():
+    c = _FakeClient()
+    sampler = BmsSampler(_FakeBms(), mqtt_client=c, dt_max_seconds=120, expire_after_seconds=20,
+                         publish_period=0, publish_tiers=dict(medium_period=1000, slow_period=1000))
+    sampler.num_samples = 1  # skip subscribe_switches / device info
+
+    asyncio.run(sampler())  # first sample publishes everything (incl. discovery)
+    assert 'bat/temperatures/1' in c.topics and 'bat/soc/soc_percent' in c.topics
+
+    c.topics.clear()
+    mqtt_util._last_values.clear()
+    for _ in range(3):
+        asyncio.run(sampler())
+    assert c.topics.count('bat/soc/current') == 3
+    assert not [t for t in c.topics if t.startswith(('bat/soc/soc_percent', 'bat/cell_voltages', 'bat/temperatures'))]
+
+    sampler.tiers['medium'].period.state = True  # period elapsed
+    c.topics.clear()
+    asyncio.run(sampler())
+    assert 'bat/cell_voltages/1' in c.topics and 'bat/cell_voltages/min' not in c.topics
+    assert 'bat/soc/soc_percent' in c.topics
@@ -0,0 +1,144 @@
+"""Native QuestDB ILP: table/column naming, type pinning, TCP and HTTP transports against local stand-ins."""
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bmslib.questdb_writer import IlpEncoder, IlpTcpWriter
+
+
+class _TcpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.num_connects += 1
+        buf = b''
+        while True:
+            d = self.request.recv(65536)
+            if not d:
+                break
+            buf += d
+            self.server.received += d
+            if b'bad_line' in buf:
+                return  # QuestDB drops the connection on a parse error
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = b''
+        while True:
+            n = int(self.rfile.readline().split(b';')[0], 16)
+            if n == 0:
+                self.rfile.readline()
+                break
+            body += self.rfile.read(n)
+            self.rfile.readline()
+        assert 'Content-Encoding' not in self.headers
+        self.server.requests.append((self.path, body))
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(srv):
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    return srv
+
+
+@pytest.fixture
+def tcp_server():
+    srv = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _TcpHandler)
+    srv.daemon_threads = True
+    srv.num_connects, srv.received = 0, b''
+    yield _serve(srv)
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def http_server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), _HttpHandler)
+    srv.requests = []
+    yield _serve(srv)
+    srv.shutdown()
+    srv.server_close()
+
+
+def _wait(cond, timeout=2.):
+    t0 = time.time()
+    while not cond() and time.time() - t0 < timeout:
+        time.sleep(.01)
+    return cond()
+
+
+def test_encoder_tables_symbols_and_type_pinning():
+    enc = IlpEncoder('tele_')
+    assert enc.encode('batmon', {'device': 'my bat'}, {'voltage': 53100, 'power': 10.5}, 5) == \
+           b'tele_batmon,device=my\\ bat power=10.5,voltage=53100i 5\n'
+    # power was written as double, voltage as long: later flips are coerced, not sent with the wrong type
+    assert enc.encode('batmon', {'device': 'b'}, {'voltage': 53.4, 'power': 11}, 6) == \
+           b'tele_batmon,device=b power=11.0,voltage=53i 6\n'
+    assert enc.encode('batmon', None, {'power': 'text'}, 7) is None
+    assert enc.encode('a.b', {'x-y': 1}, {'c(d)': 1.}, 8) == b'tele_a_b,x_y=1 c_d_=1.0 8\n'
+
+
+def test_tcp_keeps_connection_and_reconnects_after_server_close(tcp_server):
+    w = IlpTcpWriter('127.0.0.1:%d' % tcp_server.server_address[1])
+    w.write(b'm v=1i 1\n')
+    w.write(bytearray(b'm v=2i 2\n'))
+    assert _wait(lambda: tcp_server.received == b'm v=1i 1\nm v=2i 2\n')
+    assert w.num_connects == 1
+
+    w.write(b'bad_line\n')
+    assert _wait(lambda: b'bad_line' in tcp_server.received)
+    time.sleep(.05)  # server closes the connection
+    w.write(b'm v=3i 3\n')
+    assert _wait(lambda: tcp_server.received.endswith(b'm v=3i 3\n'))
+    assert w.num_connects == 2 and tcp_server.num_connects == 2
+    w.close()
+
+
+def test_tcp_connection_refused_raises():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    with pytest.raises(OSError):
+        IlpTcpWriter('127.0.0.1', port, timeout=1).write(b'm v=1i 1\n')
+
+
+def test_sink_http_native_tables(http_server):
+    from bmslib.bms import BmsSample
+    from bmslib.sinks import QuestDBSink
+    sink = QuestDBSink(host='127.0.0.1', port=http_server.server_port, database='tele', flush_interval=3600)
+    sink.publish_sample('bat', BmsSample(voltage=53.1, current=-2.0, soc=80, timestamp=1700000000.5))
+    sink.publish_voltages('bat', [3300])
+    sink.flush()
+    path, body = http_server.requests[0]
+    assert path == '/write?precision=n'
+    lines = body.decode().splitlines()
+    assert lines[0].startswith('tele_batmon,device=bat ') and 'voltage=53100i' in lines[0]
+    assert lines[0].endswith(' 1700000000500000000')
+    assert lines[-1].startswith('tele_cells,cell_index=0,device=bat voltage=3300i ')
+    sink.close()
+
+
+def test_sink_flushes_by_bytes_before_interval(tcp_server):
+    from bmslib.sinks import QuestDBSink
+    sink = QuestDBSink(host='127.0.0.1', port=tcp_server.server_address[1], transport='tcp', flush_interval=3600,
+                       flush_bytes=200)
+    sink._enqueue('m', {'device': 'b'}, {'v': 0}, 0)
+    time.sleep(.1)
+    assert tcp_server.received == b''  # below flush_bytes, waits for the interval
+    for i in range(1, 20):
+        sink._enqueue('m', {'device': 'b'}, {'v': i}, i)
+    assert _wait(lambda: tcp_server.received.count(b'\n') == 20)
+    assert tcp_server.received.startswith(b'm,device=b v=0i 0\n')
+    sink.close()
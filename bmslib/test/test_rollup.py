@@ -0,0 +1,119 @@
+"""In-process rollups: bucket aggregation, meter deltas, publishing through the sinks."""
+import asyncio
+import math
+import time
+
+import pytest
+
+from bmslib.bms import BmsSample
+from bmslib.rollup import RollupEngine, resolution_label
+from bmslib.sampling import BmsSampler, BmsSampleSink
+
+
+def test_labels():
+    assert [resolution_label(r) for r in (30, 60, 900, 3600, 86400, 90)] == ['30s', '1m', '15m', '1h', '1d', '90s']
+
+
+def test_buckets_min_max_mean_last():
+    eng = RollupEngine([60])
+    out = []
+    for t, cur in ((0, 1.), (20, 3.), (40, math.nan), (59, 2.), (61, 10.)):
+        out += eng.add(BmsSample(voltage=50, current=cur, timestamp=1000 * 60 + t))
+    assert len(out) == 1
+    res, start, f = out[0]
+    assert (res, start) == (60, 60000)
+    assert (f['current_min'], f['current_max'], f['current_last']) == (1, 3, 2)
+    assert f['current_mean'] == pytest.approx(2)
+    assert f['voltage_mean'] == 50 and f['num_samples'] == 4
+
+
+def test_meter_deltas_are_contiguous():
+    eng = RollupEngine([60, 120])
+    energy = 0.
+    out = []
+    for t in range(0, 250, 10):
+        energy += 0.5
+        out += eng.add(BmsSample(voltage=50, current=1, timestamp=6000 + t), meters=dict(total_energy=energy))
+    m1 = [f['total_energy_delta'] for r, _, f in out if r == 60]
+    assert len(m1) == 4
+    # the first bucket counts from its first reading, later ones from the end of the previous bucket
+    assert m1 == pytest.approx([2.5, 3, 3, 3])
+    assert sum(f['total_energy_delta'] for r, _, f in out if r == 120) == pytest.approx(sum(m1))
+
+
+def test_cell_min_max():
+    eng = RollupEngine([10])
+    eng.add(BmsSample(voltage=50, current=1, timestamp=6000), voltages=[3300, 3310])
+    eng.add(BmsSample(voltage=50, current=1, timestamp=6005), voltages=[3290, 3305])
+    (_, _, f), = eng.add(BmsSample(voltage=50, current=1, timestamp=6010))
+    assert (f['voltage_cell_min_min'], f['voltage_cell_max_max']) == (3290, 3310)
+
+
+class _Sink(BmsSampleSink):
+    def __init__(self):
+        self.rollups = []
+
+    def publish_sample(self, bms_name, sample, tags=None):
+        pass
+
+    def publish_voltages(self, bms_name, voltages):
+        pass
+
+    def publish_rollup(self, bms_name, resolution, timestamp, fields):
+        self.rollups.append((bms_name, resolution, timestamp, fields))
+
+
+class _Bms:
+    name = "bat"
+    address = 'serial'
+    is_virtual = False
+    is_connected = True
+    connect_time = 0
+    verbose_log = False
+
+    def __init__(self):
+        self.t = 0
+        self.t0 = (time.time() // 60) * 60 - 60  # samples at t0, t0+30, t0+60
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def fetch(self):
+        self.t += 1
+        return BmsSample(voltage=52, current=self.t, soc=50, temperatures=[20.], timestamp=self.t0 + (self.t - 1) * 30)
+
+    async def fetch_voltages(self):
+        return [3300, 3310]
+
+    async def fetch_device_info(self):
+        raise NotImplementedError()
+
+
+def test_sampler_publishes_rollups(monkeypatch):
+    import bmslib.mqtt_util as mqtt_util
+    monkeypatch.setattr(mqtt_util, '_last_values', {})
+    sink = _Sink()
+    sampler = BmsSampler(_Bms(), mqtt_client=None, dt_max_seconds=120, expire_after_seconds=200, publish_period=0,
+                         sinks=[sink], rollups=[60])
+    sampler.num_samples = 1
+    monkeypatch.setattr(sampler, 'publish_meters', lambda: None)
+    for _ in range(3):
+        asyncio.run(sampler())
+    assert len(sink.rollups) == 1
+    name, res, t0, f = sink.rollups[0]
+    assert (name, res, f['current_max'], f['num_samples']) == ('bat', 60, 2, 2)
+    assert 'total_charge_delta' in f
+
+
+def test_influx_sink_writes_rollup_measurement():
+    from bmslib.sinks import InfluxDBSink
+    sink = InfluxDBSink(host="localhost", flush_interval=3600)
+    sent = []
+    sink._send = lambda data: sent.append(bytes(data)) or True
+    sink.publish_rollup('bat', 900, 1700000100, dict(current_mean=1.23456, num_samples=12))
+    sink.flush()
+    sink.close()
+    assert sent == [b'batmon_15m,device=bat current_mean=1.2346,num_samples=12i 1700000100000000000\n']
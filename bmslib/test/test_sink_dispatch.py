@@ -0,0 +1,136 @@
+"""Per-sink dispatcher: sampling never waits on a slow sink, overflow policies, fault isolation, stats."""
+import threading
+import time
+
+import pytest
+
+from bmslib.bms import BmsSample
+from bmslib.dispatch import SinkDispatcher
+from bmslib.sampling import BmsSampleSink
+
+
+class _Sink(BmsSampleSink):
+    def __init__(self, gate=None, fail=False):
+        self.gate = gate
+        self.fail = fail
+        self.calls = []
+        self.closed = False
+
+    def publish_sample(self, bms_name, sample, tags=None):
+        if self.gate:
+            self.gate.wait()
+        if self.fail:
+            raise ValueError("broken sink")
+        self.calls.append((bms_name, sample.voltage))
+
+    def publish_voltages(self, bms_name, voltages):
+        self.calls.append((bms_name, tuple(voltages)))
+
+    def publish_rollup(self, bms_name, resolution, timestamp, fields):
+        self.calls.append((bms_name, resolution, timestamp))
+
+    def close(self):
+        self.closed = True
+
+
+def _fill(d, n, name='bat'):
+    t0 = time.perf_counter()
+    for i in range(n):
+        d.publish_sample(name, BmsSample(voltage=i, current=0))
+    return time.perf_counter() - t0
+
+
+def test_slow_sink_does_not_block_and_drops_oldest():
+    gate = threading.Event()
+    sink = _Sink(gate)
+    d = SinkDispatcher(sink, max_queue=3)
+    assert _fill(d, 10) < .5
+    time.sleep(.05)  # worker holds one call blocked in the sink
+    gate.set()
+    d.close()
+    assert sink.closed
+    assert sink.calls[-3:] == [('bat', 7), ('bat', 8), ('bat', 9)]
+    assert d.stats()['dropped'] == 10 - len(sink.calls)
+
+
+def test_coalesce_keeps_latest_per_device():
+    gate = threading.Event()
+    sink = _Sink(gate)
+    d = SinkDispatcher(sink, max_queue=10, policy='coalesce')
+    d.publish_sample('a', BmsSample(voltage=0, current=0))
+    time.sleep(.05)  # worker blocked on the first call
+    _fill(d, 5, 'a')
+    _fill(d, 5, 'b')
+    d.publish_voltages('a', [3300])
+    gate.set()
+    d.close()
+    assert sink.calls == [('a', 0), ('a', 4), ('b', 4), ('a', (3300,))]
+    assert d.num_coalesced == 8
+
+
+def test_coalesce_keeps_every_rollup():
+    gate = threading.Event()
+    sink = _Sink(gate)
+    d = SinkDispatcher(sink, max_queue=10, policy='coalesce')
+    d.publish_sample('a', BmsSample(voltage=0, current=0))
+    time.sleep(.05)
+    for t in (60, 120, 180):
+        d.publish_rollup('a', 60, t, dict(voltage=1.))
+    gate.set()
+    d.close()
+    assert sink.calls[1:] == [('a', 60, 60), ('a', 60, 120), ('a', 60, 180)] and d.num_coalesced == 0
+
+
+def test_sink_left_open_while_in_a_call():
+    gate = threading.Event()
+    sink = _Sink(gate)
+    d = SinkDispatcher(sink)
+    d.publish_sample('a', BmsSample(voltage=0, current=0))
+    time.sleep(.05)
+    d.close(timeout=.05)
+    assert not sink.closed
+    gate.set()
+
+
+def test_block_waits_then_drops():
+    gate = threading.Event()
+    sink = _Sink(gate)
+    d = SinkDispatcher(sink, max_queue=1, policy='block', block_timeout=.05)
+    d.publish_sample('a', BmsSample(voltage=0, current=0))
+    time.sleep(.05)
+    _fill(d, 1)
+    assert _fill(d, 1) >= .04  # queue full: the caller waited
+    assert d.num_dropped == 1
+    gate.set()
+    d.close()
+    assert [c[1] for c in sink.calls] == [0, 0]
+
+
+def test_failing_sink_is_isolated():
+    bad, good = _Sink(fail=True), _Sink()
+    sinks = [SinkDispatcher(bad), SinkDispatcher(good)]
+    for s in sinks:
+        s.publish_sample('a', BmsSample(voltage=1, current=0))
+        s.publish_voltages('a', [3300])
+    for s in sinks:
+        s.close()
+    assert sinks[0].num_errors == 1 and bad.calls == [('a', (3300,))]
+    assert good.calls == [('a', 1), ('a', (3300,))]
+    assert sinks[1].stats()['calls'] == 2
+
+
+def test_sample_is_copied_on_enqueue():
+    gate = threading.Event()
+    sink = _Sink(gate)
+    d = SinkDispatcher(sink)
+    s = BmsSample(voltage=52, current=0)
+    d.publish_sample('a', s)
+    s.voltage = 1  # sampler keeps working on the sample
+    gate.set()
+    d.close()
+    assert sink.calls == [('a', 52)]
+
+
+def test_unknown_policy():
+    with pytest.raises(AssertionError):
+        SinkDispatcher(_Sink(), policy='drop_newest')
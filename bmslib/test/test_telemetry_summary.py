@@ -0,0 +1,126 @@
+"""Telemetry windowed summaries: P² quantiles, per-device window metrics, bounded rows, upload to a local stand-in."""
+import gzip
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bmslib.bms import BmsSample
+from bmslib.sinks import TelemetrySink, _TelemetryWindow
+from bmslib.streamstats import P2Quantile, StreamStats
+
+
+def test_p2_quantiles():
+    rnd = random.Random(1)
+    xs = [rnd.gauss(50, 10) for _ in range(20000)]
+    qs = {p: P2Quantile(p) for p in (.1, .5, .9)}
+    for x in xs:
+        for q in qs.values():
+            q.add(x)
+    xs.sort()
+    for p, q in qs.items():
+        assert q.value() == pytest.approx(xs[int(p * len(xs))], abs=.5)
+
+
+def test_stream_stats_few_and_none():
+    st = StreamStats()
+    assert st.fields('v') == {}
+    for x in (3, None, float('nan'), 1, 2):
+        st.add(x)
+    assert st.fields('v') == dict(v_min=1, v_max=3, v_mean=2, v_p10=1, v_p50=2, v_p90=3)
+
+
+def test_window_metrics():
+    w = _TelemetryWindow(0)
+    t = 1700000000
+    for i in range(60):  # 30 s charging at 10 A, 30 s discharging at 20 A, 1 Hz
+        cur = -10. if i < 30 else 20.
+        w.add_sample(BmsSample(voltage=50., current=cur, soc=50 + i / 10, num_cycles=3, timestamp=t + i))
+    w.add_sample(BmsSample(voltage=50., current=20., timestamp=t + 70))  # gap
+    w.add_sample(BmsSample(voltage=float('nan'), current=0, timestamp=t + 71))
+    w.add_voltages({0: 3300, 1: 3310})
+    w.add_voltages({0: 3302, 1: 3306})
+    f = w.fields()
+    assert (f['num_samples'], f['num_invalid'], f['num_gaps'], f['num_direction_changes']) == (62, 1, 1, 1)
+    assert f['charge_ah'] == pytest.approx(10 * 29 / 3600, abs=1e-4)  # trapezoid, the crossing counts +5 A
+    assert f['discharge_ah'] == pytest.approx((5 + 20 * 40) / 3600, abs=1e-4)
+    assert f['current_min'] == -10 and f['current_max'] == 20 and f['dt_p50'] == 1
+    assert f['soc_delta'] == pytest.approx(5.9) and f['num_cycles'] == 3
+    assert (f['voltage_cell_min'], f['voltage_cell_max'], f['cell_spread_max']) == (3300, 3310, 10)
+    assert (f['voltage_cell000'], f['voltage_cell001']) == (3301, 3308)
+
+
+class _Bms:
+    is_virtual = False
+
+    def __init__(self, i):
+        self.address = 'AA:BB:CC:DD:EE:%02X' % i
+        self.slug = 'jk_%d' % i
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = b''
+        while True:
+            n = int(self.rfile.readline().split(b';')[0], 16)
+            if n == 0:
+                self.rfile.readline()
+                break
+            body += self.rfile.read(n)
+            self.rfile.readline()
+        self.server.lines += gzip.decompress(body).decode().splitlines()
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    srv.lines = []
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _sink(server, n, **kwargs):
+    sink = TelemetrySink({'bat%d' % i: _Bms(i) for i in range(n)}, host='127.0.0.1', port=server.server_port,
+                         **kwargs)
+    sink.did, sink._did_resolved = 'disk', True
+    return sink
+
+
+def test_rows_bounded_by_max_devices(server):
+    sink = _sink(server, 20, window=3600, max_devices=8)
+    t = time.time()
+    for k in range(10):
+        for i in range(20):
+            sink.publish_sample('bat%d' % i, BmsSample(voltage=52, current=1, timestamp=t + k))
+    sink.emit()
+    assert len(sink._windows) == 12
+    sink.emit()
+    sink.close()  # the last 4
+    rows = [l for l in server.lines if l.startswith('summary,')]
+    assert len(rows) == 20 and len({l.split(' ')[0] for l in rows}) == 20
+    assert server.lines and all(l.startswith('summary,') for l in server.lines)
+
+
+def test_summary_upload(server):
+    sink = _sink(server, 1, window=3600)
+    t = time.time()
+    for k in range(30):
+        sink.publish_sample('bat0', BmsSample(voltage=52 + k / 100, current=-5, soc=60, timestamp=t + k))
+        sink.publish_voltages('bat0', [3300, 3301 + k % 2])
+    sink.publish_sample('not_registered', BmsSample(voltage=1, current=0))
+    sink.close()
+    row, = server.lines
+    assert row.startswith('summary,addrh=%s,did=disk,slug=jk_0,uid=' % sink.addrh_by_name['bat0'])
+    assert 'num_samples=30i' in row and 'voltage_p50=' in row and 'voltage_cell001=' in row
@@ -0,0 +1,101 @@
+"""Embedded time-series store: block codec, partitions, retention, queries and the local store sink."""
+import os
+import time
+
+import pytest
+
+from bmslib.bms import BmsSample
+from bmslib.tsstore import TimeSeriesStore, encode_block, decode_block, read_blocks, _BLOCK_HEADER
+
+
+def test_block_roundtrip():
+    times = [1700000000000 + i * 1000 for i in range(100)] + [1700000100500]
+    cols = dict(voltage=[52.1 + (i % 3) * .001 for i in range(101)],
+                soc=[None if i % 10 else 50 + i // 10 for i in range(101)],
+                charging=[i % 2 == 0 for i in range(101)],
+                cycles=[7] * 101)
+    block = encode_block(times, cols, scales=dict(voltage=1000))
+    t, out = decode_block(block[_BLOCK_HEADER.size:])
+    assert t == [x / 1e3 for x in times]
+    assert out['voltage'] == pytest.approx(cols['voltage'])
+    assert out['soc'] == cols['soc'] and out['charging'] == cols['charging'] and out['cycles'] == cols['cycles']
+
+
+def test_constant_period_compresses():
+    n = 3600
+    block = encode_block([1700000000000 + i * 1000 for i in range(n)],
+                         dict(voltage=[52.0 + (i // 60) * .01 for i in range(n)], current=[1.5] * n), {})
+    assert len(block) < 300  # < 0.1 byte per value
+
+
+def test_buffering_partitions_and_query(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), flush_interval=3600, max_rows=50)
+    t0 = (time.time() // 86400) * 86400 - 30  # crosses midnight UTC
+    for i in range(60):
+        store.append('bat 1', 'sample', t0 + i, dict(voltage=52. + i / 100, soc=None if i == 5 else 50))
+    files = sorted(os.listdir(tmp_path / 'bat_1'))
+    assert len(files) == 1 and files[0].startswith('sample.')  # the day before, the rest is buffered
+
+    q = store.query('bat 1', since=t0 + 20, until=t0 + 40)
+    assert q['time'] == [t0 + i for i in range(20, 40)]
+    assert q['voltage'] == pytest.approx([52 + i / 100 for i in range(20, 40)])
+
+    store.close()
+    assert len(os.listdir(tmp_path / 'bat_1')) == 2
+    q = store.query('bat 1', since=t0, fields=['soc'])
+    assert set(q) == {'time', 'soc'} and len(q['time']) == 60 and q['soc'][5] is None
+
+
+def test_columns_appear_and_disappear(tmp_path):
+    store = TimeSeriesStore(str(tmp_path))
+    t0 = time.time() // 1 - 100
+    store.append('b', 'sample', t0, dict(a=1))
+    store.flush()
+    store.append('b', 'sample', t0 + 1, dict(b=2.5))
+    q = store.query('b')
+    assert q['time'] == [t0, t0 + 1]
+    assert q['a'] == [1, None] and q['b'] == [None, 2.5]
+
+
+def test_torn_block_and_retention(tmp_path):
+    store = TimeSeriesStore(str(tmp_path), retention_days=2)
+    now = time.time()
+    for d in (5, 0):
+        store.append('b', 'sample', now - d * 86400, dict(v=d))
+        store.flush()
+    path = store._path('b', 'sample', time.strftime('%Y%m%d', time.gmtime(now)))
+    with open(path, 'ab') as f:
+        f.write(b'BTSB\xff\x00')
+    assert len(list(read_blocks(path))) == 1
+
+    store._apply_retention(now)
+    assert os.listdir(tmp_path / 'b') == [os.path.basename(path)]
+
+
+def test_local_store_sink(tmp_path):
+    from bmslib.sinks import LocalStoreSink
+    sink = LocalStoreSink(str(tmp_path))
+    t0 = time.time() - 10
+    for i in range(5):
+        sink.publish_sample('bat', BmsSample(voltage=53.2, current=-1.25 * i, soc=80, temperatures=[20.5],
+                                             timestamp=t0 + i))
+    sink.publish_voltages('bat', [3301, 3302, float('nan')])
+    sink.publish_meters('bat', dict(total_energy=1.5))
+    sink.close()
+    q = sink.query('bat', hours=1)
+    assert q['current'] == pytest.approx([-1.25 * i for i in range(5)])
+    assert q['temperatures_0'] == [20.5] * 5
+    assert sink.query('bat', table='cells')['voltage_cell001'] == [3302]
+    assert sink.query('bat', table='meters')['total_energy'] == [1.5]
+
+
+def test_non_numeric_fields_skipped(tmp_path):
+    from bmslib.sinks import LocalStoreSink
+    sink = LocalStoreSink(str(tmp_path), flush_interval=0)
+    t0 = time.time() - 10
+    for i in range(3):
+        sink.publish_sample('bat', BmsSample(voltage=53.2, current=1., soc=80, battery_mode='FLOAT',
+                                             timestamp=t0 + i))
+    sink.close()
+    q = sink.query('bat', hours=1)
+    assert q['voltage'] == [53.2] * 3 and 'battery_mode' not in q
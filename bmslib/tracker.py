@@ -14,8 +14,7 @@ Battery tracker:
 
 from typing import Optional, Tuple
 
-import numpy as np
-
+from bmslib.cellstats import cell_stats
 from bmslib.util import dotdict, get_logger
 
 logger = get_logger()
@@ -77,11 +76,11 @@ class BatteryTracker:
                 s.weakest_cell = None
 
     def update_cell_voltages(self, voltages):
-        min_idx = np.argmin(voltages)
-        max_idx = np.argmax(voltages)
-
-        min_v = voltages[min_idx]
-        max_v = voltages[max_idx]
+        st = cell_stats(voltages)
+        if not st:
+            return False
+        min_idx, min_v = st.min_index, st.min
+        max_idx, max_v = st.max_index, st.max
 
         if min_v < chemistry.cell_voltage_min_valid:
             logger.warn("cell %d voltage %d lower than expected", min_idx, min_v)
@@ -0,0 +1,319 @@
+"""
+Embedded time-series store for sites without an InfluxDB/QuestDB: compressed columnar blocks in append-only,
+day-partitioned files, `<directory>/<series>/<table>.<YYYYMMDD>.bts` (UTC days).
+
+Rows are buffered in memory per series and table and written as one block every `flush_interval` seconds (or
+`max_rows`), so the SD card sees one append per file every few minutes instead of a write per sample. Files are
+never rewritten; retention deletes whole day files.
+
+Block: `BLOCK_MAGIC <u32 length> <u32 crc32> zlib(payload)`, payload is a JSON header line
+`{"n": rows, "t0": first time in ms, "cols": [[name, kind, scale, nullable], ...]}` followed by the columns:
+* time: delta-of-delta zigzag varints (ms), a constant sample period costs a 0 byte per row
+* values as scaled integers (`round(v * scale)`, see doc/QuestDB-compression.md), delta zigzag varints, preceded by
+  a null bitmap if the column has gaps. kind is 'f' (decoded as v / scale), 'i' or 'b'.
+A torn or corrupt block (power loss) ends the reading of that file.
+"""
+import json
+import math
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from bmslib.util import get_logger
+
+logger = get_logger()
+
+BLOCK_MAGIC = b'BTSB'
+_BLOCK_HEADER = struct.Struct('<4sII')
+
+DEFAULT_FLOAT_SCALE = 1000  # same precision as round(v, 3)
+
+
+def _zigzag(v: int) -> int:
+    return (v << 1) if v >= 0 else ((-v << 1) - 1)
+
+
+def _unzigzag(v: int) -> int:
+    return (v >> 1) if not v & 1 else -((v + 1) >> 1)
+
+
+def _put_varint(out: bytearray, v: int):
+    while v > 0x7F:
+        out.append((v & 0x7F) | 0x80)
+        v >>= 7
+    out.append(v)
+
+
+def _get_varint(buf, off):
+    v = shift = 0
+    while True:
+        b = buf[off]
+        off += 1
+        v |= (b & 0x7F) << shift
+        if b < 0x80:
+            return v, off
+        shift += 7
+
+
+def _day(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y%m%d')
+
+
+def _safe_name(s: str) -> str:
+    return re.sub(r'[^\w.-]', '_', s)
+
+
+def _column_kind(name, values, scales):
+    """ (kind, scale) of a column from its non-null values """
+    if all(isinstance(v, bool) for v in values):
+        return 'b', 1
+    if name not in scales and all(isinstance(v, int) for v in values):
+        return 'i', 1
+    return 'f', scales.get(name, DEFAULT_FLOAT_SCALE)
+
+
+def encode_block(times_ms: List[int], columns: Dict[str, list], scales: Dict[str, float]) -> bytes:
+    n = len(times_ms)
+    body = bytearray()
+    prev, prev_delta = times_ms[0], 0
+    for t in times_ms[1:]:
+        delta = t - prev
+        _put_varint(body, _zigzag(delta - prev_delta))
+        prev, prev_delta = t, delta
+
+    cols = []
+    for name, values in columns.items():
+        present = [v for v in values if v is not None]
+        if not present:
+            continue
+        kind, scale = _column_kind(name, present, scales)
+        nullable = len(present) < n
+        if nullable:
+            bitmap = bytearray((n + 7) // 8)
+            for i, v in enumerate(values):
+                if v is not None:
+                    bitmap[i >> 3] |= 1 << (i & 7)
+            body += bitmap
+        last = 0
+        for v in present:
+            iv = int(v) if kind != 'f' else int(round(v * scale))
+            _put_varint(body, _zigzag(iv - last))
+            last = iv
+        cols.append([name, kind, scale, nullable])
+
+    header = json.dumps(dict(n=n, t0=times_ms[0], cols=cols), separators=(',', ':')).encode('utf-8')
+    payload = zlib.compress(header + b'\n' + bytes(body), 6)
+    return _BLOCK_HEADER.pack(BLOCK_MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_block(payload: bytes):
+    """ :return: times (s), {column: values} """
+    raw = zlib.decompress(payload)
+    nl = raw.index(b'\n')
+    header = json.loads(raw[:nl])
+    n = header['n']
+    off = nl + 1
+
+    t = header['t0']
+    delta = 0
+    times_ms = [t]
+    for _ in range(n - 1):
+        dod, off = _get_varint(raw, off)
+        delta += _unzigzag(dod)
+        t += delta
+        times_ms.append(t)
+
+    columns = {}
+    for name, kind, scale, nullable in header['cols']:
+        if nullable:
+            nb = (n + 7) // 8
+            bitmap = raw[off:off + nb]
+            off += nb
+            mask = [bool(bitmap[i >> 3] & (1 << (i & 7))) for i in range(n)]
+        else:
+            mask = None
+        values = []
+        last = 0
+        for i in range(n):
+            if mask is not None and not mask[i]:
+                values.append(None)
+                continue
+            d, off = _get_varint(raw, off)
+            last += _unzigzag(d)
+            values.append(last / scale if kind == 'f' else (bool(last) if kind == 'b' else last))
+        columns[name] = values
+    return [t / 1e3 for t in times_ms], columns
+
+
+def read_blocks(path: str):
+    try:
+        with open(path, 'rb') as f:
+            buf = f.read()
+    except FileNotFoundError:
+        return
+    off = 0
+    while off + _BLOCK_HEADER.size <= len(buf):
+        magic, length, crc = _BLOCK_HEADER.unpack_from(buf, off)
+        payload = buf[off + _BLOCK_HEADER.size:off + _BLOCK_HEADER.size + length]
+        if magic != BLOCK_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+            logger.warning('tsstore: %s: torn block at %d, ignoring the rest', path, off)
+            return
+        off += _BLOCK_HEADER.size + length
+        yield decode_block(payload)
+
+
+class _Buffer:
+    __slots__ = ('day', 'times_ms', 'columns', 't_created')
+
+    def __init__(self, day):
+        self.day = day
+        self.times_ms: List[int] = []
+        self.columns: Dict[str, list] = {}
+        self.t_created = time.time()
+
+    def append(self, t_ms, fields: dict):
+        n = len(self.times_ms)
+        self.times_ms.append(t_ms)
+        cols = self.columns
+        for k, v in fields.items():
+            if not isinstance(v, (int, float)) or (isinstance(v, float) and not math.isfinite(v)):
+                continue  # None, NaN and non-numeric fields such as battery_mode
+            col = cols.get(k)
+            if col is None:
+                col = cols[k] = [None] * n
+            col.append(v)
+        for col in cols.values():
+            if len(col) == n:
+                col.append(None)
+
+
+class TimeSeriesStore:
+
+    def __init__(self, directory: str, retention_days: float = 30, flush_interval: float = 300,
+                 max_rows: int = 3600, scales: Optional[Dict[str, float]] = None):
+        """
+        :param scales: fixed-point scale by column name, other floats are stored with 3 decimals
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.scales = dict(scales or {})
+        self._buffers: Dict[tuple, _Buffer] = {}
+        self._lock = threading.Lock()
+        self._t_check = time.time()
+        self._t_retention = 0
+        self.bytes_written = 0
+
+    def _path(self, series, table, day):
+        return os.path.join(self.directory, _safe_name(series), '%s.%s.bts' % (_safe_name(table), day))
+
+    def append(self, series: str, table: str, timestamp: float, fields: dict):
+        day = _day(timestamp)
+        key = (series, table)
+        with self._lock:
+            buf = self._buffers.get(key)
+            if buf is not None and buf.day != day:
+                self._flush_buffer(key, buf)
+                buf = None
+            if buf is None:
+                buf = self._buffers[key] = _Buffer(day)
+            buf.append(int(round(timestamp * 1e3)), fields)
+            if len(buf.times_ms) >= self.max_rows:
+                self._flush_buffer(key, buf)
+
+            now = time.time()
+            if now - self._t_check >= min(10., self.flush_interval):
+                self._t_check = now
+                for k, b in list(self._buffers.items()):
+                    if now - b.t_created >= self.flush_interval:
+                        self._flush_buffer(k, b)
+                if now - self._t_retention > 3600:
+                    self._t_retention = now
+                    self._apply_retention(now)
+
+    def _flush_buffer(self, key, buf: _Buffer):
+        if not buf.times_ms:
+            del self._buffers[key]
+            return
+        path = self._path(*key, buf.day)
+        block = encode_block(buf.times_ms, buf.columns, self.scales)
+        del self._buffers[key]  # only once encoded, so the rows survive an encoding error
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as f:
+                f.write(block)
+            self.bytes_written += len(block)
+        except OSError as e:
+            logger.error('tsstore: failed to write %d rows to %s: %s', len(buf.times_ms), path, e)
+
+    def flush(self):
+        with self._lock:
+            for key, buf in list(self._buffers.items()):
+                self._flush_buffer(key, buf)
+
+    def _apply_retention(self, now):
+        if not self.retention_days:
+            return
+        oldest = _day(now - self.retention_days * 86400)
+        for series in os.listdir(self.directory):
+            d = os.path.join(self.directory, series)
+            if not os.path.isdir(d):
+                continue
+            for fn in os.listdir(d):
+                m = re.match(r'.+\.(\d{8})\.bts$', fn)
+                if m and m.group(1) < oldest:
+                    os.remove(os.path.join(d, fn))
+                    logger.info('tsstore: removed expired %s/%s', series, fn)
+
+    def query(self, series: str, table: str = 'sample', since: Optional[float] = None, until: Optional[float] = None,
+              fields: Optional[List[str]] = None) -> Dict[str, list]:
+        """
+        Rows of `series`/`table` with since <= time < until, including rows not yet flushed.
+        :return: columns {'time': [..], field: [..]}, missing values are None
+        """
+        until = time.time() + 1 if until is None else until
+        since = until - 86400 if since is None else since
+        parts = []
+
+        days = sorted({_day(t) for t in range(int(since), int(until) + 86400, 86400)})
+        for day in days:
+            if day > _day(until):
+                break
+            parts.extend(read_blocks(self._path(series, table, day)))
+        with self._lock:
+            buf = self._buffers.get((series, table))
+            if buf is not None and buf.times_ms:
+                parts.append(([t / 1e3 for t in buf.times_ms], {k: list(v) for k, v in buf.columns.items()}))
+
+        out = dict(time=[])
+        n = 0
+        for times, columns in parts:
+            sel = [i for i, t in enumerate(times) if since <= t < until]
+            if not sel:
+                continue
+            out['time'].extend(times[i] for i in sel)
+            for name, values in columns.items():
+                if fields is not None and name not in fields:
+                    continue
+                col = out.get(name)
+                if col is None:
+                    col = out[name] = [None] * n
+                col.extend(values[i] for i in sel)
+            n += len(sel)
+            for col in out.values():
+                if len(col) < n:
+                    col.extend([None] * (n - len(col)))
+        return out
+
+    def last_hours(self, series: str, hours: float, table: str = 'sample', fields: Optional[List[str]] = None):
+        return self.query(series, table, since=time.time() - hours * 3600, fields=fields)
+
+    def close(self):
+        self.flush()
@@ -7,9 +7,6 @@ import time
 from importlib.metadata import PackageNotFoundError
 from typing import List, Dict
 
-import paho.mqtt.client
-from paho.mqtt.enums import CallbackAPIVersion
-
 
 def _early_select_ble_stack():
     """Install the ESPHome-Proxy bleak shim before bmslib.bt imports bleak.
@@ -42,7 +39,8 @@ import bmslib.mqtt_util
 from bmslib.bms import MIN_VALUE_EXPIRY
 from bmslib.group import BmsGroup, VirtualGroupBms
 from bmslib.models import construct_bms, is_serial_device
-from bmslib.mqtt_util import mqtt_last_publish_time, mqtt_message_handler, mqtt_process_action_queue
+from bmslib.mqtt_util import mqtt_last_publish_time, mqtt_message_handler, mqtt_process_action_queue, \
+    mqtt_connect, mqtt_client_factory
 from bmslib.sampling import BmsSampler, fetch_loop as _fetch_loop
 from bmslib.scan import stop_all_scanners
 from bmslib.store import load_user_config
@@ -89,8 +87,8 @@ def bg_checks(sampler_list, timeout, t_start):
             return False
 
     global t_last_store
-    # store persistent states (metering) every 30s
-    if now - (t_last_store or t_start) > 30:
+    # store persistent states (metering), appended to a journal. each store is a synced write (SD card wear)
+    if now - (t_last_store or t_start) > float(user_config.get('meter_store_interval', 30)):
         t_last_store = now
         try:
             store_states(sampler_list)
@@ -198,6 +196,13 @@ async def main():
                 bmslib.bt.bleak_version(),
                 bmslib.bt.bt_stack_version())
 
+    if user_config.get('record_frames'):
+        # raw frames of every BMS, replay with `address: replay:/data/frames/<name>.bmsrec`
+        import bmslib.recorder
+        from bmslib.store import store_file
+        bmslib.recorder.enable(store_file('frames'))
+        logger.info('Recording BMS frames to %s', store_file('frames'))
+
     names = set()
     dev_args: Dict[str, dict] = {}
 
@@ -251,20 +256,15 @@ async def main():
             user_config.mqtt_port = user_config.get('mqtt_port', int(user_config.mqtt_broker[(port_idx + 1):]))
             user_config.mqtt_broker = user_config.mqtt_broker[:port_idx]
         mqtt_port = int(user_config.get('mqtt_port', None) or 1883)
-        logger.info('connecting mqtt %s@%s:%s', user_config.mqtt_user, user_config.mqtt_broker, mqtt_port)
+        mqtt_v5 = bool(user_config.get('mqtt_v5', False))
+        logger.info('connecting mqtt %s@%s:%s%s', user_config.mqtt_user, user_config.mqtt_broker, mqtt_port,
+                    ' (v5)' if mqtt_v5 else '')
         # paho_monkey_patch()
-        mqtt_client = paho.mqtt.client.Client(CallbackAPIVersion.VERSION2)
-        mqtt_client.enable_logger(logger)
-        if user_config.get('mqtt_user', None):
-            mqtt_client.username_pw_set(user_config.mqtt_user, user_config.mqtt_password)
-
-        mqtt_client.on_message = mqtt_message_handler
-
-        try:
-            mqtt_client.connect(user_config.mqtt_broker, port=mqtt_port)
-            mqtt_client.loop_start()
-        except Exception as ex:
-            logger.error('mqtt connection error %s', ex)
+        mqtt_client = mqtt_connect(
+            mqtt_client_factory(user_config.get('mqtt_user', None), user_config.get('mqtt_password', None),
+                                on_message=mqtt_message_handler),
+            user_config.mqtt_broker, port=mqtt_port, v5=mqtt_v5,
+            message_expiry=float(user_config.get('expire_values_after', MIN_VALUE_EXPIRY)))
 
         if not user_config.mqtt_broker:
             bmslib.mqtt_util.disable_warnings()
@@ -295,6 +295,22 @@ async def main():
         except Exception as e:
             logger.warning('Failed to load influxdb sink: %s', e)
 
+    if user_config.get('questdb_host', None):
+        try:
+            from bmslib.sinks import QuestDBSink
+            sinks.append(QuestDBSink(**{k[8:]: v for k, v in user_config.items() if k.startswith('questdb_')}))
+        except Exception as e:
+            logger.warning('Failed to load questdb sink: %s', e)
+
+    if user_config.get('local_store', False):
+        try:
+            from bmslib.sinks import LocalStoreSink
+            from bmslib.store import store_file
+            store_kwargs = {k[len('local_store_'):]: v for k, v in user_config.items() if k.startswith('local_store_')}
+            sinks.append(LocalStoreSink(directory=store_file('tsdb'), **store_kwargs))
+        except Exception as e:
+            logger.warning('Failed to load local store sink: %s', e)
+
     if user_config.get("telemetry") == False:
         logger.debug(
             "Anonymous telemetry is OFF. If enabled, batmon sends battery "
@@ -311,6 +327,37 @@ async def main():
             pass
             #logger.info("failed to init telemetry", exc_info=True)
 
+    if sinks:
+        # each sink on its own worker thread, so a slow one can't stall sampling
+        from bmslib.dispatch import SinkDispatcher
+        sinks = [SinkDispatcher(sink, max_queue=user_config.get('sink_queue_size', 1000),
+                                policy=user_config.get('sink_overflow', 'drop_oldest')) for sink in sinks]
+
+    # fast: power/current/switches, medium: voltage/SoC/cells, slow: temperatures/meters/statistics
+    publish_tiers = {}
+    for tier in ('fast', 'medium', 'slow'):
+        publish_tiers[tier + '_period'] = user_config.get('publish_period_' + tier, None)
+        publish_tiers[tier + '_aggregate'] = user_config.get('publish_aggregate_' + tier, None)
+
+    # e.g. "60,900": 1 min and 15 min rollups, written to the sinks as batmon_1m, batmon_15m
+    rollups = [float(r) for r in str(user_config.get('rollup_resolutions') or '').split(',') if r.strip()]
+    if any(r <= 0 for r in rollups):
+        logger.warning('rollup_resolutions: ignoring non-positive resolutions %s', [r for r in rollups if r <= 0])
+        rollups = [r for r in rollups if r > 0]
+
+    # integrate the meters of all devices in batch, once per tick
+    fleet = None
+    if user_config.get('fleet_batching', False):
+        from bmslib.pwmath import _numpy
+        if _numpy() is None:
+            logger.warning('fleet_batching needs numpy (pip install numpy), meters are integrated per sample')
+        else:
+            from bmslib.fleet import FleetProcessor
+            fleet = FleetProcessor(dt_max_seconds=max(60. * 10, sample_period * 2))
+
+    from bmslib.store import algorithm_state_store
+    algorithm_state_store.preload(bms.name for bms in bms_list)
+
     sampler_list = [BmsSampler(
         bms, mqtt_client=mqtt_client,
         dt_max_seconds=max(60. * 10, sample_period * 2),
@@ -323,6 +370,11 @@ async def main():
         current_calibration_factor=float(dev_args[bms.name].get('current_calibration', 1.0)),
         bms_group=groups_by_bms.get(bms.name),
         sinks=sinks,
+        hass_discovery=user_config.get('hass_discovery', 'entity'),
+        mqtt_binary=user_config.get('mqtt_binary', False),
+        publish_tiers=publish_tiers,
+        rollups=rollups,
+        fleet=fleet,
     ) for bms in bms_list]
 
     # move groups to the end
@@ -369,6 +421,11 @@ async def main():
         # this outer while loop recovers from a cancelled task. this happens when a device disconnects (bleak bug?)
         while not shutdown:
             loops = [asyncio.create_task(fetch_loop(fn, period=sample_period, max_errors=max_errors)) for fn in tasks]
+            if fleet:
+                async def flush_fleet():
+                    fleet.flush()
+
+                loops.append(asyncio.create_task(fetch_loop(flush_fleet, period=sample_period, max_errors=0)))
             done, pending = await asyncio.wait(loops, return_when='FIRST_COMPLETED')
 
             logger.debug('Done= %s, Pending=%s', done, pending)
@@ -390,6 +447,8 @@ async def main():
                         await t()
                     except Exception as ex:
                         exceptions.append(ex)
+                if fleet:
+                    fleet.flush()
                 if exceptions:
                     logger.error('%d exceptions occurred fetching BMSs', len(exceptions))
                     raise exceptions[0]
@@ -403,7 +462,10 @@ async def main():
 
     shutdown = True
 
+    if fleet:
+        fleet.flush()
     store_states(sampler_list)
+    algorithm_state_store.flush()
 
     for sink in sinks:
         try: